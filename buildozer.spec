@@ -8,10 +8,12 @@ source.exclude_dirs = tests, bin, ios, web
 
 # ИСПРАВЛЕНО: убрали запятую в конце и добавили xml
 source.include_patterns = saved_sounds/*,android/res/*
+# Скрипт сборки манифеста встроенных звуков в APK не нужен
+source.exclude_patterns = make_sound_manifest.py
 
 version = 1.3.1
 android.version_code = 10300
-requirements = python3,kivy,requests,openssl,android,androidstorage4kivy
+requirements = python3,kivy,requests,openssl,sqlite3,numpy,android,androidstorage4kivy
 orientation = portrait
 fullscreen = 0
 
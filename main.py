@@ -1,165 +1,3365 @@
 from kivy.app import App
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.scrollview import ScrollView
+from kivy.uix.recycleview import RecycleView
+from kivy.uix.recycleview.views import RecycleDataViewBehavior
+from kivy.uix.recycleboxlayout import RecycleBoxLayout
 from kivy.uix.button import Button
 from kivy.uix.textinput import TextInput
 from kivy.uix.image import Image
-from kivy.core.audio import SoundLoader
+from kivy.uix.widget import Widget
+from kivy.core.audio import SoundLoader, Sound
 from kivy.core.window import Window
 from kivy.animation import Animation
 from kivy.clock import Clock
-from kivy.graphics import Color, RoundedRectangle
+from kivy.graphics import Color, RoundedRectangle, Mesh
 from kivy.uix.popup import Popup
 from kivy.uix.label import Label
+from kivy.uix.progressbar import ProgressBar
 import os
 import requests
+from requests.adapters import HTTPAdapter
 import webbrowser
 import json
+import re
 import shutil
+import threading
+import queue
+import sqlite3
+import time
+import random
+import heapq
+import bisect
+import hashlib
+import functools
+import struct
+import subprocess
+import wave
+from array import array
 from kivy.utils import platform
-from urllib.parse import urlparse
+from urllib.parse import urlparse, unquote
+from collections import OrderedDict
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 if platform == 'android':
     from android.permissions import request_permissions, check_permission, Permission
     from android.storage import app_storage_path
     from jnius import autoclass, cast
 
+
+def java_thread(target):
+    """Для функций фоновых потоков: на Android поток, который мог обращаться
+    к Java (MediaCodec, MediaPlayer, SoundLoader), отсоединяется от JVM при выходе"""
+    if platform != 'android':
+        return target
+    
+    @functools.wraps(target)
+    def run(*args, **kwargs):
+        try:
+            return target(*args, **kwargs)
+        finally:
+            from jnius import detach
+            detach()
+    return run
+
+# -------------------------
+# Sound Cache Class
+# -------------------------
+# SDL2-бэкенд Kivy декодирует звук целиком в 16-битный стерео PCM 44.1 кГц
+DECODED_BYTES_PER_SECOND = 44100 * 2 * 2
+# Во сколько раз декодированный mp3/ogg больше файла, если длина неизвестна
+COMPRESSED_AUDIO_RATIO = 11
+
+
+def estimate_sound_bytes(sound, path=None):
+    """Оценивает объем памяти, занимаемый декодированным звуком"""
+    length = getattr(sound, 'length', 0) or 0
+    if length > 0:
+        return int(length * DECODED_BYTES_PER_SECOND)
+    try:
+        file_size = os.path.getsize(path) if path else 0
+    except OSError:
+        file_size = 0
+    if path and path.lower().endswith('.wav'):
+        return file_size
+    return file_size * COMPRESSED_AUDIO_RATIO
+
+
+class SoundCache:
+    def __init__(self, max_bytes=24 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        # path -> (sound, size); порядок ключей - порядок LRU (в конце самый свежий)
+        self.cache = OrderedDict()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get_sound(self, path):
+        item = self.cache.get(path)
+        if item is not None:
+            # Перемещаем в конец (самый недавний)
+            self.cache.move_to_end(path)
+            self.hits += 1
+            print(f"Sound cache hit: {os.path.basename(path)}")
+            return item[0]
+        self.misses += 1
+        print(f"Sound cache miss: {os.path.basename(path)}")
+        return None
+    
+    def add_sound(self, path, sound, size=None):
+        if size is None:
+            size = estimate_sound_bytes(sound, path)
+        if path in self.cache:
+            self.remove(path, unload=False)
+        
+        # Вытесняем самые старые, пока новый звук не поместится в бюджет.
+        # Играющие сейчас звуки не выгружаем - они переносятся в конец очереди
+        skipped = 0
+        while len(self.cache) > skipped and self.current_bytes + size > self.max_bytes:
+            oldest, (old_sound, old_size) = next(iter(self.cache.items()))
+            if getattr(old_sound, 'state', None) == 'play':
+                self.cache.move_to_end(oldest)
+                skipped += 1
+                continue
+            del self.cache[oldest]
+            self.current_bytes -= old_size
+            self.evictions += 1
+            print(f"Removing from cache: {os.path.basename(oldest)}")
+            if hasattr(old_sound, 'unload'):
+                old_sound.unload()
+        
+        self.cache[path] = (sound, size)
+        self.current_bytes += size
+        print(f"Added to cache: {os.path.basename(path)} "
+              f"(cache: {len(self.cache)} sounds, {self.current_bytes // 1024}KB)")
+    
+    def load_sound(self, path):
+        """Возвращает звук из кэша, при промахе декодирует файл"""
+        sound = self.get_sound(path)
+        if sound is None:
+            sound = SoundLoader.load(path)
+            if sound:
+                self.add_sound(path, sound)
+            else:
+                print(f"Failed to load sound: {os.path.basename(path)}")
+        return sound
+    
+    def remove(self, path, unload=True):
+        """Удаляет звук из кэша"""
+        item = self.cache.pop(path, None)
+        if item is None:
+            return False
+        sound, size = item
+        self.current_bytes -= size
+        if unload and hasattr(sound, 'unload'):
+            sound.unload()
+        print(f"Removed from cache: {os.path.basename(path)}")
+        return True
+    
+    def get_stats(self):
+        """Возвращает счетчики кэша для отладочной информации"""
+        lookups = self.hits + self.misses
+        return {
+            'sounds': len(self.cache),
+            'bytes': self.current_bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': (self.hits / lookups) if lookups else 0.0
+        }
+    
+    def clear_cache(self):
+        """Очищает кэш"""
+        for sound, size in self.cache.values():
+            if hasattr(sound, 'unload'):
+                sound.unload()
+        self.cache.clear()
+        self.current_bytes = 0
+        print("Sound cache cleared")
+
+# -------------------------
+# Sound Preloader Class
+# -------------------------
+class SoundPreloader:
+    """Прогревает кэш звуками, которые вероятнее всего проиграют следующими.
+
+    Вероятность оценивается по числу проигрываний с затуханием по давности,
+    декодирование идет в фоновом потоке и занимает не больше доли бюджета кэша.
+    """
+    PRELOAD_COUNT = 8
+    BUDGET_SHARE = 0.5
+    HALF_LIFE_HOURS = 72.0
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.cancel_event = None
+        self.preloaded = 0
+
+    @classmethod
+    def usage_score(cls, entry, now):
+        """Частота проигрываний, затухающая вдвое каждые HALF_LIFE_HOURS"""
+        if not entry.play_count:
+            return 0.0
+        age_hours = max(0.0, now - entry.last_played) / 3600.0
+        return entry.play_count * 0.5 ** (age_hours / cls.HALF_LIFE_HOURS)
+
+    def start(self, entries):
+        """Выбирает кандидатов и запускает фоновую предзагрузку"""
+        self.cancel()
+        now = time.time()
+        scored = [(self.usage_score(entry, now), entry) for entry in entries if entry.play_count]
+        scored.sort(key=lambda item: item[0], reverse=True)
+        
+        budget = self.cache.max_bytes * self.BUDGET_SHARE
+        candidates = []
+        for score, entry in scored[:self.PRELOAD_COUNT]:
+            if entry.path in self.cache.cache:
+                continue
+            if entry.duration:
+                size = int(entry.duration * DECODED_BYTES_PER_SECOND)
+            else:
+                size = estimate_sound_bytes(None, entry.path)
+            if size > budget:
+                continue
+            budget -= size
+            candidates.append(entry.path)
+        
+        if not candidates:
+            return
+        print(f"Preloading {len(candidates)} most played sounds...")
+        self.cancel_event = threading.Event()
+        threading.Thread(target=self._preload, args=(candidates, self.cancel_event),
+                         daemon=True).start()
+
+    def cancel(self):
+        if self.cancel_event:
+            self.cancel_event.set()
+            self.cancel_event = None
+
+    @java_thread
+    def _preload(self, paths, cancel_event):
+        """Фоновый поток: декодирует звуки и передает их главному потоку"""
+        for path in paths:
+            if cancel_event.is_set():
+                return
+            try:
+                sound = SoundLoader.load(path)
+            except Exception as e:
+                print(f"Error preloading {os.path.basename(path)}: {e}")
+                continue
+            if sound:
+                Clock.schedule_once(lambda dt, p=path, s=sound: self._commit(p, s, cancel_event))
+
+    def _commit(self, path, sound, cancel_event):
+        """Главный поток: кладет звук в кэш, не вытесняя уже загруженные"""
+        size = estimate_sound_bytes(sound, path)
+        if cancel_event.is_set() or path in self.cache.cache or \
+                self.cache.current_bytes + size > self.cache.max_bytes:
+            sound.unload()
+            return
+        self.cache.add_sound(path, sound, size)
+        self.preloaded += 1
+
+# -------------------------
+# Playback Monitor Class
+# -------------------------
+class PlaybackMonitor:
+    """Общий наблюдатель за окончанием воспроизведения.
+
+    Все звуки (и SoundLoader, и InstantSound) - это Sound Kivy, которые
+    сообщают об остановке событием on_stop; опрос таймером не нужен.
+    """
+    def __init__(self):
+        self.watched = {}  # звук -> (callback, uid подписки)
+
+    def watch(self, sound, callback):
+        """callback(sound) вызывается в главном потоке, когда звук остановится"""
+        self.unwatch(sound)
+        uid = sound.fbind('on_stop', self._on_sound_stop)
+        self.watched[sound] = (callback, uid)
+
+    def unwatch(self, sound):
+        watch = self.watched.pop(sound, None)
+        if watch:
+            sound.unbind_uid('on_stop', watch[1])
+
+    def _on_sound_stop(self, sound):
+        # Android сообщает о завершении из Java-потока
+        if threading.current_thread() is threading.main_thread():
+            self._finish(sound)
+        else:
+            Clock.schedule_once(lambda dt: self._finish(sound))
+
+    def _finish(self, sound):
+        watch = self.watched.get(sound)
+        if watch is None:
+            return
+        self.unwatch(sound)
+        try:
+            watch[0](sound)
+        except Exception as e:
+            print(f"Error in playback callback: {e}")
+
+# -------------------------
+# Voice Pool Class
+# -------------------------
+class Voice:
+    """Один играющий экземпляр звука"""
+    def __init__(self, sound, path, volume, on_finished=None):
+        self.sound = sound
+        self.path = path
+        self.volume = volume
+        self.on_finished = on_finished
+        self.started_at = time.monotonic()
+        self.stop_event = None  # Остановка перед тишиной в конце звука
+
+
+class VoicePool:
+    """Полифоническое воспроизведение: до max_voices звуков одновременно.
+
+    Основной экземпляр звука берется из SoundCache. Для повторного запуска
+    уже играющего звука в фоне готовится копия, так что следующий тап
+    получает свободный голос без декодирования. Пока копии нет, перезапускается
+    самый старый голос того же звука. Когда голоса кончаются, вытесняется
+    самый старый или самый тихий. В режиме exclusive играет только один звук.
+    """
+    STEAL_MODES = ('oldest', 'quietest')
+    MAX_VOICES = 16
+    CLONE_MAX_BYTES = 8 * 1024 * 1024  # Бюджет памяти на копии звуков
+
+    def __init__(self, monitor, max_voices=8, steal_mode='oldest', exclusive=False):
+        self.monitor = monitor
+        self.max_voices = max_voices
+        self.steal_mode = steal_mode
+        self.exclusive = exclusive
+        self.voices = []  # Активные голоса в порядке запуска
+        self.clones = {}  # path -> список копий звука (свободных и играющих)
+        self.clone_bytes = 0
+        self.steals = 0
+        self._warming = set()
+
+    def configure(self, max_voices=None, steal_mode=None, exclusive=None):
+        if max_voices is not None:
+            self.max_voices = max(1, min(int(max_voices), self.MAX_VOICES))
+        if steal_mode in self.STEAL_MODES:
+            self.steal_mode = steal_mode
+        if exclusive is not None:
+            self.exclusive = bool(exclusive)
+
+    SEEK_TOLERANCE = 0.05  # Насколько get_pos после перемотки может отставать от цели
+
+    def play(self, sound, path, volume=1.0, on_finished=None, start=0.0, tail=0.0):
+        """Запускает звук на свободном голосе и возвращает играющий экземпляр.
+        sound - основной экземпляр из кэша, on_finished(sound) вызывается по окончании,
+        start - с какой секунды начинать, tail - сколько секунд в конце не играть
+        (пропуск тишины)"""
+        if self.exclusive:
+            # Прежнее поведение: один голос, звук перезапускается с начала
+            self.stop_all()
+        
+        busy = {id(voice.sound) for voice in self.voices}
+        instance = None
+        for candidate in [sound] + self.clones.get(path, []):
+            if id(candidate) not in busy:
+                instance = candidate
+                break
+        if instance is None:
+            # Свободной копии еще нет - перезапускаем самый старый голос этого звука
+            voice = next(voice for voice in self.voices if voice.path == path)
+            self.stop_voice(voice)
+            instance = voice.sound
+        
+        while len(self.voices) >= self.max_voices:
+            self.steal_voice()
+        
+        voice = Voice(instance, path, volume, on_finished)
+        self.voices.append(voice)
+        instance.volume = volume
+        instance.stop()
+        if hasattr(instance, 'start_offset'):
+            instance.start_offset = start
+            instance.play()
+        else:
+            instance.play()
+            if start > 0:
+                instance.seek(start)
+                # SDL2 не перематывает загруженные целиком звуки (seek ничего не
+                # делает, get_pos возвращает 0) - тогда звук играет с начала
+                if instance.get_pos() < start - self.SEEK_TOLERANCE:
+                    start = 0.0
+        self.monitor.watch(instance, self._on_voice_stopped)
+        remaining = (instance.length or 0) - tail - start
+        if tail > 0 and remaining > 0:
+            voice.stop_event = Clock.schedule_once(lambda dt: self.stop_voice(voice), remaining)
+        
+        if not self.exclusive:
+            self._warm(sound, path)
+        return instance
+
+    def steal_voice(self):
+        """Освобождает голос: самый старый или самый тихий"""
+        if self.steal_mode == 'quietest':
+            victim = min(self.voices, key=lambda voice: (voice.volume, voice.started_at))
+        else:
+            victim = self.voices[0]
+        self.steals += 1
+        print(f"Voice stolen: {os.path.basename(victim.path)}")
+        self.stop_voice(victim)
+
+    def stop_voice(self, voice, notify=True):
+        """Останавливает голос; владелец узнает об этом через on_finished"""
+        if voice not in self.voices:
+            return
+        self.voices.remove(voice)
+        if voice.stop_event is not None:
+            voice.stop_event.cancel()
+        self.monitor.unwatch(voice.sound)
+        voice.sound.stop()
+        if notify and voice.on_finished:
+            voice.on_finished(voice.sound)
+
+    def stop_sound(self, sound):
+        """Останавливает все голоса, играющие этот экземпляр"""
+        for voice in [voice for voice in self.voices if voice.sound is sound]:
+            self.stop_voice(voice, notify=False)
+
+    def stop_all(self):
+        for voice in self.voices[:]:
+            self.stop_voice(voice)
+
+    def set_volume(self, sound, volume):
+        for voice in self.voices:
+            if voice.sound is sound:
+                voice.volume = volume
+                sound.volume = volume
+
+    def active_count(self):
+        return len(self.voices)
+
+    def _on_voice_stopped(self, sound):
+        for voice in self.voices:
+            if voice.sound is sound:
+                self.voices.remove(voice)
+                if voice.stop_event is not None:
+                    voice.stop_event.cancel()
+                if voice.on_finished:
+                    voice.on_finished(sound)
+                return
+
+    def _warm(self, sound, path):
+        """Готовит в фоне копию звука, если свободных экземпляров не осталось"""
+        copies = self.clones.get(path, [])
+        busy = {id(voice.sound) for voice in self.voices}
+        if path in self._warming or len(copies) + 1 >= self.max_voices:
+            return
+        if any(id(candidate) not in busy for candidate in [sound] + copies):
+            return
+        if self.clone_bytes + estimate_sound_bytes(sound, path) > self.CLONE_MAX_BYTES:
+            return
+        self._warming.add(path)
+        threading.Thread(target=self._load_clone, args=(sound, path), daemon=True).start()
+
+    @java_thread
+    def _load_clone(self, sound, path):
+        """Фоновый поток: декодирует еще один экземпляр звука"""
+        try:
+            # PCM-звуки режима instant копируются без декодирования
+            clone = sound.clone() if hasattr(sound, 'clone') else SoundLoader.load(path)
+        except Exception as e:
+            print(f"Error loading voice for {os.path.basename(path)}: {e}")
+            clone = None
+        Clock.schedule_once(lambda dt: self._add_clone(path, clone))
+
+    def _add_clone(self, path, clone):
+        if path not in self._warming:
+            # Звук удален или пул очищен, пока шла загрузка
+            if clone:
+                clone.unload()
+            return
+        self._warming.discard(path)
+        if clone:
+            self.clones.setdefault(path, []).append(clone)
+            self.clone_bytes += estimate_sound_bytes(clone, path)
+
+    def forget(self, path):
+        """Останавливает и выгружает все экземпляры звука (файл удален или изменен)"""
+        for voice in [voice for voice in self.voices if voice.path == path]:
+            self.stop_voice(voice)
+        self._warming.discard(path)
+        for clone in self.clones.pop(path, []):
+            self.clone_bytes -= estimate_sound_bytes(clone, path)
+            clone.unload()
+
+    def forget_clones(self, path, kind):
+        """Выгружает копии звука класса kind (PCM-копии, когда instant выключен
+        или клип вытеснен); обычные копии остаются"""
+        clones = self.clones.get(path, [])
+        for clone in [clone for clone in clones if isinstance(clone, kind)]:
+            for voice in [voice for voice in self.voices if voice.sound is clone]:
+                self.stop_voice(voice)
+            clones.remove(clone)
+            self.clone_bytes -= estimate_sound_bytes(clone, path)
+            clone.unload()
+        if not clones:
+            self.clones.pop(path, None)
+        # Копия, которая еще готовится, будет выгружена в _add_clone
+        self._warming.discard(path)
+
+    def clear(self):
+        for path in list(self.clones) + list(self._warming):
+            self.forget(path)
+        self.stop_all()
+        self.clone_bytes = 0
+
+# -------------------------
+# Instant Playback Classes
+# -------------------------
+class PcmClip:
+    """Декодированный звук: 16-битные сэмплы в компактном array('h')"""
+    def __init__(self, path, samples, rate, channels):
+        self.path = path
+        self.samples = samples
+        self.rate = rate
+        self.channels = channels
+
+    @property
+    def frames(self):
+        return len(self.samples) // self.channels
+
+    @property
+    def nbytes(self):
+        return len(self.samples) * self.samples.itemsize
+
+
+def decode_pcm(path):
+    """Декодирует файл в PcmClip: wav - модулем wave, остальное - MediaCodec
+    на Android или ffmpeg, если он установлен"""
+    if path.lower().endswith('.wav'):
+        with wave.open(path, 'rb') as wav:
+            if wav.getsampwidth() != 2:
+                return None
+            samples = array('h')
+            samples.frombytes(wav.readframes(wav.getnframes()))
+            return PcmClip(path, samples, wav.getframerate(), wav.getnchannels())
+    if platform == 'android':
+        return decode_pcm_android(path)
+    if shutil.which('ffmpeg'):
+        return decode_pcm_ffmpeg(path)
+    return None
+
+
+def decode_pcm_ffmpeg(path, rate=44100, channels=2):
+    """Декодирует звук в 16-битный PCM через ffmpeg"""
+    result = subprocess.run(
+        ['ffmpeg', '-v', 'error', '-i', path, '-vn', '-f', 's16le', '-acodec', 'pcm_s16le',
+         '-ac', str(channels), '-ar', str(rate), '-'],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=60)
+    if result.returncode != 0:
+        return None
+    samples = array('h')
+    samples.frombytes(result.stdout[:len(result.stdout) // 2 * 2])
+    return PcmClip(path, samples, rate, channels)
+
+
+def decode_pcm_android(path):
+    """Декодирует сжатый звук через MediaExtractor и MediaCodec"""
+    MediaExtractor = autoclass('android.media.MediaExtractor')
+    MediaCodec = autoclass('android.media.MediaCodec')
+    MediaFormat = autoclass('android.media.MediaFormat')
+    BufferInfo = autoclass('android.media.MediaCodec$BufferInfo')
+    
+    extractor = MediaExtractor()
+    extractor.setDataSource(path)
+    audio_format = None
+    for index in range(extractor.getTrackCount()):
+        track_format = extractor.getTrackFormat(index)
+        if track_format.getString(MediaFormat.KEY_MIME).startswith('audio/'):
+            extractor.selectTrack(index)
+            audio_format = track_format
+            break
+    if audio_format is None:
+        extractor.release()
+        return None
+    
+    rate = audio_format.getInteger(MediaFormat.KEY_SAMPLE_RATE)
+    channels = audio_format.getInteger(MediaFormat.KEY_CHANNEL_COUNT)
+    codec = MediaCodec.createDecoderByType(audio_format.getString(MediaFormat.KEY_MIME))
+    codec.configure(audio_format, None, None, 0)
+    codec.start()
+    
+    samples = array('h')
+    # Один буфер на весь разбор; pyjnius передает bytearray как byte[]
+    # и копирует содержимое обратно после вызова, как в JavaStreamSource
+    chunk = bytearray()
+    info = BufferInfo()
+    input_done = False
+    try:
+        while True:
+            if not input_done:
+                in_index = codec.dequeueInputBuffer(10000)
+                if in_index >= 0:
+                    size = extractor.readSampleData(codec.getInputBuffer(in_index), 0)
+                    if size < 0:
+                        codec.queueInputBuffer(in_index, 0, 0, 0, MediaCodec.BUFFER_FLAG_END_OF_STREAM)
+                        input_done = True
+                    else:
+                        codec.queueInputBuffer(in_index, 0, size, extractor.getSampleTime(), 0)
+                        extractor.advance()
+            
+            out_index = codec.dequeueOutputBuffer(info, 10000)
+            if out_index == MediaCodec.INFO_OUTPUT_FORMAT_CHANGED:
+                output_format = codec.getOutputFormat()
+                rate = output_format.getInteger(MediaFormat.KEY_SAMPLE_RATE)
+                channels = output_format.getInteger(MediaFormat.KEY_CHANNEL_COUNT)
+            elif out_index >= 0:
+                if info.size > 0:
+                    if len(chunk) < info.size:
+                        chunk = bytearray(info.size)
+                    output = codec.getOutputBuffer(out_index)
+                    output.position(info.offset)
+                    output.get(chunk, 0, info.size)
+                    samples.frombytes(memoryview(chunk)[:info.size])
+                codec.releaseOutputBuffer(out_index, False)
+                if info.flags & MediaCodec.BUFFER_FLAG_END_OF_STREAM:
+                    break
+    finally:
+        codec.stop()
+        codec.release()
+        extractor.release()
+    return PcmClip(path, samples, rate, channels)
+
+
+if platform == 'android':
+    from jnius import PythonJavaClass, java_method
+
+    class TrackMarkerListener(PythonJavaClass):
+        """Сообщает о достижении маркера AudioTrack (конец звука)"""
+        __javainterfaces__ = ['android/media/AudioTrack$OnPlaybackPositionUpdateListener']
+        __javacontext__ = 'app'
+
+        def __init__(self, callback, **kwargs):
+            super().__init__(**kwargs)
+            self.callback = callback
+
+        @java_method('(Landroid/media/AudioTrack;)V')
+        def onMarkerReached(self, track):
+            self.callback()
+
+        @java_method('(Landroid/media/AudioTrack;)V')
+        def onPeriodicNotification(self, track):
+            pass
+
+
+def create_audio_track(clip, looping=False):
+    """Создает статический AudioTrack с PCM клипа"""
+    AudioTrack = autoclass('android.media.AudioTrack')
+    AudioFormat = autoclass('android.media.AudioFormat')
+    AudioManager = autoclass('android.media.AudioManager')
+    channel_mask = AudioFormat.CHANNEL_OUT_STEREO if clip.channels == 2 else AudioFormat.CHANNEL_OUT_MONO
+    track = AudioTrack(AudioManager.STREAM_MUSIC, clip.rate, channel_mask,
+                       AudioFormat.ENCODING_PCM_16BIT, clip.nbytes, AudioTrack.MODE_STATIC)
+    track.write(clip.samples.tobytes(), 0, clip.nbytes)
+    if looping:
+        track.setLoopPoints(0, clip.frames, -1)
+    return track
+
+
+class InstantSound(Sound):
+    """Звук, играющий из PCM в памяти через AudioTrack: перезапуск - это
+    только перемотка позиции, без повторной буферизации файла"""
+    def __init__(self, clip, **kwargs):
+        self.clip = clip
+        self.start_offset = 0.0
+        self._track = None
+        self._listener = None
+        # Трек создается в load() из on_source
+        super().__init__(source=clip.path, **kwargs)
+
+    def load(self):
+        self.unload()
+        self._track = create_audio_track(self.clip)
+        self._listener = TrackMarkerListener(self._on_track_end)
+        self._track.setPlaybackPositionUpdateListener(self._listener)
+
+    def unload(self):
+        if self._track:
+            self._track.release()
+            self._track = None
+
+    def clone(self):
+        """Еще один голос с тем же PCM - без декодирования"""
+        return InstantSound(self.clip)
+
+    def play(self):
+        if not self._track:
+            return
+        # Статический трек, доигравший до конца, остается в PLAYSTATE_PLAYING,
+        # а позицию можно менять только у остановленного - ставим паузу всегда
+        self._track.pause()
+        start_frame = min(int(self.start_offset * self.clip.rate), self.clip.frames - 1)
+        self._track.setPlaybackHeadPosition(max(0, start_frame))
+        self._track.setNotificationMarkerPosition(max(1, self.clip.frames - 1))
+        self._track.setVolume(float(self.volume))
+        self._track.play()
+        super().play()
+
+    def stop(self):
+        if self._track:
+            self._track.pause()
+            self._track.setPlaybackHeadPosition(0)
+        super().stop()
+
+    def _on_track_end(self):
+        # Вызывается из потока Android, PlaybackMonitor переносит событие в главный поток
+        if self.state == 'play':
+            super().stop()
+
+    def get_pos(self):
+        if self._track and self.state == 'play':
+            return self._track.getPlaybackHeadPosition() / float(self.clip.rate)
+        return 0
+
+    def _get_length(self):
+        return self.clip.frames / float(self.clip.rate)
+
+    def on_volume(self, instance, volume):
+        if self._track:
+            self._track.setVolume(float(volume))
+
+    def seek(self, position):
+        pass
+
+
+class InstantAudio:
+    """Режим instant: часто играемые звуки держатся в памяти как PCM,
+    а аудиовыход остается прогретым между тапами.
+
+    Работает через AudioTrack на Android. На остальных платформах
+    SDL2-бэкенд Kivy и так играет из памяти, поэтому режим недоступен.
+    """
+    available = platform == 'android'
+    MAX_BYTES = 16 * 1024 * 1024
+    WARM_SECONDS = 30  # Сколько держать выход открытым после последнего тапа
+
+    def __init__(self, voice_pool):
+        self.voice_pool = voice_pool  # Держит копии PCM-звуков для полифонии
+        self.enabled = False
+        self.sounds = OrderedDict()  # path -> InstantSound, порядок LRU
+        self.current_bytes = 0
+        self._decoding = set()
+        self._warm_track = None
+        self._cool_trigger = Clock.create_trigger(self.cool_down, self.WARM_SECONDS)
+
+    def set_enabled(self, enabled):
+        self.enabled = bool(enabled) and self.available
+        if not self.enabled:
+            self.clear()
+
+    def get_sound(self, path):
+        """Возвращает PCM-звук или None; при промахе запускает фоновое декодирование"""
+        if not self.enabled:
+            return None
+        self.keep_warm()
+        sound = self.sounds.get(path)
+        if sound is not None:
+            self.sounds.move_to_end(path)
+            return sound
+        if path not in self._decoding:
+            self._decoding.add(path)
+            threading.Thread(target=self._decode, args=(path,), daemon=True).start()
+        return None
+
+    @java_thread
+    def _decode(self, path):
+        """Фоновый поток: декодирует звук в PCM"""
+        try:
+            clip = decode_pcm(path)
+        except Exception as e:
+            print(f"Error decoding PCM for {os.path.basename(path)}: {e}")
+            clip = None
+        Clock.schedule_once(lambda dt: self._commit(path, clip))
+
+    def _commit(self, path, clip):
+        if path not in self._decoding:
+            return
+        self._decoding.discard(path)
+        if clip is None or not self.enabled or clip.nbytes > self.MAX_BYTES:
+            return
+        # Вытесняем самые старые неиграющие клипы
+        for old_path in list(self.sounds):
+            if self.current_bytes + clip.nbytes <= self.MAX_BYTES:
+                break
+            if self.sounds[old_path].state != 'play':
+                self.forget(old_path)
+        if self.current_bytes + clip.nbytes > self.MAX_BYTES:
+            return
+        try:
+            self.sounds[path] = InstantSound(clip)
+        except Exception as e:
+            print(f"Error creating instant sound: {e}")
+            return
+        self.current_bytes += clip.nbytes
+        print(f"Instant PCM ready: {os.path.basename(path)} ({clip.nbytes // 1024}KB)")
+
+    def keep_warm(self):
+        """Держит аудиовыход открытым, проигрывая тишину по кругу"""
+        if self._warm_track is None:
+            try:
+                silence = PcmClip(None, array('h', bytes(4096)), 44100, 1)
+                self._warm_track = create_audio_track(silence, looping=True)
+                self._warm_track.setVolume(0.0)
+                self._warm_track.play()
+            except Exception as e:
+                print(f"Error warming audio output: {e}")
+                self._warm_track = None
+        self._cool_trigger()
+
+    def cool_down(self, *args):
+        """Закрывает прогретый выход (простой или пауза приложения)"""
+        self._cool_trigger.cancel()
+        if self._warm_track is not None:
+            self._warm_track.stop()
+            self._warm_track.release()
+            self._warm_track = None
+
+    def forget(self, path):
+        self._decoding.discard(path)
+        sound = self.sounds.pop(path, None)
+        if sound is not None:
+            self.current_bytes -= sound.clip.nbytes
+            sound.stop()
+            sound.unload()
+            self.voice_pool.forget_clones(path, InstantSound)
+
+    def clear(self):
+        for path in list(self.sounds):
+            self.forget(path)
+        self._decoding.clear()
+        self.cool_down()
+
+# -------------------------
+# Latency Probe Class
+# -------------------------
+class LatencyProbe:
+    """Замеряет задержку от касания до первого сэмпла.
+
+    Момент первого сэмпла оценивается как (сейчас - позиция воспроизведения),
+    позиция опрашивается каждый кадр только пока есть незавершенные замеры.
+    Бэкенды, не сообщающие позицию, в статистику не попадают.
+    """
+    MAX_SAMPLES = 50
+    TIMEOUT = 1.0
+
+    def __init__(self):
+        self.enabled = False
+        self.samples = {}  # вид воспроизведения -> список задержек в секундах
+        self._pending = []
+        self._event = None
+
+    def begin(self, sound, touch_time, kind):
+        if not self.enabled:
+            return
+        self._pending.append((sound, touch_time, kind))
+        if self._event is None:
+            self._event = Clock.schedule_interval(self._poll, 0)
+
+    def _poll(self, dt):
+        now = time.time()
+        for item in self._pending[:]:
+            sound, touch_time, kind = item
+            position = sound.get_pos() if sound.state == 'play' else 0
+            if position > 0:
+                self._pending.remove(item)
+                latency = max(0.0, now - position - touch_time)
+                samples = self.samples.setdefault(kind, [])
+                samples.append(latency)
+                del samples[:-self.MAX_SAMPLES]
+            elif now - touch_time > self.TIMEOUT:
+                self._pending.remove(item)
+        if not self._pending:
+            self._event = None
+            return False
+        return True
+
+    def report(self):
+        """Строка с медианой и p95 задержки для каждого вида воспроизведения"""
+        if not self.samples:
+            return "no data"
+        parts = []
+        for kind, samples in sorted(self.samples.items()):
+            ordered = sorted(samples)
+            median = ordered[len(ordered) // 2] * 1000
+            p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000
+            parts.append(f"{kind} {median:.0f}/{p95:.0f} ms (n={len(ordered)})")
+        return ", ".join(parts)
+
+# -------------------------
+# Import Transcoder Class
+# -------------------------
+def encode_with_ffmpeg(src_path, dst_path, bitrate_kbps):
+    """Кодирует звук в моно Ogg Vorbis через ffmpeg"""
+    result = subprocess.run(
+        ['ffmpeg', '-v', 'error', '-y', '-i', src_path, '-vn', '-ac', '1',
+         '-c:a', 'libvorbis', '-b:a', f'{bitrate_kbps}k', dst_path],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=120)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.decode('utf-8', 'replace').strip())
+
+
+def encode_with_mediacodec(src_path, dst_path, bitrate_kbps):
+    """Кодирует звук в моно AAC (.m4a) через MediaCodec и MediaMuxer"""
+    clip = decode_pcm(src_path)
+    if clip is None:
+        raise RuntimeError("Cannot decode source")
+    samples = clip.samples
+    if clip.channels == 2:
+        # Сводим в моно: для коротких мемов стерео почти ничего не дает
+        samples = array('h', ((left + right) >> 1 for left, right in zip(samples[0::2], samples[1::2])))
+    pcm = samples.tobytes()
+    
+    MediaCodec = autoclass('android.media.MediaCodec')
+    MediaFormat = autoclass('android.media.MediaFormat')
+    MediaMuxer = autoclass('android.media.MediaMuxer')
+    OutputFormat = autoclass('android.media.MediaMuxer$OutputFormat')
+    CodecProfileLevel = autoclass('android.media.MediaCodecInfo$CodecProfileLevel')
+    BufferInfo = autoclass('android.media.MediaCodec$BufferInfo')
+    
+    audio_format = MediaFormat.createAudioFormat('audio/mp4a-latm', clip.rate, 1)
+    audio_format.setInteger(MediaFormat.KEY_AAC_PROFILE, CodecProfileLevel.AACObjectLC)
+    audio_format.setInteger(MediaFormat.KEY_BIT_RATE, bitrate_kbps * 1000)
+    codec = MediaCodec.createEncoderByType('audio/mp4a-latm')
+    codec.configure(audio_format, None, None, MediaCodec.CONFIGURE_FLAG_ENCODE)
+    codec.start()
+    muxer = MediaMuxer(dst_path, OutputFormat.MUXER_OUTPUT_MPEG_4)
+    
+    info = BufferInfo()
+    offset = 0
+    track = -1
+    input_done = False
+    try:
+        while True:
+            if not input_done:
+                in_index = codec.dequeueInputBuffer(10000)
+                if in_index >= 0:
+                    buffer = codec.getInputBuffer(in_index)
+                    buffer.clear()
+                    size = min(buffer.remaining(), len(pcm) - offset)
+                    pts = offset // 2 * 1000000 // clip.rate
+                    if size <= 0:
+                        codec.queueInputBuffer(in_index, 0, 0, pts, MediaCodec.BUFFER_FLAG_END_OF_STREAM)
+                        input_done = True
+                    else:
+                        buffer.put(pcm[offset:offset + size])
+                        codec.queueInputBuffer(in_index, 0, size, pts, 0)
+                        offset += size
+            
+            out_index = codec.dequeueOutputBuffer(info, 10000)
+            if out_index == MediaCodec.INFO_OUTPUT_FORMAT_CHANGED:
+                track = muxer.addTrack(codec.getOutputFormat())
+                muxer.start()
+            elif out_index >= 0:
+                is_config = info.flags & MediaCodec.BUFFER_FLAG_CODEC_CONFIG
+                if info.size > 0 and track >= 0 and not is_config:
+                    muxer.writeSampleData(track, codec.getOutputBuffer(out_index), info)
+                codec.releaseOutputBuffer(out_index, False)
+                if info.flags & MediaCodec.BUFFER_FLAG_END_OF_STREAM:
+                    break
+    finally:
+        codec.stop()
+        codec.release()
+        if track >= 0:
+            muxer.stop()
+        muxer.release()
+
+
+class ImportTranscoder:
+    """Фоновое перекодирование импортированных звуков в компактный формат.
+
+    Файл перекодируется в моно с заданным битрейтом (ffmpeg -> Ogg Vorbis,
+    Android без ffmpeg -> AAC). Результат заменяет оригинал, только если
+    он заметно меньше; оригинал сохраняется в originals/ лишь по запросу.
+    Имя файла без расширения (sound_id) не меняется, настройки звука сохраняются.
+    """
+    BITRATES = (64, 48, 32)
+    MIN_SAVING = 0.8  # Результат должен быть меньше 80% оригинала
+
+    def __init__(self, app):
+        self.app = app
+        self.enabled = False
+        self.bitrate_kbps = 48
+        self.keep_original = False
+        self.jobs = queue.Queue()
+        self.worker = None
+        self.lock = threading.Lock()
+        self.transcoded = 0
+        self.saved_bytes = 0
+
+    @staticmethod
+    def encoder():
+        """Доступный кодировщик или None"""
+        if shutil.which('ffmpeg'):
+            return 'ffmpeg'
+        if platform == 'android':
+            return 'mediacodec'
+        return None
+
+    def submit(self, path):
+        """Ставит импортированный файл в очередь на перекодирование"""
+        if not self.enabled or self.encoder() is None:
+            return
+        self.jobs.put((path, self.bitrate_kbps, self.keep_original))
+        with self.lock:
+            if self.worker is None:
+                self.worker = threading.Thread(target=self._run, daemon=True)
+                self.worker.start()
+
+    @java_thread
+    def _run(self):
+        """Фоновый поток: обрабатывает очередь и завершается, когда она пуста"""
+        while True:
+            with self.lock:
+                try:
+                    job = self.jobs.get_nowait()
+                except queue.Empty:
+                    self.worker = None
+                    return
+            try:
+                result = self._transcode(*job)
+            except Exception as e:
+                print(f"Error transcoding {os.path.basename(job[0])}: {e}")
+                result = None
+            if result:
+                Clock.schedule_once(lambda dt, r=result: self._commit(*r))
+
+    def _transcode(self, path, bitrate_kbps, keep_original):
+        if not os.path.exists(path):
+            return None
+        encoder = self.encoder()
+        ext = '.ogg' if encoder == 'ffmpeg' else '.m4a'
+        new_path = os.path.splitext(path)[0] + ext
+        if new_path != path and os.path.exists(new_path):
+            # Имя занято другим звуком, а sound_id должен сохраниться - не перекодируем
+            print(f"Transcoding skipped for {os.path.basename(path)}: "
+                  f"{os.path.basename(new_path)} already exists")
+            return None
+        save_dir = os.path.dirname(path)
+        work_dir = os.path.join(save_dir, '.transcode')
+        os.makedirs(work_dir, exist_ok=True)
+        temp_path = os.path.join(work_dir, os.path.basename(os.path.splitext(path)[0]) + ext)
+        
+        started = time.perf_counter()
+        try:
+            if encoder == 'ffmpeg':
+                encode_with_ffmpeg(path, temp_path, bitrate_kbps)
+            else:
+                encode_with_mediacodec(path, temp_path, bitrate_kbps)
+            old_size = os.path.getsize(path)
+            new_size = os.path.getsize(temp_path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        
+        if new_size >= old_size * self.MIN_SAVING or \
+                (new_path != path and os.path.exists(new_path)):
+            print(f"Transcoding skipped for {os.path.basename(path)}: "
+                  f"{old_size // 1024}KB -> {new_size // 1024}KB")
+            os.remove(temp_path)
+            return None
+        
+        if keep_original:
+            originals_dir = os.path.join(save_dir, 'originals')
+            os.makedirs(originals_dir, exist_ok=True)
+            base, old_ext = os.path.splitext(os.path.basename(path))
+            original_path = os.path.join(originals_dir, base + old_ext)
+            counter = 1
+            while os.path.exists(original_path):
+                original_path = os.path.join(originals_dir, f"{base}_{counter}{old_ext}")
+                counter += 1
+            shutil.move(path, original_path)
+        else:
+            os.remove(path)
+        os.replace(temp_path, new_path)
+        print(f"Transcoded {os.path.basename(path)}: {old_size // 1024}KB -> "
+              f"{new_size // 1024}KB in {time.perf_counter() - started:.1f}s")
+        return path, new_path, old_size - new_size
+
+    def _commit(self, old_path, new_path, saved):
+        """Главный поток: учитывает результат и обновляет библиотеку"""
+        self.transcoded += 1
+        self.saved_bytes += saved
+        self.app.on_sound_transcoded(old_path, new_path)
+
+# -------------------------
+# Sound Analyzer Class
+# -------------------------
+SILENCE_THRESHOLD = 10 ** (-50 / 20)  # -50 dBFS
+
+
+def analyze_pcm(clip):
+    """Считает громкость, пик и тишину в начале и конце звука.
+
+    Громкость - интегральная по BS.1770 (блоки 400 мс, гейты -70 и -10 LU),
+    но без K-фильтра: для сравнения клипов между собой этого достаточно.
+    Возвращает (loudness LUFS, peak dBFS, lead_silence с, trail_silence с).
+    """
+    samples = np.frombuffer(clip.samples, dtype=np.int16)
+    channels = max(1, clip.channels)
+    if channels > 1:
+        samples = samples[:len(samples) // channels * channels].reshape(-1, channels).mean(axis=1)
+    x = samples.astype(np.float32) / 32768.0
+    if not x.size:
+        return -70.0, -90.0, 0.0, 0.0
+    rate = clip.rate
+    
+    peak = float(np.abs(x).max())
+    peak_db = 20 * np.log10(max(peak, 1e-9))
+    
+    # Энергии блоков через накопленную сумму квадратов - без цикла по блокам
+    energy = np.concatenate(([0.0], np.cumsum(np.square(x, dtype=np.float64))))
+    block = int(0.4 * rate)
+    if len(x) >= block:
+        starts = np.arange(0, len(x) - block + 1, max(1, block // 4))
+        blocks = (energy[starts + block] - energy[starts]) / block
+    else:
+        blocks = np.array([energy[-1] / len(x)])
+    blocks = blocks[blocks > 10 ** ((-70 + 0.691) / 10)]
+    if blocks.size:
+        relative_gate = -0.691 + 10 * np.log10(blocks.mean()) - 10
+        blocks = blocks[blocks > 10 ** ((relative_gate + 0.691) / 10)]
+    loudness = -0.691 + 10 * np.log10(blocks.mean()) if blocks.size else -70.0
+    
+    # Тишина по пикам 10-мс кадров; один кадр запаса, чтобы не срезать атаку
+    frame = max(1, int(0.01 * rate))
+    count = len(x) // frame
+    lead = trail = 0.0
+    if count:
+        frame_peaks = np.abs(x[:count * frame]).reshape(count, frame).max(axis=1)
+        loud = np.flatnonzero(frame_peaks > SILENCE_THRESHOLD)
+        if loud.size:
+            lead = max(0, int(loud[0]) - 1) * frame / rate
+            trail = max(0, count - int(loud[-1]) - 2) * frame / rate
+    return float(loudness), float(peak_db), lead, trail
+
+
+class SoundAnalyzer:
+    """Фоновый анализ звуков: громкость, пик и тишина по краям.
+
+    Каждый файл анализируется один раз, результат хранится в LibraryIndex
+    вместе с размером и mtime. При проигрывании громкость приводится к
+    TARGET_LOUDNESS (только ослаблением - громкость Kivy не больше 1.0),
+    а тишина в начале и в конце звука не проигрывается.
+    """
+    TARGET_LOUDNESS = -14.0
+    MIN_GAIN = 0.1
+
+    def __init__(self, app):
+        self.app = app
+        self.enabled = True
+        self.jobs = queue.Queue()
+        self.queued = set()
+        self.failed = set()
+        self.worker = None
+        self.lock = threading.Lock()
+        self.analyzed = 0
+        self.closing = False
+
+    @staticmethod
+    def available():
+        return np is not None
+
+    def submit(self, entries):
+        """Ставит в очередь записи, которые еще не анализировались"""
+        if not self.available():
+            return
+        with self.lock:
+            if self.closing:
+                return
+            for entry in entries:
+                if entry.loudness is None and entry.path not in self.queued \
+                        and entry.path not in self.failed:
+                    self.queued.add(entry.path)
+                    self.jobs.put(entry.path)
+            if self.worker is None and self.queued:
+                self.worker = threading.Thread(target=self._run, daemon=True)
+                self.worker.start()
+
+    @java_thread
+    def _run(self):
+        """Фоновый поток: анализирует очередь и завершается, когда она пуста"""
+        while True:
+            with self.lock:
+                try:
+                    path = self.jobs.get_nowait()
+                except queue.Empty:
+                    self.worker = None
+                    return
+            result = None
+            try:
+                st = os.stat(path)
+                clip = decode_pcm(path)
+                if clip is not None:
+                    result = analyze_pcm(clip)
+                    index = self.app.library_index
+                    if index is not None:
+                        index.store_analysis(path, st.st_size, st.st_mtime_ns, result)
+                    # Миниатюра волны считается из того же декодированного звука
+                    self.app.waveform_cache.store(path, clip, st.st_mtime_ns)
+            except Exception as e:
+                print(f"Error analyzing {os.path.basename(path)}: {e}")
+            Clock.schedule_once(lambda dt, p=path, r=result: self._commit(p, r))
+
+    def shutdown(self):
+        """Выход из приложения: очередь сбрасывается, начатый файл дорабатывается"""
+        with self.lock:
+            self.closing = True
+            while True:
+                try:
+                    self.jobs.get_nowait()
+                except queue.Empty:
+                    break
+
+    def active_threads(self):
+        with self.lock:
+            return [self.worker] if self.worker is not None else []
+
+    def _commit(self, path, result):
+        """Главный поток: записывает результат в запись библиотеки"""
+        with self.lock:
+            self.queued.discard(path)
+            if result is None:
+                # Нечем декодировать (нет ffmpeg) - не пытаемся снова до перезапуска
+                self.failed.add(path)
+                return
+        self.analyzed += 1
+        for entry in self.app.sound_entries:
+            if entry.path == path:
+                entry.loudness, entry.peak, entry.lead_silence, entry.trail_silence = result
+                break
+
+    def gain_for(self, entry):
+        """Множитель громкости, выравнивающий звук по TARGET_LOUDNESS"""
+        if not self.enabled or entry.loudness is None:
+            return 1.0
+        gain = 10 ** ((self.TARGET_LOUDNESS - entry.loudness) / 20)
+        return max(self.MIN_GAIN, min(1.0, gain))
+
+    def start_offset(self, entry):
+        """Сколько секунд тишины пропустить в начале звука"""
+        if not self.enabled or not entry.lead_silence:
+            return 0.0
+        return entry.lead_silence
+
+    def end_offset(self, entry):
+        """Сколько секунд тишины не доигрывать в конце звука"""
+        if not self.enabled or not entry.trail_silence:
+            return 0.0
+        return entry.trail_silence
+
+# -------------------------
+# Waveform Cache Class
+# -------------------------
+def compute_peaks(clip, columns):
+    """Min/max пики звука по columns колонкам, квантованные в int8"""
+    samples = np.frombuffer(clip.samples, dtype=np.int16)
+    channels = max(1, clip.channels)
+    if channels > 1:
+        samples = samples[:len(samples) // channels * channels].reshape(-1, channels).mean(axis=1)
+    peaks = np.zeros((columns, 2), dtype=np.int8)
+    if len(samples) < columns:
+        return peaks
+    step = len(samples) // columns
+    blocks = samples[:step * columns].reshape(columns, step)
+    peaks[:, 0] = (blocks.min(axis=1) / 258).astype(np.int8)
+    peaks[:, 1] = (blocks.max(axis=1) / 258).astype(np.int8)
+    return peaks
+
+
+class WaveformCache:
+    """Кэш миниатюр волны: min/max пики в бинарных файлах .waveforms/<hash>.wf.
+
+    Ключ - дайджест содержимого (тот же, что у дедупликации импорта, берется
+    из индекса по размеру и mtime), в заголовке хранится mtime: измененный
+    файл получает новую миниатюру. Пики считаются один раз (вместе с анализом
+    громкости), а при раскрытии кнопки только читаются с диска в фоне.
+    """
+    COLUMNS = 160
+    MAGIC = b'MCWF'
+    HEADER = struct.Struct('<4sqH')  # magic, mtime_ns, число колонок
+    MEMORY_ITEMS = 256
+
+    def __init__(self, save_dir, file_key=None):
+        self.cache_dir = os.path.join(save_dir, '.waveforms')
+        self.file_key = file_key or hash_file  # path -> дайджест содержимого
+        self.peaks = OrderedDict()  # path -> массив пиков, порядок LRU
+        self.callbacks = {}  # path -> ожидающие callback(path, peaks)
+        self.jobs = queue.Queue()
+        self.worker = None
+        self.lock = threading.Lock()
+        self.closing = False
+
+    def cache_path(self, key):
+        return os.path.join(self.cache_dir, key + '.wf')
+
+    def store(self, path, clip, mtime_ns, key=None):
+        """Фоновый поток: считает пики декодированного звука и пишет их на диск"""
+        peaks = compute_peaks(clip, self.COLUMNS)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        target = self.cache_path(key or self.file_key(path))
+        temp_path = target + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(self.HEADER.pack(self.MAGIC, mtime_ns, self.COLUMNS))
+            f.write(peaks.tobytes())
+        os.replace(temp_path, target)
+        return peaks
+
+    def _read(self, path):
+        """Фоновый поток: читает пики из кэша, при промахе считает заново"""
+        mtime_ns = os.stat(path).st_mtime_ns
+        key = self.file_key(path)
+        target = self.cache_path(key)
+        try:
+            with open(target, 'rb') as f:
+                magic, cached_mtime, columns = self.HEADER.unpack(f.read(self.HEADER.size))
+                if magic == self.MAGIC and cached_mtime == mtime_ns:
+                    data = f.read(columns * 2)
+                    if len(data) == columns * 2:
+                        return np.frombuffer(data, dtype=np.int8).reshape(columns, 2)
+        except (OSError, struct.error):
+            pass
+        clip = decode_pcm(path)
+        if clip is None:
+            return None
+        return self.store(path, clip, mtime_ns, key)
+
+    def get(self, path, callback):
+        """Возвращает пики из памяти; иначе загружает их в фоне и вызывает
+        callback(path, peaks) в главном потоке"""
+        peaks = self.peaks.get(path)
+        if peaks is not None:
+            self.peaks.move_to_end(path)
+            return peaks
+        if np is None:
+            return None
+        with self.lock:
+            if self.closing:
+                return None
+            waiting = self.callbacks.setdefault(path, [])
+            waiting.append(callback)
+            if len(waiting) == 1:
+                self.jobs.put(path)
+            if self.worker is None:
+                self.worker = threading.Thread(target=self._run, daemon=True)
+                self.worker.start()
+        return None
+
+    @java_thread
+    def _run(self):
+        while True:
+            with self.lock:
+                try:
+                    path = self.jobs.get_nowait()
+                except queue.Empty:
+                    self.worker = None
+                    return
+            try:
+                peaks = self._read(path)
+            except Exception as e:
+                print(f"Error loading waveform for {os.path.basename(path)}: {e}")
+                peaks = None
+            Clock.schedule_once(lambda dt, p=path, w=peaks: self._commit(p, w))
+
+    def shutdown(self):
+        """Выход из приложения: ожидающие миниатюры больше не загружаются"""
+        with self.lock:
+            self.closing = True
+            self.callbacks.clear()
+            while True:
+                try:
+                    self.jobs.get_nowait()
+                except queue.Empty:
+                    break
+
+    def active_threads(self):
+        with self.lock:
+            return [self.worker] if self.worker is not None else []
+
+    def _commit(self, path, peaks):
+        with self.lock:
+            callbacks = self.callbacks.pop(path, [])
+        if peaks is None:
+            return
+        self.peaks[path] = peaks
+        while len(self.peaks) > self.MEMORY_ITEMS:
+            self.peaks.popitem(last=False)
+        for callback in callbacks:
+            callback(path, peaks)
+
+    def forget(self, path):
+        self.peaks.pop(path, None)
+
+
+class WaveformView(Widget):
+    """Миниатюра волны - один Mesh из прямоугольника на каждую колонку"""
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.peaks = None
+        with self.canvas:
+            Color(0.6, 0.65, 0.9, 0.9)
+            self.mesh = Mesh(mode='triangles')
+        self.bind(pos=self.update_mesh, size=self.update_mesh)
+
+    def set_peaks(self, peaks):
+        self.peaks = peaks
+        self.update_mesh()
+
+    def update_mesh(self, *args):
+        if self.peaks is None or not len(self.peaks):
+            self.mesh.vertices = []
+            self.mesh.indices = []
+            return
+        columns = len(self.peaks)
+        column_width = self.width / columns
+        x0 = self.x + np.arange(columns) * column_width
+        x1 = x0 + max(1.0, column_width * 0.7)
+        center = self.center_y
+        scale = self.height / 2 / 127.0
+        y0 = center + self.peaks[:, 0] * scale
+        y1 = np.maximum(center + self.peaks[:, 1] * scale, y0 + 1)
+        
+        # 4 вершины (x, y, u, v) и 2 треугольника на колонку
+        vertices = np.zeros((columns, 4, 4), dtype=np.float32)
+        vertices[:, 0, 0], vertices[:, 0, 1] = x0, y0
+        vertices[:, 1, 0], vertices[:, 1, 1] = x1, y0
+        vertices[:, 2, 0], vertices[:, 2, 1] = x1, y1
+        vertices[:, 3, 0], vertices[:, 3, 1] = x0, y1
+        base = np.arange(columns)[:, None] * 4
+        indices = base + np.array([0, 1, 2, 0, 2, 3])
+        self.mesh.vertices = vertices.ravel().tolist()
+        self.mesh.indices = indices.ravel().tolist()
+
+# -------------------------
+# Library Index Class
+# -------------------------
+class LibraryIndex:
+    """Постоянный индекс библиотеки в SQLite.
+
+    При запуске файлы сверяются с индексом только по размеру и mtime - имя,
+    иконка и длительность берутся из индекса без повторного вычисления.
+    Настройки звуков (громкость) остаются в app_settings.json и
+    применяются к записям по sound_id. Статистика проигрываний хранится
+    отдельно по sound_id и не теряется при пересоздании таблицы звуков.
+    """
+    SCHEMA_VERSION = 1
+    AUDIO_EXTENSIONS = ('.mp3', '.wav', '.ogg', '.m4a')
+    ICON_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        # Индекс используется и фоновым сканером, и главным потоком
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version != self.SCHEMA_VERSION:
+            self.conn.execute("DROP TABLE IF EXISTS sounds")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS sounds (
+            path TEXT PRIMARY KEY,
+            sound_id TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            icon_path TEXT,
+            duration REAL
+        )""")
+        # Результаты анализа привязаны к размеру и mtime файла
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS analysis (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            loudness REAL NOT NULL,
+            peak REAL NOT NULL,
+            lead_silence REAL NOT NULL,
+            trail_silence REAL NOT NULL
+        )""")
+        # Дайджест содержимого -> файл библиотеки (размер и mtime файла на момент записи)
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS content (
+            digest TEXT PRIMARY KEY,
+            path TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL
+        )""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS content_path ON content (path)")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS plays (
+            sound_id TEXT PRIMARY KEY,
+            play_count INTEGER NOT NULL,
+            last_played REAL NOT NULL
+        )""")
+        self.conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+        self.conn.commit()
+
+    def reconcile(self, save_dir, clean_name):
+        """Сверяет индекс с папкой.
+
+        Возвращает (entries, added, removed, changed): все записи в порядке
+        имен файлов и пути новых, удаленных и измененных файлов.
+        """
+        started = time.perf_counter()
+        audio_files = []
+        icons = {}
+        with os.scandir(save_dir) as it:
+            for item in it:
+                base, ext = os.path.splitext(item.name)
+                ext = ext.lower()
+                if ext in self.AUDIO_EXTENSIONS:
+                    audio_files.append((item.name, base, item))
+                elif ext in self.ICON_EXTENSIONS:
+                    # Приоритет расширений такой же, как при поиске иконки
+                    current = icons.get(base)
+                    if current is None or self.ICON_EXTENSIONS.index(ext) < \
+                            self.ICON_EXTENSIONS.index(os.path.splitext(current)[1].lower()):
+                        icons[base] = item.path
+        audio_files.sort()
+
+        with self.lock:
+            rows = {row[0]: row for row in self.conn.execute(
+                "SELECT path, sound_id, size, mtime_ns, name, icon_path, duration FROM sounds")}
+            plays = {row[0]: row[1:] for row in self.conn.execute(
+                "SELECT sound_id, play_count, last_played FROM plays")}
+            analysis = {row[0]: row[1:] for row in self.conn.execute(
+                "SELECT path, size, mtime_ns, loudness, peak, lead_silence, trail_silence FROM analysis")}
+            entries = []
+            added, changed, updates = [], [], []
+            for filename, sound_id, item in audio_files:
+                st = item.stat()
+                icon_path = icons.get(sound_id)
+                row = rows.pop(item.path, None)
+                if row is not None and row[2] == st.st_size and row[3] == st.st_mtime_ns:
+                    name, duration = row[4], row[6]
+                    if row[5] != icon_path:
+                        updates.append((item.path, sound_id, st.st_size, st.st_mtime_ns,
+                                        name, icon_path, duration))
+                else:
+                    name, duration = clean_name(filename), None
+                    (added if row is None else changed).append(item.path)
+                    updates.append((item.path, sound_id, st.st_size, st.st_mtime_ns,
+                                    name, icon_path, duration))
+                entry = SoundEntry(item.path, name, icon_path, sound_id=sound_id)
+                entry.size = st.st_size
+                entry.mtime_ns = st.st_mtime_ns
+                entry.duration = duration
+                if sound_id in plays:
+                    entry.play_count, entry.last_played = plays[sound_id]
+                result = analysis.get(item.path)
+                if result is not None and result[0] == st.st_size and result[1] == st.st_mtime_ns:
+                    entry.loudness, entry.peak, entry.lead_silence, entry.trail_silence = result[2:]
+                entries.append(entry)
+
+            removed = list(rows)
+            if updates:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO sounds VALUES (?, ?, ?, ?, ?, ?, ?)", updates)
+            if removed:
+                self.conn.executemany("DELETE FROM sounds WHERE path = ?",
+                                      [(path,) for path in removed])
+                self.conn.executemany("DELETE FROM analysis WHERE path = ?",
+                                      [(path,) for path in removed])
+                self.conn.executemany("DELETE FROM content WHERE path = ?",
+                                      [(path,) for path in removed])
+            self.conn.commit()
+
+        print(f"Library index reconciled in {(time.perf_counter() - started) * 1000:.1f} ms: "
+              f"{len(entries)} sounds, +{len(added)} -{len(removed)} ~{len(changed)}")
+        return entries, added, removed, changed
+
+    def update_duration(self, path, duration):
+        """Запоминает длительность звука после первого декодирования"""
+        with self.lock:
+            self.conn.execute("UPDATE sounds SET duration = ? WHERE path = ?", (duration, path))
+            self.conn.commit()
+
+    def store_analysis(self, path, size, mtime_ns, result):
+        """Сохраняет результат анализа: (loudness, peak, lead_silence, trail_silence)"""
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO analysis VALUES (?, ?, ?, ?, ?, ?, ?)",
+                              (path, size, mtime_ns) + tuple(result))
+            self.conn.commit()
+
+    def annotate(self, entries):
+        """Дополняет записи вне папки библиотеки статистикой и результатами анализа"""
+        with self.lock:
+            plays = {row[0]: row[1:] for row in self.conn.execute(
+                "SELECT sound_id, play_count, last_played FROM plays")}
+            analysis = {row[0]: row[1:] for row in self.conn.execute(
+                "SELECT path, size, mtime_ns, loudness, peak, lead_silence, trail_silence FROM analysis")}
+        for entry in entries:
+            if entry.sound_id in plays:
+                entry.play_count, entry.last_played = plays[entry.sound_id]
+            result = analysis.get(entry.path)
+            if result is not None and result[0] == entry.size and result[1] == entry.mtime_ns:
+                entry.loudness, entry.peak, entry.lead_silence, entry.trail_silence = result[2:]
+
+    def store_content(self, path, digest):
+        """Связывает дайджест содержимого с файлом библиотеки"""
+        st = os.stat(path)
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO content VALUES (?, ?, ?, ?)",
+                              (digest, path, st.st_size, st.st_mtime_ns))
+            self.conn.commit()
+
+    def lookup_content(self, digest):
+        """Файл с таким содержимым или None; устаревшая связь удаляется"""
+        with self.lock:
+            row = self.conn.execute("SELECT path, size, mtime_ns FROM content WHERE digest = ?",
+                                    (digest,)).fetchone()
+            if row is None:
+                return None
+            try:
+                st = os.stat(row[0])
+                if st.st_size == row[1] and st.st_mtime_ns == row[2]:
+                    return row[0]
+            except OSError:
+                pass
+            self.conn.execute("DELETE FROM content WHERE digest = ?", (digest,))
+            self.conn.commit()
+            return None
+
+    def has_content(self, path):
+        """Есть ли актуальный дайджест для файла"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        with self.lock:
+            return self.conn.execute(
+                "SELECT 1 FROM content WHERE path = ? AND size = ? AND mtime_ns = ?",
+                (path, st.st_size, st.st_mtime_ns)).fetchone() is not None
+
+    def content_digest(self, path):
+        """Дайджест файла, если он записан для его текущих размера и mtime"""
+        st = os.stat(path)
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT digest FROM content WHERE path = ? AND size = ? AND mtime_ns = ?",
+                (path, st.st_size, st.st_mtime_ns)).fetchone()
+        return row[0] if row else None
+
+    def move_content(self, old_path, new_path):
+        """Файл заменен другим (перекодирован) - прежние дайджесты ведут к новому"""
+        st = os.stat(new_path)
+        with self.lock:
+            self.conn.execute("UPDATE content SET path = ?, size = ?, mtime_ns = ? WHERE path = ?",
+                              (new_path, st.st_size, st.st_mtime_ns, old_path))
+            self.conn.commit()
+
+    def record_plays(self, plays):
+        """Добавляет проигрывания: plays - список (sound_id, count, last_played)"""
+        with self.lock:
+            self.conn.executemany(
+                """INSERT INTO plays (sound_id, play_count, last_played) VALUES (?, ?, ?)
+                ON CONFLICT(sound_id) DO UPDATE SET
+                    play_count = play_count + excluded.play_count,
+                    last_played = MAX(last_played, excluded.last_played)""", plays)
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+# -------------------------
+# Bundled Sounds Class
+# -------------------------
+class BundledSounds:
+    """Встроенные звуки, которые играют прямо из пакета приложения.
+
+    Список берется из sounds_manifest.json (его создает make_sound_manifest.py
+    при сборке), без манифеста - из содержимого папки. Файлы не копируются:
+    записи ссылаются на пакет и доступны только для чтения. Громкость и имя
+    хранятся в настройках, удаление только скрывает звук. Файл с тем же
+    именем в папке звуков заменяет встроенный.
+    """
+    MANIFEST_NAME = 'sounds_manifest.json'
+
+    def __init__(self, app):
+        self.app = app
+        self.directory = None
+        self.sounds = []  # [{'file', 'size', 'digest', 'icon'}]
+        self.hidden = set()  # sound_id встроенных звуков, удаленных пользователем
+        self.digests = {}
+
+    def load(self):
+        """Находит встроенные звуки; при запуске с исходников папка совпадает
+        с папкой звуков, и отдельные записи не нужны"""
+        app_dir = os.path.dirname(os.path.abspath(__file__))
+        possible_paths = [
+            os.path.join(app_dir, "saved_sounds"),
+            os.path.join(app_dir, "assets", "saved_sounds"),
+            os.path.join(app_dir, "..", "saved_sounds"),  # Для GitHub структуры
+        ]
+        for path in possible_paths:
+            if os.path.isdir(path):
+                self.directory = os.path.abspath(path)
+                break
+        if self.directory is None:
+            print("No built-in sounds directory found")
+            return
+        try:
+            if os.path.samefile(self.directory, self.app.save_dir):
+                self.directory = None
+                return
+        except OSError:
+            pass
+        
+        try:
+            with open(os.path.join(self.directory, self.MANIFEST_NAME), 'r', encoding='utf-8') as f:
+                self.sounds = json.load(f).get('sounds', [])
+        except (OSError, ValueError):
+            # Манифеста нет - достаточно списка файлов, без чтения содержимого
+            filenames = sorted(os.listdir(self.directory))
+            icons = {}
+            for filename in filenames:
+                base, ext = os.path.splitext(filename)
+                if ext.lower() in LibraryIndex.ICON_EXTENSIONS and base not in icons:
+                    icons[base] = filename
+            self.sounds = [{'file': filename, 'icon': icons.get(os.path.splitext(filename)[0])}
+                           for filename in filenames
+                           if filename.lower().endswith(LibraryIndex.AUDIO_EXTENSIONS)]
+        self.digests = {sound['digest']: os.path.join(self.directory, sound['file'])
+                        for sound in self.sounds if sound.get('digest')}
+        print(f"Built-in sounds: {len(self.sounds)} at {self.directory}")
+
+    def sound_ids(self):
+        return {os.path.splitext(sound['file'])[0] for sound in self.sounds}
+
+    def is_bundled(self, path):
+        return self.directory is not None and os.path.dirname(path) == self.directory
+
+    def name_taken(self, path):
+        """Имя файла в папке звуков совпадает с видимым встроенным звуком"""
+        sound_id = os.path.splitext(os.path.basename(path))[0]
+        return sound_id not in self.hidden and sound_id in self.sound_ids()
+
+    def find(self, digest):
+        """Путь видимого встроенного звука с таким содержимым"""
+        path = self.digests.get(digest)
+        if path is None or os.path.splitext(os.path.basename(path))[0] in self.hidden:
+            return None
+        return path
+
+    def digest_of(self, path):
+        """Дайджест встроенного звука из манифеста"""
+        if not self.is_bundled(path):
+            return None
+        filename = os.path.basename(path)
+        for sound in self.sounds:
+            if sound['file'] == filename:
+                return sound.get('digest')
+        return None
+
+    def hide(self, entry):
+        self.hidden.add(entry.sound_id)
+
+    def entries(self, library_ids):
+        """Записи встроенных звуков, не замененных файлами библиотеки и не скрытых"""
+        entries = []
+        for sound in self.sounds:
+            sound_id = os.path.splitext(sound['file'])[0]
+            if sound_id in library_ids or sound_id in self.hidden:
+                continue
+            path = os.path.join(self.directory, sound['file'])
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            icon = sound.get('icon')
+            entry = SoundEntry(path, self.app.clean_sound_name(sound['file']),
+                               os.path.join(self.directory, icon) if icon else None,
+                               sound_id=sound_id)
+            entry.size = st.st_size
+            entry.mtime_ns = st.st_mtime_ns
+            entry.bundled = True
+            entries.append(entry)
+        if entries and self.app.library_index is not None:
+            self.app.library_index.annotate(entries)
+        return entries
+
+# -------------------------
+# Content Index Class
+# -------------------------
+def new_content_hash():
+    return hashlib.blake2b(digest_size=16)
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    digest = new_content_hash()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def copy_source_hashed(source, dst_path, on_progress=None, chunk_size=1024 * 1024):
+    """Копирует источник в файл и за тот же проход считает дайджест содержимого.
+    Буфер один на весь файл, части передаются через memoryview без копирования"""
+    digest = new_content_hash()
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    with open(dst_path, 'wb') as dst:
+        while True:
+            size = source.readinto(buffer)
+            if not size:
+                break
+            chunk = view[:size]
+            digest.update(chunk)
+            dst.write(chunk)
+            if on_progress:
+                on_progress(size)
+    return digest.hexdigest()
+
+
+class ContentIndex:
+    """Дедупликация импорта по содержимому.
+
+    Импортируемый файл хэшируется (blake2b) во время копирования во временный
+    файл. Если такие байты уже есть в библиотеке, копия удаляется и импорт
+    ссылается на существующую запись. Файлы, добавленные до появления индекса,
+    хэшируются лениво и только при совпадении размера.
+    """
+    def __init__(self, app):
+        self.app = app
+        self.lock = threading.Lock()
+
+    def import_dir(self):
+        path = os.path.join(self.app.save_dir, '.import')
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def commit_import(self, temp_path, final_path, digest):
+        """Переносит temp_path в библиотеку, если такого содержимого еще нет.
+        Возвращает (path, is_new): для дубликата - путь существующего файла"""
+        size = os.path.getsize(temp_path)
+        # Поиск и перенос под одной блокировкой - параллельные импорты
+        # одинаковых файлов не проскочат оба
+        with self.lock:
+            existing = self._find(digest, size)
+            if existing is not None:
+                os.remove(temp_path)
+                print(f"Already in library: {os.path.basename(existing)}")
+                return existing, False
+            os.replace(temp_path, final_path)
+            self._store(final_path, digest)
+            return final_path, True
+
+    def _find(self, digest, size):
+        index = self.app.library_index
+        if index is not None:
+            path = index.lookup_content(digest)
+            if path is not None:
+                return path
+        path = self.app.bundled_sounds.find(digest)
+        if path is not None:
+            return path
+        for entry in list(self.app.sound_entries):
+            if entry.size != size or (index is not None and index.has_content(entry.path)):
+                continue
+            try:
+                own = hash_file(entry.path)
+            except OSError:
+                continue
+            self._store(entry.path, own)
+            if own == digest:
+                return entry.path
+        return None
+
+    def digest(self, path):
+        """Дайджест содержимого файла: из манифеста или индекса,
+        иначе файл хэшируется один раз и дайджест запоминается"""
+        digest = self.app.bundled_sounds.digest_of(path)
+        if digest:
+            return digest
+        index = self.app.library_index
+        if index is not None:
+            try:
+                digest = index.content_digest(path)
+            except Exception as e:
+                print(f"Error reading content digest: {e}")
+        if digest is None:
+            digest = hash_file(path)
+            self._store(path, digest)
+        return digest
+
+    def _store(self, path, digest):
+        if self.app.library_index is not None:
+            try:
+                self.app.library_index.store_content(path, digest)
+            except Exception as e:
+                print(f"Error storing content digest: {e}")
+
+    def moved(self, old_path, new_path):
+        if self.app.library_index is not None:
+            try:
+                self.app.library_index.move_content(old_path, new_path)
+            except Exception as e:
+                print(f"Error updating content digest: {e}")
+
+# -------------------------
+# Content Source Classes
+# -------------------------
+class ContentSource:
+    """Источник импортируемого файла.
+
+    name - имя файла, size - размер в байтах (None, если неизвестен).
+    readinto(buffer) заполняет буфер и возвращает число байт, 0 - конец данных.
+    """
+    name = ''
+    size = None
+
+    def readinto(self, buffer):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class FileContentSource(ContentSource):
+    """Обычный файл на диске"""
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.size = os.path.getsize(path)
+        self.file = None
+
+    def readinto(self, buffer):
+        if self.file is None:
+            self.file = open(self.path, 'rb', buffering=0)
+        return self.file.readinto(buffer)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class JavaStreamSource(ContentSource):
+    """java.io.InputStream: один вызов JNI на весь буфер.
+    Подойдет любой объект с read(bytearray) -> int (-1 в конце), как у InputStream"""
+    def __init__(self, stream, name='', size=None):
+        self.stream = stream
+        self.name = name
+        self.size = size
+
+    def readinto(self, buffer):
+        return max(self.stream.read(buffer), 0)
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+
+class AndroidUriSource(ContentSource):
+    """Файл из системного пикера (content://).
+
+    Открывается в рабочем потоке. Если провайдер отдает файловый дескриптор,
+    данные читаются напрямую из него без JNI, иначе - через InputStream.
+    """
+    def __init__(self, resolver, uri, name, size=None):
+        self.resolver = resolver
+        self.uri = uri
+        self.name = name
+        self.size = size
+        self.reader = None
+
+    @classmethod
+    def query(cls, resolver, uri):
+        """Имя и размер файла из провайдера"""
+        name, size = "audio_file", None
+        cursor = resolver.query(uri, None, None, None, None)
+        if cursor:
+            try:
+                if cursor.moveToFirst():
+                    name_index = cursor.getColumnIndex("_display_name")
+                    if name_index != -1:
+                        name = cursor.getString(name_index)
+                    size_index = cursor.getColumnIndex("_size")
+                    if size_index != -1 and not cursor.isNull(size_index):
+                        size = cursor.getLong(size_index)
+            finally:
+                cursor.close()
+        return cls(resolver, uri, name, size)
+
+    def readinto(self, buffer):
+        if self.reader is None:
+            try:
+                descriptor = self.resolver.openFileDescriptor(self.uri, "r")
+                self.reader = os.fdopen(descriptor.detachFd(), 'rb', buffering=0)
+            except Exception as e:
+                print(f"No file descriptor for {self.name} ({e}), reading stream")
+                self.reader = JavaStreamSource(self.resolver.openInputStream(self.uri))
+        return self.reader.readinto(buffer)
+
+    def close(self):
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+
+# -------------------------
+# File Importer Class
+# -------------------------
+class FileImporter:
+    """Импорт файлов пулом фоновых потоков.
+
+    Рабочие потоки копируют источник (файл или content:// на Android)
+    с подсчетом дайджеста, проверяют сигнатуру, отсеивают дубликаты и
+    готовят запись библиотеки. Главный поток только показывает общий
+    прогресс (по байтам, если размеры известны) и в конце добавляет все
+    новые звуки разом.
+    """
+    MAX_WORKERS = 4
+    PROGRESS_INTERVAL = 0.1
+
+    def __init__(self, app):
+        self.app = app
+        self.lock = threading.Lock()
+        self.jobs = queue.Queue()
+        self.workers = 0
+        self.threads = []
+        self.cancel_event = threading.Event()
+        self.progress_event = None
+        self.reserved = set()
+        self._reset()
+
+    def _reset(self):
+        self.total = 0
+        self.processed = 0
+        self.total_bytes = 0
+        self.copied_bytes = 0
+        self.sizes_known = True
+        self.entries = []
+        self.duplicates = 0
+        self.failed = 0
+
+    @property
+    def is_running(self):
+        return self.progress_event is not None
+
+    def start(self, paths):
+        """Ставит файлы с диска в очередь"""
+        return self.start_sources([FileContentSource(path) for path in paths
+                                   if os.path.splitext(path)[1].lower() in LibraryIndex.AUDIO_EXTENSIONS])
+
+    def start_sources(self, sources):
+        """Ставит источники в очередь; во время импорта новые добавляются к текущему"""
+        sources = [source for source in sources
+                   if os.path.splitext(source.name)[1].lower() in LibraryIndex.AUDIO_EXTENSIONS]
+        if not sources:
+            return 0
+        if self.is_running and self.cancel_event.is_set():
+            # Отмененный импорт еще дописывает начатые файлы - новый начнется после него
+            Clock.schedule_once(lambda dt: self.start_sources(sources), self.PROGRESS_INTERVAL)
+            return len(sources)
+        if not self.is_running:
+            self._reset()
+            self.cancel_event = threading.Event()
+            self.progress_event = Clock.schedule_interval(self._report, self.PROGRESS_INTERVAL)
+        with self.lock:
+            self.total += len(sources)
+            for source in sources:
+                if source.size is None:
+                    self.sizes_known = False
+                else:
+                    self.total_bytes += source.size
+                self.jobs.put(source)
+            while self.workers < min(self.MAX_WORKERS, self.jobs.qsize()):
+                self.workers += 1
+                worker = threading.Thread(target=self._run, args=(self.cancel_event,), daemon=True)
+                worker.start()
+                self.threads.append(worker)
+        print(f"Importing {len(sources)} files...")
+        return len(sources)
+
+    def cancel(self):
+        """Останавливает импорт: файлы из очереди закрываются, начатые докопируются"""
+        self.cancel_event.set()
+        with self.lock:
+            while True:
+                try:
+                    source = self.jobs.get_nowait()
+                except queue.Empty:
+                    break
+                self.total -= 1
+                if source.size is not None:
+                    self.total_bytes -= source.size
+                source.close()
+
+    def active_threads(self):
+        with self.lock:
+            self.threads = [worker for worker in self.threads if worker.is_alive()]
+            return list(self.threads)
+
+    @java_thread
+    def _run(self, cancel_event):
+        """Рабочий поток: импортирует файлы, пока очередь не опустеет"""
+        while not cancel_event.is_set():
+            try:
+                source = self.jobs.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                result = self._import(source)
+            except Exception as e:
+                print(f"Error importing {source.name}: {e}")
+                result = None
+            finally:
+                source.close()
+            with self.lock:
+                self.processed += 1
+                if result is None:
+                    self.failed += 1
+                elif result is False:
+                    self.duplicates += 1
+                else:
+                    self.entries.append(result)
+        with self.lock:
+            self.workers -= 1
+            if self.workers == 0:
+                Clock.schedule_once(lambda dt: self._finish())
+
+    def _reserve(self, filename):
+        """Свободное имя в папке звуков с учетом файлов, которые копируют другие потоки"""
+        base, ext = os.path.splitext(filename)
+        with self.lock:
+            new_path = os.path.join(self.app.save_dir, filename)
+            counter = 1
+            while os.path.exists(new_path) or new_path in self.reserved or \
+                    self.app.bundled_sounds.name_taken(new_path):
+                new_path = os.path.join(self.app.save_dir, f"{base}_{counter}{ext}")
+                counter += 1
+            self.reserved.add(new_path)
+        return new_path
+
+    def _import(self, source):
+        """Возвращает запись нового звука, False для дубликата или None при ошибке"""
+        new_path = self._reserve(os.path.basename(source.name))
+        try:
+            content_index = self.app.content_index
+            temp_path = os.path.join(content_index.import_dir(), os.path.basename(new_path))
+            try:
+                digest = copy_source_hashed(source, temp_path, self._on_copied)
+            except Exception:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+            if isinstance(source, FileContentSource):
+                shutil.copystat(source.path, temp_path)
+            if probe_audio_file(temp_path) is None:
+                os.remove(temp_path)
+                print(f"Not a playable sound: {source.name}")
+                return None
+            path, is_new = content_index.commit_import(temp_path, new_path, digest)
+            if not is_new:
+                return False
+            return self.app.build_sound_entry(new_path)
+        finally:
+            with self.lock:
+                self.reserved.discard(new_path)
+
+    def _on_copied(self, size):
+        with self.lock:
+            self.copied_bytes += size
+
+    def _report(self, dt):
+        if self.sizes_known and self.total_bytes:
+            self.app.update_load_progress(self.copied_bytes, self.total_bytes)
+        else:
+            self.app.update_load_progress(self.processed, self.total)
+
+    def _finish(self):
+        """Главный поток: все потоки закончили - добавляем звуки одним обновлением"""
+        if self.workers or not self.is_running:
+            return
+        if self.progress_event is not None:
+            self.progress_event.cancel()
+            self.progress_event = None
+        self.app.update_load_progress(0, 0)
+        entries = self.app.add_sound_entries(self.entries)
+        for entry in entries:
+            self.app.transcoder.submit(entry.path)
+        duplicates = self.duplicates + len(self.entries) - len(entries)
+        print(f"Import finished: {len(entries)} added, {duplicates} duplicates, {self.failed} failed")
+        if not self.cancel_event.is_set():
+            self.app.on_import_finished(len(entries), duplicates, self.failed)
+
+# -------------------------
+# Sound Library Loader Class
+# -------------------------
+class SoundLibraryLoader:
+    """Сканирует библиотеку в фоновом потоке и добавляет строки в UI порциями"""
+    BATCH_SIZE = 25  # Сколько строк добавляется за один кадр
+
+    def __init__(self, app):
+        self.app = app
+        self.cancel_event = None
+        self.results = None
+        self.consume_event = None
+        self.worker = None
+        self.total = 0
+        self.loaded = 0
+        self.incremental = False
+
+    @property
+    def is_running(self):
+        return self.consume_event is not None
+
+    def start(self, incremental=False):
+        """Запускает сканирование, отменяя предыдущее незавершенное.
+
+        При incremental=True список не перестраивается: сканер сравнивает папку
+        с текущими записями и возвращает только изменения.
+        """
+        self.cancel()
+        self.cancel_event = threading.Event()
+        self.results = queue.Queue()
+        self.total = 0
+        self.loaded = 0
+        self.incremental = incremental
+        known = None
+        if incremental:
+            known = {entry.path: (entry.size, entry.mtime_ns) for entry in self.app.sound_entries}
+        self.worker = threading.Thread(
+            target=self._scan,
+            args=(self.app.save_dir, self.cancel_event, self.results, known),
+            daemon=True
+        )
+        self.worker.start()
+        # Результаты забираются на главном потоке каждый кадр до окончания
+        self.consume_event = Clock.schedule_interval(self._consume, 0)
+
+    def cancel(self):
+        """Отменяет текущее сканирование"""
+        if self.cancel_event:
+            self.cancel_event.set()
+        if self.consume_event:
+            self.consume_event.cancel()
+            self.consume_event = None
+            print("Sound scan cancelled")
+
+    def active_threads(self):
+        if self.worker is not None and self.worker.is_alive():
+            return [self.worker]
+        return []
+
+    def _scan(self, save_dir, cancel_event, results, known=None):
+        """Фоновый поток: список файлов, разбор имен и иконок"""
+        complete = False
+        try:
+            entries = self._list_entries(save_dir)
+            if known is None:
+                results.put(('total', len(entries)))
+                for entry in entries:
+                    if cancel_event.is_set():
+                        return
+                    results.put(('entry', entry))
+                complete = True
+            else:
+                # Сравниваем с текущими записями по размеру и mtime
+                paths = set()
+                added, changed = [], []
+                for entry in entries:
+                    paths.add(entry.path)
+                    state = known.get(entry.path)
+                    if state is None:
+                        added.append(entry.path)
+                    elif state != (entry.size, entry.mtime_ns):
+                        changed.append(entry.path)
+                removed = [path for path in known if path not in paths]
+                if cancel_event.is_set():
+                    return
+                results.put(('diff', (entries, added, removed, changed)))
+                complete = True
+
+        except Exception as e:
+            print(f"Error scanning sounds: {e}")
+        finally:
+            results.put(('done', complete))
+
+    def _list_entries(self, save_dir):
+        """Записи библиотеки вместе со встроенными звуками, по именам файлов"""
+        entries = self._list_library(save_dir)
+        bundled = self.app.bundled_sounds.entries({entry.sound_id for entry in entries})
+        if bundled:
+            entries = sorted(entries + bundled, key=library_sort_key)
+        return entries
+
+    def _list_library(self, save_dir):
+        """Записи папки звуков: из индекса, а без него - полным разбором папки"""
+        index = self.app.library_index
+        if index is not None:
+            try:
+                return index.reconcile(save_dir, self.app.clean_sound_name)[0]
+            except Exception as e:
+                print(f"Library index error, falling back to full scan: {e}")
+        
+        audio_extensions = LibraryIndex.AUDIO_EXTENSIONS
+        return [self.app.build_sound_entry(os.path.join(save_dir, filename))
+                for filename in sorted(os.listdir(save_dir))
+                if filename.lower().endswith(audio_extensions)]
+
+    def _consume(self, dt):
+        """Главный поток: добавляет в UI не больше BATCH_SIZE строк за кадр"""
+        entries = []
+        finished = False
+        complete = False
+        while len(entries) < self.BATCH_SIZE:
+            try:
+                kind, value = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if kind == 'total':
+                self.total = value
+                self.app.on_library_scan_started(value)
+            elif kind == 'entry':
+                entries.append(value)
+            elif kind == 'diff':
+                self.app.apply_library_diff(*value)
+            elif kind == 'done':
+                finished = True
+                complete = value
+                break
+        
+        if entries:
+            self.loaded += len(entries)
+            self.app.on_library_entries_loaded(entries)
+            self.app.update_load_progress(self.loaded, self.total)
+        
+        if finished:
+            self.consume_event = None
+            self.app.on_library_scan_finished(complete)
+            return False
+
+# -------------------------
+# Search Index Class
+# -------------------------
+class SearchIndex:
+    """N-граммный индекс по именам звуков для поиска и подсказок.
+
+    Точные вхождения подстроки находятся пересечением списков n-грамм
+    запроса. Если точных совпадений мало, добавляются нечеткие (опечатки)
+    по доле общих триграмм. Индекс обновляется по одной записи.
+    """
+    FUZZY_MIN_SHARE = 0.5  # Доля триграмм запроса, которые должны совпасть
+    FUZZY_FALLBACK = 5  # Нечеткий поиск - только если точных совпадений меньше
+
+    def __init__(self):
+        self.grams = {}  # n-грамма -> множество sound_id
+        self.docs = {}  # sound_id -> (entry, текст имени, текст имени файла, n-граммы)
+        self._last_query = None
+        self._last_match = None
+
+    @staticmethod
+    def normalize(text):
+        text = text.lower().replace('_', ' ').replace('-', ' ')
+        return ' '.join(text.split())
+
+    @staticmethod
+    def ngrams(text, n):
+        return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+    def clear(self):
+        self.grams.clear()
+        self.docs.clear()
+        self._last_query = None
+
+    def add(self, entry):
+        if entry.sound_id in self.docs:
+            self.remove(entry)
+        name_text = self.normalize(entry.name)
+        file_text = self.normalize(entry.sound_id)
+        grams = set()
+        for text in (name_text, file_text):
+            grams |= self.ngrams(text, 1)
+            grams |= self.ngrams(text, 2)
+            # Пробелы по краям дают триграммы начала и конца слова
+            grams |= self.ngrams(f" {text} ", 3)
+        self.docs[entry.sound_id] = (entry, name_text, file_text, grams)
+        for gram in grams:
+            self.grams.setdefault(gram, set()).add(entry.sound_id)
+        self._last_query = None
+
+    def contains(self, entry):
+        """Проиндексирована ли именно эта запись"""
+        doc = self.docs.get(entry.sound_id)
+        return doc is not None and doc[0] is entry
+
+    def remove(self, entry):
+        doc = self.docs.pop(entry.sound_id, None)
+        if doc is None:
+            return
+        for gram in doc[3]:
+            ids = self.grams.get(gram)
+            if ids is not None:
+                ids.discard(entry.sound_id)
+                if not ids:
+                    del self.grams[gram]
+        self._last_query = None
+
+    def match(self, query):
+        """Возвращает (точные sound_id, {sound_id: похожесть} нечетких совпадений).
+        Результат последнего запроса запоминается - фильтр списка и подсказки
+        для одного и того же текста считаются один раз"""
+        query = self.normalize(query)
+        if query != self._last_query:
+            self._last_query = query
+            self._last_match = self._match(query)
+        return self._last_match
+
+    def _match(self, query):
+        docs = self.docs
+        if len(query) < 3:
+            # Для 1-2 символов наличие n-граммы и есть вхождение подстроки
+            return set(self.grams.get(query, ())), {}
+        
+        postings = sorted((self.grams.get(gram, set()) for gram in self.ngrams(query, 3)), key=len)
+        exact = postings[0].intersection(*postings[1:])
+        exact = {sound_id for sound_id in exact
+                 if query in docs[sound_id][1] or query in docs[sound_id][2]}
+        
+        fuzzy = {}
+        if len(exact) < self.FUZZY_FALLBACK:
+            query_grams = self.ngrams(f" {query} ", 3)
+            shared = {}
+            for gram in query_grams:
+                for sound_id in self.grams.get(gram, ()):
+                    shared[sound_id] = shared.get(sound_id, 0) + 1
+            min_shared = len(query_grams) * self.FUZZY_MIN_SHARE
+            for sound_id, count in shared.items():
+                if count >= min_shared and sound_id not in exact:
+                    # Похожесть учитывает и длину имени: короткие ближе к запросу
+                    fuzzy[sound_id] = count / len(query_grams) + count / len(docs[sound_id][3])
+        return exact, fuzzy
+
+    def matching_ids(self, query):
+        """Множество sound_id для фильтра списка; None - фильтр пустой"""
+        if not self.normalize(query):
+            return None
+        exact, fuzzy = self.match(query)
+        return exact | fuzzy.keys()
+
+    def search(self, query, limit=None):
+        """Возвращает подходящие записи в порядке релевантности"""
+        exact, fuzzy = self.match(query)
+        query = self._last_query
+        ranked = []
+        for sound_id in exact:
+            entry, name_text, file_text, _ = self.docs[sound_id]
+            if name_text.startswith(query):
+                tier = 0
+            elif f" {query}" in f" {name_text}":
+                tier = 1
+            elif query in name_text:
+                tier = 2
+            else:
+                tier = 3
+            ranked.append((tier, 0.0, -entry.play_count, name_text, sound_id))
+        for sound_id, similarity in fuzzy.items():
+            entry, name_text = self.docs[sound_id][:2]
+            ranked.append((4, -similarity, -entry.play_count, name_text, sound_id))
+        
+        if limit is not None:
+            ranked = heapq.nsmallest(limit, ranked)
+        else:
+            ranked.sort()
+        return [self.docs[item[4]][0] for item in ranked]
+
+# -------------------------
+# Suggestion Panel Class
+# -------------------------
+class SuggestionPanel(BoxLayout):
+    """Постоянная панель подсказок под строкой поиска.
+    Создается один раз; строки-кнопки переиспользуются между запросами."""
+    ROW_HEIGHT = 40
+    MAX_ROWS = 5
+
+    def __init__(self, on_select, **kwargs):
+        super().__init__(orientation='vertical', size_hint=(None, None), **kwargs)
+        self.on_select = on_select
+        self.is_open = False
+        self.anchor = None
+        
+        with self.canvas.before:
+            Color(0.7, 0.7, 0.8, 1)
+            self.rect = RoundedRectangle(pos=self.pos, size=self.size, radius=[6])
+        self.bind(pos=self.update_rect, size=self.update_rect)
+        
+        self.rows = []
+        for _ in range(self.MAX_ROWS):
+            row = Button(
+                size_hint_y=None,
+                height=self.ROW_HEIGHT,
+                background_color=(0.9, 0.9, 0.95, 1),
+                background_normal='',
+                color=(0.2, 0.2, 0.2, 1),
+                font_size='14sp'
+            )
+            row.bind(on_release=lambda btn: self.on_select(btn.text))
+            self.rows.append(row)
+
+    def update_rect(self, *args):
+        self.rect.pos = self.pos
+        self.rect.size = self.size
+
+    def show(self, names, anchor):
+        """Показывает names под виджетом anchor, переиспользуя строки"""
+        if not names:
+            self.hide()
+            return
+        
+        names = names[:self.MAX_ROWS]
+        for row, name in zip(self.rows, names):
+            row.text = name
+        # Добавляем или убираем строки только при изменении их количества
+        visible = len(self.children)
+        for row in self.rows[visible:len(names)]:
+            self.add_widget(row)
+        for row in self.rows[len(names):visible]:
+            self.remove_widget(row)
+        
+        self.height = len(names) * self.ROW_HEIGHT
+        if not self.is_open:
+            self.anchor = anchor
+            # Панель следует за строкой поиска при повороте и изменении окна
+            Window.bind(size=self.reposition)
+            anchor.bind(pos=self.reposition, size=self.reposition)
+            Window.add_widget(self)
+            self.is_open = True
+        self.reposition()
+
+    def reposition(self, *args):
+        if self.anchor is None:
+            return
+        self.width = Window.width * 0.9
+        _, anchor_y = self.anchor.to_window(self.anchor.x, self.anchor.y)
+        self.pos = ((Window.width - self.width) / 2, anchor_y - self.height)
+
+    def hide(self):
+        if self.is_open:
+            Window.unbind(size=self.reposition)
+            self.anchor.unbind(pos=self.reposition, size=self.reposition)
+            Window.remove_widget(self)
+            self.anchor = None
+            self.is_open = False
+
+    def on_touch_down(self, touch):
+        # Панель лежит поверх окна: касание мимо нее и строки поиска закрывает
+        # подсказки и уходит дальше, к списку звуков
+        if self.collide_point(*touch.pos):
+            return super().on_touch_down(touch)
+        if self.anchor is None or not self.anchor.collide_point(*self.anchor.to_widget(*touch.pos)):
+            self.hide()
+        return False
+
+# -------------------------
+# Smart Search Input Class
+# -------------------------
+class SmartSearchInput(TextInput):
+    SUGGEST_DELAY = 0.15  # Пауза в наборе, после которой обновляются подсказки
+
+    def __init__(self, app, **kwargs):
+        super().__init__(**kwargs)
+        self.app = app
+        self.suggestions_panel = SuggestionPanel(self.select_suggestion)
+        # Все нажатия за время паузы схлопываются в одно обновление
+        self._suggest_trigger = Clock.create_trigger(self.update_suggestions, self.SUGGEST_DELAY)
+        self._selecting = False
+    
+    def on_text(self, instance, value):
+        if self._selecting:
+            return
+        # Показываем подсказки если введено 2+ символа
+        if len(value) >= 2:
+            self._suggest_trigger()
+        else:
+            self._suggest_trigger.cancel()
+            self.suggestions_panel.hide()
+    
+    def on_focus(self, instance, focused):
+        if not focused:
+            # Откладываем до следующего кадра: тап по подсказке тоже снимает фокус
+            Clock.schedule_once(lambda dt: self.hide_suggestions() if not self.focus else None)
+
+    def on_text_validate(self):
+        self.hide_suggestions()
+
+    def keyboard_on_key_down(self, window, keycode, text, modifiers):
+        if keycode[1] == 'escape' and self.suggestions_panel.is_open:
+            self.hide_suggestions()
+            return True
+        return super().keyboard_on_key_down(window, keycode, text, modifiers)
+
+    def hide_suggestions(self):
+        self._suggest_trigger.cancel()
+        self.suggestions_panel.hide()
+
+    def update_suggestions(self, *args):
+        """Обновляет подсказки для текущего текста.
+        Запрос берется в момент отрисовки, поэтому устаревший текст не показывается"""
+        query = self.text
+        if len(query) < 2:
+            self.suggestions_panel.hide()
+            return
+        self.show_suggestions(query)
+    
+    def show_suggestions(self, query):
+        """Показывает подсказки для поиска"""
+        # Лучшие совпадения из индекса (тот же запрос, что и у фильтра списка)
+        matching_sounds = [entry.name for entry in self.app.search_index.search(
+            query, limit=SuggestionPanel.MAX_ROWS)]
+        self.suggestions_panel.show(matching_sounds, self)
+    
+    def select_suggestion(self, suggestion):
+        """Выбирает подсказку и применяет её"""
+        self._suggest_trigger.cancel()
+        self.suggestions_panel.hide()
+        # Выбранное имя не должно снова открывать подсказки
+        self._selecting = True
+        try:
+            self.text = suggestion
+        finally:
+            self._selecting = False
+        
+        # Применяем фильтр
+        self.app.filter_buttons()
+
+# -------------------------
+# HTTP Client Class
+# -------------------------
+def create_http_session(user_agent, pool_size=4):
+    """Общая HTTP-сессия приложения: соединения и TLS переиспользуются между запросами"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers['User-Agent'] = user_agent
+    return session
+
+
+def parse_version(text):
+    """'v1.4.0-rc2' -> ((1, 4), 0, ((1, 0, 'rc'), (0, 2, ''))).
+    Релиз выше своих пре-релизов, числа в суффиксе сравниваются как числа (rc2 < rc10)"""
+    text = str(text).strip().lstrip('vV').partition('+')[0]
+    match = re.match(r'(\d+(?:\.\d+)*)(.*)', text)
+    core, pre = (match.group(1), match.group(2)) if match else ('0', text)
+    numbers = [int(piece) for piece in core.split('.')]
+    # 1.4 и 1.4.0 - одна и та же версия
+    while len(numbers) > 1 and numbers[-1] == 0:
+        numbers.pop()
+    # Суффикс с дефисом или без: 1.4.0-beta2, 1.4.0rc10
+    pre = tuple((0, int(token), '') if token.isdigit() else (1, 0, token.lower())
+                for token in re.findall(r'\d+|[A-Za-z]+', pre))
+    return tuple(numbers), 0 if pre else 1, pre
+
+
+def is_newer_version(latest, current):
+    return parse_version(latest) > parse_version(current)
+
+
+class UpdateChecker:
+    """Проверка обновлений с условными запросами.
+
+    ETag/Last-Modified и последний ответ хранятся в update_cache.json,
+    поэтому повторная проверка получает 304 без тела. Сеть опрашивается
+    не чаще CHECK_INTERVAL, в промежутке используется сохраненный ответ.
+    check_async выполняет проверку в фоне: сетевые ошибки и ответы 5xx
+    повторяются с экспоненциальной задержкой и случайным разбросом,
+    в главный поток передается только итоговый результат.
+    """
+    CHECK_INTERVAL = 12 * 3600
+    ATTEMPTS = 4
+    BACKOFF_BASE = 5.0
+    BACKOFF_MAX = 120.0
+
+    def __init__(self, app, url):
+        self.app = app
+        self.url = url
+        self.cache_file = os.path.join(app.save_dir, 'update_cache.json')
+        self.cache = self._load()
+        self.worker = None
+        self.stop_event = threading.Event()
+
+    def check_async(self, callback, force=False):
+        """Запускает проверку в фоне; callback(data) вызывается в главном потоке"""
+        if self.worker is not None and self.worker.is_alive():
+            return
+        self.stop_event.clear()
+        self.worker = threading.Thread(target=self._run, args=(callback, force), daemon=True)
+        self.worker.start()
+
+    def cancel(self):
+        self.stop_event.set()
+
+    def _run(self, callback, force):
+        for attempt in range(self.ATTEMPTS):
+            try:
+                data = self.check(force)
+                break
+            except Exception as e:
+                if not self.should_retry(e) or attempt == self.ATTEMPTS - 1:
+                    print(f"Update check error: {e}")
+                    return
+                # Полный разброс не дает всем клиентам повторять запрос одновременно
+                delay = random.uniform(0, min(self.BACKOFF_MAX, self.BACKOFF_BASE * 2 ** attempt))
+                print(f"Update check failed ({e}), retrying in {delay:.1f}s")
+                if self.stop_event.wait(delay):
+                    return
+        if not self.stop_event.is_set():
+            Clock.schedule_once(lambda dt: callback(data))
+
+    @staticmethod
+    def should_retry(error):
+        """Повторяются только сетевые сбои и ошибки сервера (5xx);
+        4xx и битый ответ повтор не исправит"""
+        if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+            return True
+        response = getattr(error, 'response', None)
+        return isinstance(error, requests.exceptions.HTTPError) and \
+            response is not None and response.status_code >= 500
+
+    def _load(self):
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+            if cache.get('url') == self.url:
+                return cache
+        except (OSError, ValueError):
+            pass
+        return {}
+
+    def _save(self):
+        temp_file = self.cache_file + '.tmp'
+        try:
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(self.cache, f)
+            os.replace(temp_file, self.cache_file)
+        except OSError as e:
+            print(f"Error saving update cache: {e}")
+
+    def check(self, force=False):
+        """Возвращает данные update.json из сети или из кэша"""
+        now = time.time()
+        cached = self.cache.get('data')
+        if cached is not None and not force and now - self.cache.get('checked_at', 0) < self.CHECK_INTERVAL:
+            print("Update info is fresh, skipping network check")
+            return cached
+        
+        headers = {}
+        if cached is not None:
+            if self.cache.get('etag'):
+                headers['If-None-Match'] = self.cache['etag']
+            if self.cache.get('last_modified'):
+                headers['If-Modified-Since'] = self.cache['last_modified']
+        
+        response = self.app.http.get(self.url, headers=headers, timeout=10)
+        if response.status_code == 304 and cached is not None:
+            print("Update info not modified")
+        elif response.status_code == 200:
+            self.cache = {
+                'url': self.url,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'data': response.json()
+            }
+        else:
+            raise requests.exceptions.HTTPError(f"HTTP {response.status_code}", response=response)
+        self.cache['checked_at'] = now
+        self._save()
+        return self.cache['data']
+
+
 # -------------------------
-# Sound Cache Class
+# Download Manager Class
 # -------------------------
-class SoundCache:
-    def __init__(self, max_size=10):
-        self.max_size = max_size
-        self.cache = {}
-        self.access_order = []
-    
-    def get_sound(self, path):
-        if path in self.cache:
-            # Перемещаем в конец (самый недавний)
-            if path in self.access_order:
-                self.access_order.remove(path)
-            self.access_order.append(path)
-            print(f"Sound cache hit: {os.path.basename(path)}")
-            return self.cache[path]
-        print(f"Sound cache miss: {os.path.basename(path)}")
+def probe_audio_file(path):
+    """Проверяет сигнатуру аудиофайла по первым байтам, без декодирования.
+    Возвращает формат ('mp3', 'wav', 'ogg', 'm4a', 'flac') или None"""
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(12)
+    except OSError:
         return None
+    if head[:3] == b'ID3' or (len(head) > 1 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0):
+        return 'mp3'
+    if head[:4] == b'RIFF' and head[8:12] == b'WAVE':
+        return 'wav'
+    if head[:4] == b'OggS':
+        return 'ogg'
+    if head[4:8] == b'ftyp':
+        return 'm4a'
+    if head[:4] == b'fLaC':
+        return 'flac'
+    return None
+
+
+def parse_import_list(text):
+    """Разбирает список массового импорта: JSON-манифест или по одному url в строке.
+    Манифест - список объектов {"url", "name", "icon"} (или {"sounds": [...]}).
+    Возвращает [(url, name, icon_url)]; ValueError при битом JSON"""
+    text = text.strip()
+    if text[:1] in ('[', '{'):
+        data = json.loads(text)
+        if isinstance(data, dict):
+            data = data.get('sounds', [])
+        items = []
+        for item in data:
+            if isinstance(item, str):
+                items.append((item.strip(), None, None))
+            elif isinstance(item, dict) and item.get('url'):
+                items.append((str(item['url']).strip(), item.get('name'), item.get('icon')))
+        return items
+    return [(line.strip(), None, None) for line in text.splitlines()
+            if line.strip() and not line.strip().startswith('#')]
+
+
+def import_filename(url, name=None):
+    """Имя файла для загрузки: из имени в манифесте или из пути url"""
+    ext = os.path.splitext(urlparse(url).path)[1].lower()
+    if ext not in LibraryIndex.AUDIO_EXTENSIONS:
+        ext = '.mp3'
+    if name:
+        base = ''.join(ch if ch.isalnum() or ch in ' -_' else '_' for ch in str(name)).strip()
+    else:
+        base = os.path.splitext(os.path.basename(unquote(urlparse(url).path)))[0]
+    return (base or 'sound') + ext
+
+
+class DownloadTask:
+    """Одна загрузка в очереди менеджера"""
+    def __init__(self, task_id, url, filepath, kind='sound', batch=None):
+        self.task_id = task_id
+        self.url = url
+        self.filepath = filepath
+        self.filename = os.path.basename(filepath)
+        self.kind = kind  # sound или icon
+        self.batch = batch
+        self.owner = None  # Для иконки - задача ее звука
+        self.duplicate_of = None  # Такой звук уже есть в библиотеке
+        self.hasher = None
+        self.partial_key = None  # Имя файла в .downloads
+        self.status = 'queued'  # queued, downloading, done, failed, cancelled
+        self.downloaded = 0
+        self.total = 0
+        self.error = ""
+        self.cancel_event = threading.Event()
+
+    @property
+    def is_active(self):
+        return self.status in ('queued', 'downloading')
+
+    def status_text(self):
+        if self.status == 'downloading':
+            if self.total > 0:
+                return f"{self.downloaded * 100 // self.total}%"
+            return f"{self.downloaded // 1024}KB"
+        if self.status == 'failed':
+            return f"failed: {self.error}"
+        if self.status == 'done' and self.duplicate_of:
+            return "already in library"
+        return self.status
+
+
+class DownloadBatch:
+    """Массовый импорт: звуки добавляются в библиотеку разом, когда загрузки закончатся"""
+    def __init__(self, on_committed=None):
+        self.tasks = []
+        self.committed = False
+        self.added = 0
+        self.on_committed = on_committed
+
+    @property
+    def is_active(self):
+        return any(task.is_active for task in self.tasks)
+
+    def progress_text(self):
+        sounds = [task for task in self.tasks if task.kind == 'sound']
+        failed = sum(1 for task in sounds if task.status in ('failed', 'cancelled'))
+        if self.committed:
+            text = f"Added {self.added} of {len(sounds)} sounds"
+        else:
+            done = sum(1 for task in sounds if task.status == 'done')
+            text = f"Downloaded {done}/{len(sounds)}"
+        duplicates = sum(1 for task in sounds if task.duplicate_of)
+        if duplicates:
+            text += f", {duplicates} already in library"
+        if failed:
+            text += f", {failed} failed"
+        return text
+
+
+class DownloadManager:
+    """Загрузки по URL в фоновых потоках.
+
+    До MAX_WORKERS загрузок идут одновременно, остальные ждут в очереди.
+    Потоки сообщают о прогрессе в главный поток не чаще PROGRESS_INTERVAL.
+    Список загрузок живет в менеджере, поэтому закрытие окна их не прерывает.
     
-    def add_sound(self, path, sound):
-        if len(self.cache) >= self.max_size:
-            # Удаляем самый старый
-            if self.access_order:
-                oldest = self.access_order.pop(0)
-                if oldest in self.cache:
-                    print(f"Removing from cache: {os.path.basename(oldest)}")
-                    if hasattr(self.cache[oldest], 'unload'):
-                        self.cache[oldest].unload()
-                    del self.cache[oldest]
-        
-        self.cache[path] = sound
-        self.access_order.append(path)
-        print(f"Added to cache: {os.path.basename(path)} (cache size: {len(self.cache)})")
-    
-    def preload_sounds(self, sound_paths):
-        """Предзагружает первые несколько звуков для быстрого доступа"""
-        print(f"Preloading {min(3, len(sound_paths))} sounds...")
-        for path in sound_paths[:3]:  # Предзагружаем первые 3 звука
-            if path not in self.cache:
-                sound = SoundLoader.load(path)
-                if sound:
-                    self.add_sound(path, sound)
-    
-    def clear_cache(self):
-        """Очищает кэш"""
-        for sound in self.cache.values():
-            if hasattr(sound, 'unload'):
-                sound.unload()
-        self.cache.clear()
-        self.access_order.clear()
-        print("Sound cache cleared")
+    Данные пишутся в .downloads/<хэш url>.part (у каждой задачи свой файл);
+    при обрыве загрузка продолжается запросом Range (If-Range защищает
+    от смены файла на сервере).
+    Готовый файл проверяется по длине и атомарно переносится в папку звуков.
+    """
+    MAX_WORKERS = 3
+    CHUNK_SIZE = 64 * 1024
+    PROGRESS_INTERVAL = 0.25
+    HISTORY = 20  # Сколько завершенных загрузок держать в списке
+    RETRIES = 3  # Повторы с докачкой при обрыве соединения
+    PARTIAL_MAX_AGE = 7 * 24 * 3600  # Брошенные недокачанные части старше недели удаляются
 
-# -------------------------
-# Smart Search Input Class
-# -------------------------
-class SmartSearchInput(TextInput):
-    def __init__(self, app, **kwargs):
-        super().__init__(**kwargs)
+    def __init__(self, app):
         self.app = app
-        self.suggestions_popup = None
-        self.suggestions = []
-    
-    def on_text(self, instance, value):
-        super().on_text(instance, value)
-        
-        # Закрываем предыдущие подсказки
-        if self.suggestions_popup:
-            self.suggestions_popup.dismiss()
-            self.suggestions_popup = None
+        self.tasks = []
+        self.jobs = queue.Queue()
+        self.workers = 0
+        self.threads = []
+        self.lock = threading.Lock()
+        self.listeners = []
+        self._next_id = 1
+        self.closing = False
+
+    def add_listener(self, callback):
+        """callback(task) вызывается в главном потоке при изменении загрузки"""
+        if callback not in self.listeners:
+            self.listeners.append(callback)
+
+    def remove_listener(self, callback):
+        if callback in self.listeners:
+            self.listeners.remove(callback)
+
+    def unique_path(self, filename):
+        """Путь в папке звуков, не занятый ни файлом, ни другой загрузкой"""
+        reserved = {task.filepath for task in self.tasks if task.is_active}
+        filepath = os.path.join(self.app.save_dir, filename)
+        base, ext = os.path.splitext(filename)
+        counter = 1
+        while os.path.exists(filepath) or filepath in reserved or self.app.bundled_sounds.name_taken(filepath):
+            filepath = os.path.join(self.app.save_dir, f"{base}_{counter}{ext}")
+            counter += 1
+        return filepath
+
+    def enqueue(self, url, filename):
+        """Ставит загрузку в очередь и возвращает задачу"""
+        task = self._create(url, self.unique_path(filename))
+        self._start(task)
+        return task
+
+    def enqueue_batch(self, items, on_committed=None):
+        """Ставит в очередь массовый импорт [(url, name, icon_url)].
+        Звуки проверяются в рабочих потоках и добавляются одним обновлением списка"""
+        batch = DownloadBatch(on_committed)
+        for url, name, icon_url in items:
+            task = self._create(url, self.unique_path(import_filename(url, name)), batch=batch)
+            if icon_url:
+                # Иконка лежит рядом со звуком под тем же именем
+                icon_ext = os.path.splitext(urlparse(icon_url).path)[1].lower()
+                if icon_ext not in LibraryIndex.ICON_EXTENSIONS:
+                    icon_ext = '.png'
+                icon_path = os.path.join(self.app.save_dir, os.path.splitext(task.filename)[0] + icon_ext)
+                if not os.path.exists(icon_path):
+                    icon = self._create(icon_url, icon_path, kind='icon', batch=batch)
+                    icon.owner = task
+        # Запускаем после создания всех задач - пути уже зарезервированы
+        for task in batch.tasks:
+            self._start(task)
+        if not batch.tasks:
+            self._commit_batch(batch)
+        return batch
+
+    def _create(self, url, filepath, kind='sound', batch=None):
+        task = DownloadTask(self._next_id, url, filepath, kind, batch)
+        task.partial_key = self.partial_key(url, task.task_id)
+        self._next_id += 1
+        self.tasks.append(task)
+        if batch is not None:
+            batch.tasks.append(task)
+        self._trim_history()
+        return task
+
+    def retry(self, task):
+        """Повторяет неудавшуюся загрузку - скачанная часть не теряется"""
+        if task.status != 'failed':
+            return
+        task.filepath = self.unique_path(task.filename)
+        task.filename = os.path.basename(task.filepath)
+        task.error = ""
+        task.cancel_event = threading.Event()
+        self._start(task)
+
+    def _start(self, task):
+        task.status = 'queued'
+        self.jobs.put(task)
+        with self.lock:
+            if self.workers < self.MAX_WORKERS:
+                self.workers += 1
+                worker = threading.Thread(target=self._run, daemon=True)
+                worker.start()
+                self.threads.append(worker)
+        self._dispatch(task)
+
+    def cancel(self, task):
+        if task.status == 'failed':
+            # Отказ от повтора - недокачанная часть больше не нужна
+            self._remove_partial(task)
+            task.status = 'cancelled'
+            self._dispatch(task)
+            return
+        if not task.is_active:
+            return
+        task.cancel_event.set()
+        if task.status == 'queued':
+            task.status = 'cancelled'
+            self._remove_partial(task)
+            self._dispatch(task)
+
+    def shutdown(self):
+        """Останавливает загрузки при выходе, не удаляя скачанные части"""
+        self.closing = True
+        for task in self.tasks:
+            if task.is_active:
+                task.cancel_event.set()
+
+    def active_threads(self):
+        with self.lock:
+            self.threads = [worker for worker in self.threads if worker.is_alive()]
+            return list(self.threads)
+
+    def partial_key(self, url, task_id):
+        """Имя недокачанного файла: хэш url, чтобы докачка пережила перезапуск.
+        Если файл уже занят другой задачей с тем же url, добавляется номер задачи"""
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()[:16]
+        if any(task.partial_key == key and (task.is_active or task.status == 'failed')
+               for task in self.tasks):
+            key = f"{key}-{task_id}"
+        return key
+
+    def partial_paths(self, task):
+        """Пути недокачанного файла задачи и его метаданных"""
+        partial_dir = os.path.join(self.app.save_dir, '.downloads')
+        return (os.path.join(partial_dir, task.partial_key + '.part'),
+                os.path.join(partial_dir, task.partial_key + '.json'))
+
+    def prune_partials(self):
+        """Удаляет в фоне брошенные части из .downloads: те, на которые
+        не ссылается ни одна задача, и не менявшиеся дольше PARTIAL_MAX_AGE"""
+        keep = {task.partial_key for task in self.tasks
+                if task.is_active or task.status == 'failed'}
+        partial_dir = os.path.join(self.app.save_dir, '.downloads')
+        threading.Thread(target=self._prune_partials, args=(partial_dir, keep),
+                         daemon=True).start()
+
+    def _prune_partials(self, partial_dir, keep):
+        try:
+            items = list(os.scandir(partial_dir))
+        except OSError:
+            return
+        # .part и .json одной загрузки живут и удаляются вместе
+        touched = {}
+        for item in items:
+            key, ext = os.path.splitext(item.name)
+            if ext not in ('.part', '.json') or key in keep:
+                continue
+            try:
+                mtime = item.stat().st_mtime
+            except OSError:
+                continue
+            touched[key] = max(touched.get(key, 0), mtime)
+        deadline = time.time() - self.PARTIAL_MAX_AGE
+        for key, mtime in touched.items():
+            if mtime < deadline:
+                for ext in ('.part', '.json'):
+                    self._remove_file(os.path.join(partial_dir, key + ext))
+                print(f"Removed stale partial download: {key}")
+
+    def active_count(self):
+        return sum(1 for task in self.tasks if task.is_active)
+
+    def _trim_history(self):
+        finished = [task for task in self.tasks if not task.is_active]
+        for task in finished[:max(0, len(finished) - self.HISTORY)]:
+            self.tasks.remove(task)
+
+    def _run(self):
+        """Рабочий поток: берет загрузки из очереди, пока она не опустеет"""
+        while True:
+            with self.lock:
+                try:
+                    task = self.jobs.get_nowait()
+                except queue.Empty:
+                    self.workers -= 1
+                    return
+            if task.cancel_event.is_set():
+                continue
+            try:
+                self._download(task)
+            except requests.exceptions.Timeout:
+                self._fail(task, "timeout")
+            except requests.exceptions.ConnectionError:
+                self._fail(task, "connection error")
+            except Exception as e:
+                self._fail(task, str(e))
+
+    def _download(self, task):
+        task.status = 'downloading'
+        self._notify(task)
+        part_path, meta_path = self.partial_paths(task)
+        os.makedirs(os.path.dirname(part_path), exist_ok=True)
         
-        # Показываем подсказки если введено 2+ символа
-        if len(value) >= 2:
-            self.show_suggestions(value)
-    
-    def show_suggestions(self, query):
-        """Показывает подсказки для поиска"""
-        # Получаем совпадения
-        matching_sounds = []
-        for btn in self.app.buttons:
-            if query.lower() in btn.btn_text.lower():
-                matching_sounds.append(btn.btn_text)
+        for attempt in range(self.RETRIES + 1):
+            if task.cancel_event.is_set():
+                break
+            try:
+                self._fetch(task, part_path, meta_path)
+                break
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    requests.exceptions.ChunkedEncodingError) as e:
+                if task.cancel_event.is_set():
+                    break
+                if attempt == self.RETRIES:
+                    raise
+                print(f"Download interrupted ({e}), resuming in {2 ** attempt}s...")
+                task.cancel_event.wait(2 ** attempt)
         
-        if not matching_sounds:
+        if task.cancel_event.is_set():
+            if self.closing:
+                # Приложение закрывается - часть остается для докачки
+                return
+            self._remove_partial(task)
+            task.status = 'cancelled'
+            self._notify(task)
             return
         
-        # Создаем контент для попапа
-        content = BoxLayout(orientation='vertical', size_hint=(1, None))
-        content.bind(minimum_height=content.setter('height'))
-        
-        # Добавляем до 5 подсказок
-        for suggestion in matching_sounds[:5]:
-            suggestion_btn = Button(
-                text=suggestion,
-                size_hint_y=None,
-                height=40,
-                background_color=(0.9, 0.9, 0.95, 1),
-                background_normal='',
-                color=(0.2, 0.2, 0.2, 1),
-                font_size='14sp'
-            )
-            suggestion_btn.bind(on_release=lambda x, s=suggestion: self.select_suggestion(s))
-            content.add_widget(suggestion_btn)
+        size = os.path.getsize(part_path)
+        if task.total and size != task.total:
+            # Часть остается на диске - повтор продолжит с этого места
+            raise IOError(f"incomplete download ({size} of {task.total} bytes)")
+        if task.batch is not None and task.kind == 'sound' and probe_audio_file(part_path) is None:
+            # В пакете звук проверяется здесь, а не декодированием в главном потоке
+            self._remove_partial(task)
+            raise IOError("not a playable sound")
+        if task.kind == 'sound':
+            path, is_new = self.app.content_index.commit_import(part_path, task.filepath,
+                                                                task.hasher.hexdigest())
+            if not is_new:
+                task.duplicate_of = path
+        else:
+            os.replace(part_path, task.filepath)
+        self._remove_file(meta_path)
+        Clock.schedule_once(lambda dt: self._finish(task))
+
+    def _fetch(self, task, part_path, meta_path):
+        """Качает url в part_path, продолжая с уже скачанного места"""
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        meta = {}
+        if offset:
+            try:
+                with open(meta_path, 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                meta = {}
+        # Без сжатия: Range и Content-Length считаются по байтам файла, а
+        # iter_content распаковал бы gzip, и длина с докачкой перестали бы сходиться
+        headers = {'Accept-Encoding': 'identity'}
+        if offset and meta.get('validator'):
+            headers['Range'] = f'bytes={offset}-'
+            headers['If-Range'] = meta['validator']
+        else:
+            offset = 0
         
-        # Создаем и показываем попап
-        self.suggestions_popup = Popup(
-            content=content,
-            size_hint=(0.9, None),
-            height=min(len(matching_sounds) * 40, 200),
-            pos_hint={'center_x': 0.5, 'top': 0.1},
-            background='',
-            separator_color=(0.7, 0.7, 0.8, 1)
-        )
-        self.suggestions_popup.open()
-    
-    def select_suggestion(self, suggestion):
-        """Выбирает подсказку и применяет её"""
-        self.text = suggestion
-        if self.suggestions_popup:
-            self.suggestions_popup.dismiss()
-            self.suggestions_popup = None
+        response = self.app.http.get(task.url, stream=True, timeout=30, headers=headers)
+        try:
+            if response.status_code == 416 and meta.get('total') == offset:
+                # Файл уже скачан целиком
+                task.total = task.downloaded = offset
+                task.hasher = new_content_hash()
+                with open(part_path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(self.CHUNK_SIZE), b''):
+                        task.hasher.update(chunk)
+                return
+            response.raise_for_status()
+            if response.status_code == 206:
+                # Content-Range: bytes start-end/total
+                content_range = response.headers.get('Content-Range', '')
+                start, _, total = content_range.replace('bytes ', '').partition('/')
+                if int(start.split('-')[0]) != offset:
+                    raise IOError(f"unexpected range: {content_range}")
+                task.total = int(total) if total.isdigit() else 0
+                mode = 'ab'
+                # Дайджест продолжает уже скачанную часть
+                task.hasher = new_content_hash()
+                with open(part_path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(self.CHUNK_SIZE), b''):
+                        task.hasher.update(chunk)
+            else:
+                # Сервер не поддерживает докачку или файл изменился - с начала
+                offset = 0
+                task.total = int(response.headers.get('content-length', 0))
+                mode = 'wb'
+                task.hasher = new_content_hash()
+            
+            validator = response.headers.get('ETag') or response.headers.get('Last-Modified')
+            if validator and validator.startswith('W/'):
+                validator = None  # Слабый ETag нельзя использовать в If-Range
+            if response.headers.get('Content-Encoding', 'identity').lower() != 'identity':
+                # Сервер все равно сжал ответ: длина и диапазоны относятся к сжатым байтам
+                if mode == 'ab':
+                    raise IOError("compressed range response")
+                task.total = 0
+                validator = None
+            with open(meta_path, 'w', encoding='utf-8') as f:
+                json.dump({'url': task.url, 'validator': validator, 'total': task.total}, f)
+            
+            task.downloaded = offset
+            last_notify = 0.0
+            with open(part_path, mode) as f:
+                for chunk in response.iter_content(chunk_size=self.CHUNK_SIZE):
+                    if task.cancel_event.is_set():
+                        break
+                    if chunk:
+                        f.write(chunk)
+                        task.hasher.update(chunk)
+                        task.downloaded += len(chunk)
+                        now = time.monotonic()
+                        if now - last_notify >= self.PROGRESS_INTERVAL:
+                            last_notify = now
+                            self._notify(task)
+        finally:
+            response.close()
+
+    def _fail(self, task, message):
+        task.status = 'failed'
+        task.error = message
+        print(f"Download failed ({task.url}): {message}")
+        self._notify(task)
+
+    def _remove_partial(self, task):
+        for path in self.partial_paths(task):
+            self._remove_file(path)
+
+    @staticmethod
+    def _remove_file(filepath):
+        try:
+            if os.path.exists(filepath):
+                os.remove(filepath)
+        except OSError:
+            pass
+
+    def _finish(self, task):
+        """Главный поток: добавляет скачанный звук в библиотеку"""
+        if task.kind == 'icon' or task.duplicate_of or \
+                (task.batch is not None and not task.batch.committed):
+            # Звуки пакета добавляются все вместе в _commit_batch,
+            # а дубликат ссылается на уже существующую запись
+            task.status = 'done'
+        elif self.app.add_sound_button(task.filepath):
+            task.status = 'done'
+            self.app.transcoder.submit(task.filepath)
+        else:
+            self._remove_file(task.filepath)
+            task.status = 'failed'
+            task.error = "not a playable sound"
+        self._dispatch(task)
+
+    def _notify(self, task):
+        """Из рабочего потока: передает изменение в главный поток"""
+        Clock.schedule_once(lambda dt: self._dispatch(task))
+
+    def _dispatch(self, task):
+        for callback in self.listeners[:]:
+            callback(task)
+        batch = task.batch
+        if batch is not None and not batch.committed and not batch.is_active:
+            self._commit_batch(batch)
+
+    def _commit_batch(self, batch):
+        """Главный поток: все загрузки пакета закончены - добавляем звуки разом"""
+        batch.committed = True
+        sounds = [task for task in batch.tasks
+                  if task.kind == 'sound' and task.status == 'done' and not task.duplicate_of]
+        for task in batch.tasks:
+            if task.kind == 'icon' and task.status == 'done' and \
+                    (task.owner.status != 'done' or task.owner.duplicate_of):
+                self._remove_file(task.filepath)
         
-        # Применяем фильтр
-        self.app.filter_buttons()
+        entries = self.app.add_sound_batch([task.filepath for task in sounds])
+        added = {entry.path for entry in entries}
+        for task in sounds:
+            if task.filepath in added:
+                self.app.transcoder.submit(task.filepath)
+            else:
+                self._remove_file(task.filepath)
+                task.status = 'failed'
+                task.error = "sound already exists"
+                self._dispatch(task)
+        batch.added = len(entries)
+        print(f"Bulk import finished: {batch.progress_text()}")
+        if batch.on_committed:
+            batch.on_committed(batch)
 
 # -------------------------
 # URL Download Popup Class
 # -------------------------
+class DownloadRow(BoxLayout):
+    """Строка списка загрузок: имя, состояние и кнопка отмены"""
+    def __init__(self, manager, task, **kwargs):
+        super().__init__(orientation='horizontal', size_hint_y=None, height=40, spacing=10, **kwargs)
+        self.manager = manager
+        self.task = task
+        self.label = Label(
+            size_hint_x=0.75,
+            font_size='13sp',
+            halign='left',
+            valign='middle',
+            shorten=True,
+            color=(1, 1, 1, 0.9)
+        )
+        self.label.bind(size=self.label.setter('text_size'))
+        self.cancel_btn = Button(
+            text="X",
+            size_hint_x=0.25,
+            background_color=(0.8, 0.3, 0.3, 1),
+            background_normal='',
+            color=(1, 1, 1, 1)
+        )
+        self.cancel_btn.bind(on_release=self.on_button)
+        self.add_widget(self.label)
+        self.add_widget(self.cancel_btn)
+        self.update()
+
+    def update(self):
+        self.label.text = f"{self.task.filename}: {self.task.status_text()}"
+        # Неудачную загрузку можно повторить с места обрыва
+        self.cancel_btn.text = "Retry" if self.task.status == 'failed' else "X"
+        self.cancel_btn.disabled = not (self.task.is_active or self.task.status == 'failed')
+
+    def on_button(self, instance):
+        if self.task.status == 'failed':
+            self.manager.retry(self.task)
+        else:
+            self.manager.cancel(self.task)
+
+
 class URLDownloadPopup(Popup):
     def __init__(self, app, **kwargs):
         super().__init__(**kwargs)
         self.app = app
+        self.manager = app.download_manager
         self.title = "Download from URL"
-        self.size_hint = (0.9, 0.6)
+        self.size_hint = (0.9, 0.8)
         self.auto_dismiss = False
         self.background = ''
+        self.rows = {}  # task_id -> DownloadRow
 
         # Основной контейнер
         content = BoxLayout(orientation='vertical', spacing=15, padding=20)
@@ -217,6 +3417,15 @@ class URLDownloadPopup(Popup):
         )
         content.add_widget(self.status_label)
 
+        # Список загрузок (общий для всех открытий окна)
+        downloads_scroll = ScrollView(size_hint=(1, 1))
+        self.downloads_layout = BoxLayout(orientation='vertical', spacing=5, size_hint_y=None)
+        self.downloads_layout.bind(minimum_height=self.downloads_layout.setter('height'))
+        downloads_scroll.add_widget(self.downloads_layout)
+        content.add_widget(downloads_scroll)
+        for task in self.manager.tasks:
+            self.on_task_update(task)
+
         # Кнопки
         btn_layout = BoxLayout(size_hint_y=None, height=60, spacing=15)
         
@@ -228,22 +3437,63 @@ class URLDownloadPopup(Popup):
         )
         download_btn.bind(on_press=self.start_download)
         
-        cancel_btn = Button(
-            text="CANCEL",
+        bulk_btn = Button(
+            text="BULK",
+            background_color=(0.3, 0.5, 0.8, 1),
+            background_normal='',
+            color=(1, 1, 1, 1)
+        )
+        bulk_btn.bind(on_press=lambda x: BulkImportPopup(self.app).open())
+        
+        # Закрытие окна не прерывает загрузки
+        close_btn = Button(
+            text="CLOSE",
             background_color=(0.8, 0.3, 0.3, 1),
             background_normal='',
             color=(1, 1, 1, 1)
         )
-        cancel_btn.bind(on_press=self.dismiss)
+        close_btn.bind(on_press=self.dismiss)
 
         btn_layout.add_widget(download_btn)
-        btn_layout.add_widget(cancel_btn)
+        btn_layout.add_widget(bulk_btn)
+        btn_layout.add_widget(close_btn)
         content.add_widget(btn_layout)
 
         self.content = content
         
         # Привязываем события
         self.url_input.bind(text=self.on_url_change)
+        self.manager.add_listener(self.on_task_update)
+
+    def on_dismiss(self):
+        self.manager.remove_listener(self.on_task_update)
+
+    def on_task_update(self, task):
+        """Обновляет строку загрузки (вызывается в главном потоке)"""
+        if task not in self.manager.tasks:
+            return
+        # Строки загрузок, вытесненных из истории, убираем
+        for task_id, stale in list(self.rows.items()):
+            if stale.task not in self.manager.tasks:
+                self.downloads_layout.remove_widget(stale)
+                del self.rows[task_id]
+        row = self.rows.get(task.task_id)
+        if row is None:
+            row = DownloadRow(self.manager, task)
+            self.rows[task.task_id] = row
+            # Новые загрузки - сверху
+            self.downloads_layout.add_widget(row, index=len(self.downloads_layout.children))
+        else:
+            row.update()
+        if task.status == 'done' and task.duplicate_of:
+            self.status_label.text = f"Already in library: {os.path.basename(task.duplicate_of)}"
+            self.status_label.color = (1, 1, 0.8, 1)
+        elif task.status == 'done':
+            self.status_label.text = f"Added: {task.filename}"
+            self.status_label.color = (0.6, 1, 0.6, 1)
+        elif task.status == 'failed':
+            self.status_label.text = f"Error: {task.filename}: {task.error}"
+            self.status_label.color = (1, 0.5, 0.5, 1)
 
     def on_url_change(self, instance, value):
         """Автоматически извлекаем имя файла из URL"""
@@ -272,105 +3522,212 @@ class URLDownloadPopup(Popup):
             self.status_label.color = (1, 0.5, 0.5, 1)
             return
 
-        # Проверяем расширение файла
-        valid_extensions = ('.mp3', '.wav', '.ogg')
+        # Проверяем расширение файла - те же форматы, что видит сканер библиотеки
+        valid_extensions = LibraryIndex.AUDIO_EXTENSIONS
         if not filename.lower().endswith(valid_extensions):
-            self.status_label.text = "File must be .mp3, .wav or .ogg"
+            self.status_label.text = f"File must be {', '.join(valid_extensions)}"
             self.status_label.color = (1, 0.5, 0.5, 1)
             return
 
-        # Меняем состояние кнопки
-        instance.text = "DOWNLOADING..."
-        instance.background_color = (0.5, 0.5, 0.5, 1)
-        instance.disabled = True
-
-        self.status_label.text = "Starting download..."
+        # Загрузка идет в фоновом потоке менеджера, окно можно закрыть
+        task = self.app.download_manager.enqueue(url, filename)
+        self.status_label.text = f"Queued: {task.filename}"
         self.status_label.color = (1, 1, 0.8, 1)
+        self.url_input.text = ""
+        self.filename_input.text = ""
+
+
+class BulkImportPopup(Popup):
+    """Массовый импорт: список url по строке или JSON-манифест"""
+    def __init__(self, app, **kwargs):
+        super().__init__(**kwargs)
+        self.app = app
+        self.manager = app.download_manager
+        self.batch = None
+        self.title = "Bulk import"
+        self.size_hint = (0.9, 0.8)
+        self.auto_dismiss = False
+        self.background = ''
+
+        content = BoxLayout(orientation='vertical', spacing=15, padding=20)
+        content.add_widget(Label(
+            text="One URL per line or a JSON manifest\n[{\"url\": ..., \"name\": ..., \"icon\": ...}]",
+            size_hint_y=None,
+            height=60,
+            font_size='14sp',
+            halign='center',
+            color=(1, 1, 1, 1)
+        ))
+        self.list_input = TextInput(
+            hint_text="https://example.com/sound1.mp3\nhttps://example.com/sound2.mp3",
+            multiline=True,
+            background_color=(0.9, 0.9, 0.95, 1),
+            foreground_color=(0, 0, 0, 1),
+            hint_text_color=(0.5, 0.5, 0.5, 0.7),
+            padding=[15, 10]
+        )
+        content.add_widget(self.list_input)
+        self.status_label = Label(
+            text="",
+            size_hint_y=None,
+            height=40,
+            font_size='14sp',
+            color=(1, 1, 1, 0.8)
+        )
+        content.add_widget(self.status_label)
+
+        btn_layout = BoxLayout(size_hint_y=None, height=60, spacing=15)
+        self.import_btn = Button(
+            text="IMPORT",
+            background_color=(0.3, 0.6, 0.3, 1),
+            background_normal='',
+            color=(1, 1, 1, 1)
+        )
+        self.import_btn.bind(on_press=self.start_import)
+        close_btn = Button(
+            text="CLOSE",
+            background_color=(0.8, 0.3, 0.3, 1),
+            background_normal='',
+            color=(1, 1, 1, 1)
+        )
+        close_btn.bind(on_press=self.dismiss)
+        btn_layout.add_widget(self.import_btn)
+        btn_layout.add_widget(close_btn)
+        content.add_widget(btn_layout)
+        self.content = content
+        self.manager.add_listener(self.on_task_update)
 
-        # Запускаем загрузку в отдельном потоке
-        Clock.schedule_once(lambda dt: self.download_file(url, filename, instance), 0.1)
+    def on_dismiss(self):
+        self.manager.remove_listener(self.on_task_update)
 
-    def download_file(self, url, filename, button):
-        """Загружает файл по URL"""
+    def show_status(self, text, color=(1, 1, 1, 0.8)):
+        self.status_label.text = text
+        self.status_label.color = color
+
+    def start_import(self, instance):
         try:
-            self.status_label.text = "Connecting..."
-            
-            # Создаем полный путь для сохранения
-            filepath = os.path.join(self.app.save_dir, filename)
-            
-            # Если файл существует, добавляем номер
-            if os.path.exists(filepath):
-                base, ext = os.path.splitext(filename)
-                counter = 1
-                while os.path.exists(filepath):
-                    filepath = os.path.join(self.app.save_dir, f"{base}_{counter}{ext}")
-                    counter += 1
-                filename = os.path.basename(filepath)
-
-            # Загружаем файл
-            response = requests.get(url, stream=True, timeout=30)
-            response.raise_for_status()
-            
-            total_size = int(response.headers.get('content-length', 0))
-            downloaded_size = 0
-            
-            self.status_label.text = f"Downloading: 0%"
-            
-            with open(filepath, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-                        downloaded_size += len(chunk)
-                        
-                        if total_size > 0:
-                            percent = (downloaded_size / total_size) * 100
-                            self.status_label.text = f"Downloading: {percent:.1f}%"
-                        else:
-                            self.status_label.text = f"Downloaded: {downloaded_size // 1024}KB"
-            
-            self.status_label.text = "Download completed!"
-            self.status_label.color = (0.6, 1, 0.6, 1)
-            
-            # Добавляем звук в приложение
-            success = self.app.add_sound_button(filepath)
-            
-            if success:
-                self.status_label.text = "File added successfully!"
-                
-                # Закрываем попап через 1 секунду
-                Clock.schedule_once(lambda dt: self.dismiss(), 1.0)
-            else:
-                self.status_label.text = "Error adding file"
-                self.status_label.color = (1, 0.5, 0.5, 1)
-                # Удаляем файл если не удалось добавить
-                try:
-                    os.remove(filepath)
-                except:
-                    pass
-                
-                # Восстанавливаем кнопку
-                button.text = "DOWNLOAD"
-                button.background_color = (0.3, 0.6, 0.3, 1)
-                button.disabled = False
+            items = parse_import_list(self.list_input.text)
+        except ValueError as e:
+            self.show_status(f"Invalid manifest: {e}", (1, 0.5, 0.5, 1))
+            return
+        valid = [item for item in items if urlparse(item[0]).scheme in ('http', 'https')]
+        if not valid:
+            self.show_status("No valid URLs", (1, 0.5, 0.5, 1))
+            return
+        # Загрузки продолжаются и после закрытия окна
+        self.batch = self.manager.enqueue_batch(valid, on_committed=self.on_batch_committed)
+        skipped = len(items) - len(valid)
+        self.show_status(f"Queued {len(valid)} sounds" + (f", {skipped} invalid skipped" if skipped else ""),
+                         (1, 1, 0.8, 1))
+        self.list_input.text = ""
 
-        except requests.exceptions.Timeout:
-            self.status_label.text = "Download timeout"
-            self.status_label.color = (1, 0.5, 0.5, 1)
-        except requests.exceptions.ConnectionError:
-            self.status_label.text = "Connection error"
-            self.status_label.color = (1, 0.5, 0.5, 1)
-        except requests.exceptions.RequestException as e:
-            self.status_label.text = f"Download error: {str(e)}"
-            self.status_label.color = (1, 0.5, 0.5, 1)
+    def on_task_update(self, task):
+        if self.batch is not None and task.batch is self.batch and not self.batch.committed:
+            self.show_status(self.batch.progress_text(), (1, 1, 0.8, 1))
+
+    def on_batch_committed(self, batch):
+        if batch is self.batch:
+            self.show_status(batch.progress_text(), (0.6, 1, 0.6, 1))
+
+# -------------------------
+# Settings Store Class
+# -------------------------
+class SettingsStore:
+    """Отложенная атомарная запись app_settings.json.
+
+    Изменения только помечают настройки грязными; запись идет не чаще раза
+    в FLUSH_DELAY секунд в фоне. Файл пишется во временный и подменяется
+    через os.replace, поэтому прерванная запись не портит настройки.
+    """
+    FLUSH_DELAY = 2.0
+
+    def __init__(self, path, snapshot):
+        self.path = path
+        self.snapshot = snapshot  # Собирает словарь настроек в главном потоке
+        self.dirty = False
+        self.lock = threading.Lock()
+        self.sequence = 0
+        self.written = 0
+        self._trigger = Clock.create_trigger(self.flush, self.FLUSH_DELAY)
+
+    def mark_dirty(self):
+        """Откладывает запись; серия изменений дает одну запись"""
+        self.dirty = True
+        self._trigger()
+
+    def flush(self, *args, wait=False):
+        """Пишет настройки, если они менялись (в фоне, кроме wait=True)"""
+        self._trigger.cancel()
+        if not self.dirty:
+            return
+        self.dirty = False
+        try:
+            payload = json.dumps(self.snapshot(), ensure_ascii=False, indent=1)
         except Exception as e:
-            self.status_label.text = f"Error: {str(e)}"
-            self.status_label.color = (1, 0.5, 0.5, 1)
+            print(f"Error collecting settings: {e}")
+            return
+        self.sequence += 1
+        sequence = self.sequence
         
-        # Восстанавливаем кнопку в случае ошибки
-        if self.status_label.color == (1, 0.5, 0.5, 1):
-            button.text = "DOWNLOAD"
-            button.background_color = (0.3, 0.6, 0.3, 1)
-            button.disabled = False
+        if wait:
+            self._write(payload, sequence)
+        else:
+            threading.Thread(target=self._write, args=(payload, sequence), daemon=True).start()
+
+    def _write(self, payload, sequence):
+        with self.lock:
+            # Более свежий снимок уже записан другим потоком
+            if sequence <= self.written:
+                return
+            temp_file = self.path + '.tmp'
+            try:
+                with open(temp_file, 'w', encoding='utf-8') as f:
+                    f.write(payload)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(temp_file, self.path)
+                self.written = sequence
+            except OSError as e:
+                print(f"Error saving settings: {e}")
+
+# -------------------------
+# Sound Entry Class
+# -------------------------
+class SoundEntry:
+    """Звук в библиотеке - модель данных, к которой привязываются кнопки.
+    Хранит только путь: сам звук декодируется через SoundCache при проигрывании"""
+    def __init__(self, path, name, icon_path=None, sound_id=None, volume=1.0):
+        self.path = path
+        self.name = name
+        self.icon_path = icon_path
+        self.sound_id = sound_id or os.path.splitext(os.path.basename(path))[0]
+        self.volume = volume
+        self.size = 0
+        self.mtime_ns = 0
+        self.duration = None
+        self.play_count = 0
+        self.last_played = 0.0
+        self.bundled = False  # Встроенный звук из пакета, только для чтения
+        # Результаты анализа (None - еще не анализировался)
+        self.loudness = None
+        self.peak = None
+        self.lead_silence = None
+        self.trail_silence = None
+
+def library_sort_key(entry):
+    """Порядок списка библиотеки - по имени файла, как при сканировании папки"""
+    return os.path.basename(entry.path)
+
+def merge_sorted_entries(entries, new_entries):
+    """Новый список: entries с new_entries, вставленными на свои места по имени файла"""
+    merged = list(entries)
+    keys = [library_sort_key(entry) for entry in merged]
+    for entry in new_entries:
+        key = library_sort_key(entry)
+        position = bisect.bisect_right(keys, key)
+        keys.insert(position, key)
+        merged.insert(position, entry)
+    return merged
 
 # -------------------------
 # SoundButton Class
@@ -378,25 +3735,23 @@ class URLDownloadPopup(Popup):
 class SoundButton(BoxLayout):
     current_button = None
 
-    def __init__(self, text, sound, icon_path=None, app=None, sound_id=None, sound_path=None, **kwargs):
+    def __init__(self, entry=None, app=None, **kwargs):
         super().__init__(**kwargs)
         self.app = app
-        self.sound_id = sound_id or text
-        self.sound_path = sound_path  # Сохраняем путь к файлу для кэширования
+        self.entry = None
         self.orientation = 'horizontal'
         self.size_hint_y = None
         self.height = 150
         self.spacing = 10
         self.padding = [10, 10, 10, 10]
-        self.sound = sound
-        self.btn_text = text
         self.is_expanded = False
         self.pinned = False
-        self.volume = 1.0
-        self.original_icon_path = icon_path
         self.highlight_anim = None
-        self.sound_check_event = None
+        self.active_voices = []  # Играющие экземпляры звука, запущенные этой кнопкой
+        self._retriggering = False
+        self._touch_time = None
         self.expanded_view = None  # Ссылка на расширенное представление
+        self.waveform_view = None
 
         with self.canvas.before:
             Color(0, 0, 0, 0.1)
@@ -407,14 +3762,10 @@ class SoundButton(BoxLayout):
             self.rect = RoundedRectangle(pos=self.pos, size=self.size, radius=[20])
 
         self.original_widgets = []
-        
-        if icon_path and os.path.exists(icon_path):
-            self.icon_widget = Image(source=icon_path, size_hint=(None, 1), width=50)
-            self.original_widgets.append(self.icon_widget)
-            self.add_widget(self.icon_widget)
+        self.icon_widget = Image(size_hint=(None, 1), width=50)
 
         self.button = Button(
-            text=text,
+            text='',
             size_hint=(1, 1),
             background_normal='',
             background_color=(0, 0, 0, 0),
@@ -425,11 +3776,78 @@ class SoundButton(BoxLayout):
         self.button.text_size = (None, None)
         self.button.bind(on_press=self.play_sound)
         self.button.bind(on_touch_down=self.start_long_press, on_touch_up=self.end_long_press)
+
+        self.bind(pos=self.update_rect, size=self.update_rect)
+        self._long_press_trigger = Clock.create_trigger(self.expand, 0.8)
+
+        if entry is not None:
+            self.set_entry(entry)
+
+    @property
+    def btn_text(self):
+        return self.entry.name if self.entry else ''
+
+    @property
+    def sound_id(self):
+        return self.entry.sound_id if self.entry else None
+
+    @property
+    def sound_path(self):
+        return self.entry.path if self.entry else None
+
+    @property
+    def volume(self):
+        return self.entry.volume if self.entry else 1.0
+
+    @volume.setter
+    def volume(self, value):
+        if self.entry:
+            self.entry.volume = value
+
+    def load_sound(self):
+        """Получает звук через кэш приложения - файл декодируется при первом проигрывании"""
+        if self.entry is None or self.app is None:
+            return None
+        return self.app.load_entry_sound(self.entry)
+
+    def set_entry(self, entry):
+        """Привязывает кнопку к звуку (в виртуальном списке строки переиспользуются)"""
+        if entry is self.entry:
+            return
+        if self.entry is not None:
+            self.reset_view_state()
+        self.entry = entry
+        self.update_from_entry()
+
+    def update_from_entry(self):
+        """Обновляет текст и иконку по данным записи"""
+        entry = self.entry
+        self.button.text = entry.name
+
+        # Иконка показывается только если она есть у звука
+        self.original_widgets = []
+        if entry.icon_path:
+            self.icon_widget.source = entry.icon_path
+            self.original_widgets.append(self.icon_widget)
         self.original_widgets.append(self.button)
-        self.add_widget(self.button)
+        if not self.is_expanded:
+            self.restore_original_view()
 
-        self.bind(pos=self.update_rect, size=self.update_rect)
-        self._long_press_trigger = Clock.create_trigger(self.expand, 0.8)
+    def reset_view_state(self):
+        """Мгновенно сбрасывает подсветку и расширенный вид без анимаций"""
+        # Звуки доигрывают, но кнопка больше не ждет их окончания
+        self.active_voices = []
+        if self.highlight_anim:
+            self.highlight_anim.cancel(self.bg_color)
+            self.highlight_anim = None
+        self.bg_color.rgba = (0.25, 0.25, 0.35, 1)
+        if self.is_expanded or self.expanded_view:
+            Animation.cancel_all(self, 'height')
+            if self.expanded_view:
+                Animation.cancel_all(self.expanded_view)
+            self.is_expanded = False
+            self.pinned = False
+            self.height = 150
 
     def update_rect(self, *args):
         self.rect.pos = self.pos
@@ -438,19 +3856,31 @@ class SoundButton(BoxLayout):
         self.shadow.size = (self.width + 4, self.height + 4)
 
     def play_sound(self, instance=None):
-        if SoundButton.current_button and SoundButton.current_button != self:
+        pool = self.app.voice_pool
+        # Другие звуки останавливаются только в режиме exclusive
+        if pool.exclusive and SoundButton.current_button and SoundButton.current_button != self:
             SoundButton.current_button.stop_sound_and_collapse()
         SoundButton.current_button = self
 
-        if self.sound:
-            self.sound.volume = self.volume
-            self.sound.stop()
-            self.sound.play()
-            self.start_highlight()
-            # Отменяем предыдущую проверку и запускаем новую
-            if self.sound_check_event:
-                self.sound_check_event.cancel()
-            self.sound_check_event = Clock.schedule_interval(self.check_sound, 0.1)
+        sound = self.load_sound()
+        if not sound:
+            return
+        
+        # Перезапуск собственного голоса не должен гасить подсветку и сворачивать кнопку
+        analyzer = self.app.sound_analyzer
+        self._retriggering = True
+        try:
+            voice = pool.play(sound, self.sound_path, self.volume * analyzer.gain_for(self.entry),
+                              self.on_playback_finished, start=analyzer.start_offset(self.entry),
+                              tail=analyzer.end_offset(self.entry))
+        finally:
+            self._retriggering = False
+        self.active_voices.append(voice)
+        self.app.latency_probe.begin(voice, self._touch_time or time.time(),
+                                     'instant' if isinstance(voice, InstantSound) else 'standard')
+        self._touch_time = None
+        self.start_highlight()
+        self.app.record_play(self.entry)
 
     def start_highlight(self):
         self.stop_highlight()
@@ -468,23 +3898,23 @@ class SoundButton(BoxLayout):
         # Плавное возвращение к исходному цвету
         Animation(rgba=(0.25, 0.25, 0.35, 1), duration=0.2).start(self.bg_color)
 
-    def check_sound(self, dt):
-        if self.sound and self.sound.state != 'play':
-            # Звук закончил воспроизведение
-            self.stop_highlight()
-            # Отменяем проверку
-            if self.sound_check_event:
-                self.sound_check_event.cancel()
-                self.sound_check_event = None
-            
-            # Сворачиваем если развернуто и не закреплено
-            if self.is_expanded and not getattr(App.get_running_app(), "pin_active", False):
-                self.collapse()
-            return False  # Останавливаем проверку
-        return True  # Продолжаем проверку
+    def on_playback_finished(self, sound):
+        """Голос закончил воспроизведение (или был вытеснен)"""
+        if sound not in self.active_voices:
+            return
+        self.active_voices.remove(sound)
+        if self.active_voices or self._retriggering:
+            return
+        self.stop_highlight()
+        
+        # Сворачиваем если развернуто и не закреплено
+        if self.is_expanded and not getattr(App.get_running_app(), "pin_active", False):
+            self.collapse()
 
     def start_long_press(self, instance, touch):
         if instance.collide_point(*touch.pos):
+            # Время касания нужно для замера задержки до звука
+            self._touch_time = touch.time_start
             # Визуальный feedback при начале long press
             Animation(background_color=(0.3, 0.3, 0.5, 0.3), duration=0.1).start(self.button)
             self._long_press_trigger()
@@ -521,12 +3951,16 @@ class SoundButton(BoxLayout):
         expanded_height = Window.height - top_bar_height - 20  # -20 для отступов
         
         # Плавная анимация расширения
+        self.animate_height(expanded_height, 0.5, self.on_expand_complete)
+
+    def animate_height(self, height, duration, on_complete):
+        """Плавно меняет высоту кнопки при расширении и сворачивании"""
         anim = Animation(
-            height=expanded_height, 
-            duration=0.5, 
+            height=height, 
+            duration=duration, 
             t='out_quad'
         )
-        anim.bind(on_complete=self.on_expand_complete)
+        anim.bind(on_complete=on_complete)
         anim.start(self)
 
     def on_expand_complete(self, *args):
@@ -552,6 +3986,14 @@ class SoundButton(BoxLayout):
         title_label.bind(on_touch_down=self.on_title_touch)
         self.expanded_view.add_widget(title_label)
         
+        # Миниатюра волны: из памяти сразу, с диска - в фоне
+        self.waveform_view = WaveformView(size_hint_y=None, height=120)
+        if self.app:
+            peaks = self.app.waveform_cache.get(self.sound_path, self.on_waveform_loaded)
+            if peaks is not None:
+                self.waveform_view.set_peaks(peaks)
+        self.expanded_view.add_widget(self.waveform_view)
+        
         # Контейнер для кнопок управления
         controls_layout = BoxLayout(orientation='vertical', spacing=15, size_hint_y=None, height=250)
         
@@ -601,6 +4043,12 @@ class SoundButton(BoxLayout):
         self.expanded_view.add_widget(controls_layout)
         self.add_widget(self.expanded_view)
 
+    def on_waveform_loaded(self, path, peaks):
+        """Пики загружены в фоне - рисуем, если кнопка еще показывает этот звук"""
+        if self.expanded_view is not None and self.waveform_view is not None \
+                and path == self.sound_path:
+            self.waveform_view.set_peaks(peaks)
+
     def on_play_button_press(self, instance):
         """Анимация при нажатии кнопки play"""
         Animation(background_color=(0.4, 0.5, 0.7, 1), duration=0.1).start(instance)
@@ -642,10 +4090,11 @@ class SoundButton(BoxLayout):
 
     def on_volume_change(self, instance, value):
         self.volume = value
-        if self.sound:
-            self.sound.volume = value
+        gain = self.app.sound_analyzer.gain_for(self.entry)
+        for voice in self.active_voices:
+            self.app.voice_pool.set_volume(voice, value * gain)
         if self.app:
-            self.app.save_sound_settings()
+            self.app.update_sound_setting(self.entry)
 
     def delete_sound(self, instance):
         def confirm_delete(instance):
@@ -719,13 +4168,7 @@ class SoundButton(BoxLayout):
         self.stop_sound_and_collapse()
         
         # Плавная анимация сворачивания
-        anim = Animation(
-            height=150, 
-            duration=0.4, 
-            t='out_quad'
-        )
-        anim.bind(on_complete=self.on_collapse_complete)
-        anim.start(self)
+        self.animate_height(150, 0.4, self.on_collapse_complete)
 
     def on_collapse_complete(self, *args):
         """Вызывается после завершения анимации сворачивания"""
@@ -741,16 +4184,137 @@ class SoundButton(BoxLayout):
         self.expanded_view = None
 
     def stop_sound_and_collapse(self):
-        if self.sound:
-            self.sound.stop()
+        for voice in self.active_voices:
+            self.app.voice_pool.stop_sound(voice)
+        self.active_voices = []
         self.stop_highlight()
-        if self.sound_check_event:
-            self.sound_check_event.cancel()
-            self.sound_check_event = None
+
+# -------------------------
+# Virtual Sound List Classes
+# -------------------------
+class SoundRow(RecycleDataViewBehavior, SoundButton):
+    """Строка виртуализированного списка - переиспользуется для разных звуков"""
+    def __init__(self, **kwargs):
+        app = App.get_running_app()
+        super().__init__(app=app, **kwargs)
+        self.index = None
+        # Живые строки тоже учитываются в app.buttons (сворачивание, Pin)
+        if app:
+            app.buttons.append(self)
+
+    def refresh_view_attrs(self, rv, index, data):
+        self.index = index
+        self.rv = rv
+        self.set_entry(data['entry'])
+
+    def expand(self, *args):
+        # Высоту строк задает RecycleView, поэтому раскрывается отдельная кнопка
+        if self.entry is not None and not self.is_expanded:
+            self.rv.expand_row(self)
+
+
+class SoundOverlay(SoundButton):
+    """Раскрытая кнопка виртуального списка, показывается поверх строк"""
+    def __init__(self, entry, app=None, rv=None, **kwargs):
+        super().__init__(entry, app=app, **kwargs)
+        self.rv = rv
+        self.row_y = self.y
+        self.index = None  # Строка этого звука в данных списка
+
+    def animate_height(self, height, duration, on_complete):
+        # При расширении кнопка прижимается к низу окна, при сворачивании
+        # возвращается на место строки
+        target_y = 0 if height > self.height else self.row_y
+        anim = Animation(y=target_y, height=height, duration=duration, t='out_quad')
+        anim.bind(on_complete=on_complete)
+        anim.start(self)
+
+    def on_collapse_complete(self, *args):
+        super().on_collapse_complete(*args)
+        if self.rv:
+            self.rv.close_overlay()
+
+
+class SoundRecycleView(RecycleView):
+    """Список звуков, в котором виджеты создаются только для видимых строк"""
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        layout = RecycleBoxLayout(
+            orientation='vertical',
+            spacing=15,
+            size_hint_y=None,
+            default_size=(None, 150),
+            default_size_hint=(1, None)
+        )
+        layout.bind(minimum_height=layout.setter('height'))
+        self.add_widget(layout)
+        # viewclass передается менеджеру раскладки, поэтому задается после него
+        self.viewclass = SoundRow
+        self.overlay = None
+        # Строки пересоздаются на следующем кадре после смены данных
+        self._reanchor_trigger = Clock.create_trigger(self.reanchor_overlay)
+
+    def set_entries(self, entries):
+        """Обновляет модель данных списка. Раскрытая кнопка остается открытой,
+        пока ее звук есть в новом списке, и переезжает к его новой строке"""
+        if self.overlay:
+            index = next((index for index, entry in enumerate(entries)
+                          if entry is self.overlay.entry), None)
+            if index is None:
+                self.overlay.reset_view_state()
+                self.close_overlay()
+            else:
+                self.overlay.index = index
+                self._reanchor_trigger()
+        self.data = [{'entry': entry} for entry in entries]
+
+    def append_entries(self, entries):
+        """Добавляет строки в конец списка без пересборки всей модели"""
+        if entries:
+            self.data.extend({'entry': entry} for entry in entries)
+
+    def reanchor_overlay(self, *args):
+        """После обновления данных запоминает, где теперь строка раскрытой кнопки"""
+        if self.overlay is None:
+            return
+        row = self.view_adapter.get_visible_view(self.overlay.index)
+        if row is not None:
+            self.overlay.row_y = row.to_window(*row.pos)[1]
+
+    def expand_row(self, row):
+        """Раскрывает строку в отдельной кнопке поверх списка"""
+        if self.overlay:
+            self.overlay.reset_view_state()
+            self.close_overlay()
+        
+        x, y = row.to_window(*row.pos)
+        self.overlay = SoundOverlay(
+            row.entry, app=row.app, rv=self,
+            size_hint=(None, None), pos=(x, y), size=row.size
+        )
+        self.overlay.index = row.index
+        Window.add_widget(self.overlay)
+        if row.app:
+            row.app.buttons.append(self.overlay)
+        self.overlay.expand()
+
+    def close_overlay(self):
+        """Убирает раскрытую кнопку"""
+        overlay, self.overlay = self.overlay, None
+        if overlay is None:
+            return
+        if overlay.parent:
+            overlay.parent.remove_widget(overlay)
+        if overlay.app and overlay in overlay.app.buttons:
+            overlay.app.buttons.remove(overlay)
 
 class MyApp(App):
     CURRENT_VERSION = "1.3.1"
     UPDATE_URL = "https://raw.githubusercontent.com/mortualer/MemeCloud/main/update.json"
+    # В режиме 'auto' виртуализированный список включается для больших библиотек
+    VIRTUAL_LIST_THRESHOLD = 150
+    LIST_MODES = ('auto', 'virtual', 'classic')
+    SHUTDOWN_TIMEOUT = 2.0  # Сколько выход ждет фоновые потоки, пишущие в индекс
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
@@ -769,20 +4333,53 @@ class MyApp(App):
             self.save_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "saved_sounds")
 
         self.settings_file = os.path.join(self.save_dir, "app_settings.json")
+        self.settings_store = SettingsStore(self.settings_file, self.settings_snapshot)
         print(f"Save directory: {self.save_dir}")
 
         # ВАЖНО: Создаем директорию ДО загрузки настроек
         os.makedirs(self.save_dir, exist_ok=True)
         
         self.buttons = []
+        self.sound_entries = []
         self.pin_active = False
         self.sound_settings = {}
+        self.list_mode = 'auto'
+        self.virtual_list = False
+        self.scroll = None
+        self.layout = None
+        self.no_sounds_label = None
         self.permissions_granted = False
         
         # Инициализируем кэш звуков
-        self.sound_cache = SoundCache(max_size=15)
+        self.sound_cache = SoundCache(max_bytes=24 * 1024 * 1024)
+        self.library_loader = SoundLibraryLoader(self)
+        self.sound_preloader = SoundPreloader(self.sound_cache)
+        self.search_index = SearchIndex()
+        self.playback_monitor = PlaybackMonitor()
+        self.voice_pool = VoicePool(self.playback_monitor)
+        self.instant_audio = InstantAudio(self.voice_pool)
+        self.latency_probe = LatencyProbe()
+        self.transcoder = ImportTranscoder(self)
+        self.sound_analyzer = SoundAnalyzer(self)
+        self.http = create_http_session(f"MemeCloud/{self.CURRENT_VERSION}",
+                                        pool_size=DownloadManager.MAX_WORKERS + 1)
+        self.update_checker = UpdateChecker(self, self.UPDATE_URL)
+        self.download_manager = DownloadManager(self)
+        self.content_index = ContentIndex(self)
+        self.waveform_cache = WaveformCache(self.save_dir, self.content_index.digest)
+        self.bundled_sounds = BundledSounds(self)
+        self.file_importer = FileImporter(self)
+        # Проигрывания копятся в памяти и пишутся в индекс пачками
+        self.pending_plays = {}
+        self._flush_plays_trigger = Clock.create_trigger(self.flush_play_stats, 5)
+        try:
+            self.library_index = LibraryIndex(os.path.join(self.save_dir, "library.db"))
+        except Exception as e:
+            print(f"Error opening library index: {e}")
+            self.library_index = None
         
         self.load_settings()
+        self.bundled_sounds.load()
 
     def build(self):
         try:
@@ -823,7 +4420,8 @@ class MyApp(App):
     def delayed_check_update(self, dt):
         """Отложенная проверка обновлений"""
         try:
-            self.check_for_update()
+            print("Checking for updates...")
+            self.update_checker.check_async(self.on_update_info)
         except Exception as e:
             print(f"Error in delayed_check_update: {e}")
 
@@ -888,12 +4486,120 @@ class MyApp(App):
 
         self.root.add_widget(top_bar)
 
+        # Индикатор фоновой загрузки библиотеки (виден только во время сканирования)
+        self.load_progress = ProgressBar(max=1, value=0, size_hint=(1, None), height=0, opacity=0)
+        self.root.add_widget(self.load_progress)
+
         # Область прокрутки для звуков
-        self.scroll = ScrollView(size_hint=(1, 1))
-        self.layout = BoxLayout(orientation='vertical', spacing=15, size_hint_y=None)
-        self.layout.bind(minimum_height=self.layout.setter('height'))
-        self.scroll.add_widget(self.layout)
+        self.setup_sound_list(virtual=False)
+
+    def setup_sound_list(self, virtual):
+        """Создает контейнер списка звуков: обычный или виртуализированный"""
+        if self.scroll is not None:
+            if SoundButton.current_button:
+                SoundButton.current_button.stop_sound_and_collapse()
+                SoundButton.current_button = None
+            self.voice_pool.stop_all()
+            self.root.remove_widget(self.scroll)
+        self.buttons.clear()
+        self.virtual_list = virtual
+
+        if virtual:
+            # Виджеты создаются только для видимых строк и переиспользуются
+            self.scroll = SoundRecycleView(size_hint=(1, 1))
+            self.layout = None
+        else:
+            self.scroll = ScrollView(size_hint=(1, 1))
+            self.no_sounds_label = None
+            self.layout = BoxLayout(orientation='vertical', spacing=15, size_hint_y=None)
+            self.layout.bind(minimum_height=self.layout.setter('height'))
+            self.scroll.add_widget(self.layout)
         self.root.add_widget(self.scroll)
+        print(f"Sound list mode: {'virtual' if virtual else 'classic'}")
+
+    def should_use_virtual_list(self, count):
+        """Решает, нужен ли виртуализированный список для count звуков"""
+        if self.list_mode == 'virtual':
+            return True
+        if self.list_mode == 'classic':
+            return False
+        return count > self.VIRTUAL_LIST_THRESHOLD
+
+    def cycle_list_mode(self, instance):
+        """Переключает режим списка: auto -> virtual -> classic"""
+        modes = self.LIST_MODES
+        index = modes.index(self.list_mode) if self.list_mode in modes else 0
+        self.list_mode = modes[(index + 1) % len(modes)]
+        instance.text = f"List: {self.list_mode.capitalize()}"
+        self.save_sound_settings()
+        self.refresh_sound_list()
+
+    def playback_mode_text(self):
+        pool = self.voice_pool
+        if pool.exclusive:
+            return "Play: Exclusive"
+        return f"Play: {pool.max_voices} voices, {pool.steal_mode}"
+
+    def cycle_playback_mode(self, instance):
+        """Переключает воспроизведение: oldest -> quietest -> exclusive"""
+        pool = self.voice_pool
+        if pool.exclusive:
+            pool.configure(steal_mode='oldest', exclusive=False)
+        elif pool.steal_mode == 'oldest':
+            pool.configure(steal_mode='quietest')
+        else:
+            pool.configure(exclusive=True)
+        instance.text = self.playback_mode_text()
+        self.save_sound_settings()
+
+    def instant_mode_text(self):
+        if not self.instant_audio.available:
+            return "Instant: n/a"
+        return f"Instant: {'On' if self.instant_audio.enabled else 'Off'}"
+
+    def toggle_instant_mode(self, instance):
+        """Включает проигрывание горячих звуков из PCM в памяти"""
+        self.instant_audio.set_enabled(not self.instant_audio.enabled)
+        instance.text = self.instant_mode_text()
+        self.save_sound_settings()
+
+    def toggle_normalize(self, instance):
+        """Включает выравнивание громкости и пропуск начальной тишины"""
+        self.sound_analyzer.enabled = not self.sound_analyzer.enabled
+        instance.text = f"Normalize: {'On' if self.sound_analyzer.enabled else 'Off'}"
+        self.save_sound_settings()
+
+    def toggle_latency_probe(self, instance):
+        """Включает замер задержки от касания до звука"""
+        self.latency_probe.enabled = not self.latency_probe.enabled
+        instance.text = f"Probe: {'On' if self.latency_probe.enabled else 'Off'}"
+
+    def transcode_mode_text(self):
+        if self.transcoder.encoder() is None:
+            return "Compress: n/a"
+        if not self.transcoder.enabled:
+            return "Compress: Off"
+        return f"Compress: {self.transcoder.bitrate_kbps} kbps"
+
+    def cycle_transcode_mode(self, instance):
+        """Переключает сжатие импорта: Off -> 64 -> 48 -> 32 kbps"""
+        transcoder = self.transcoder
+        bitrates = ImportTranscoder.BITRATES
+        if not transcoder.enabled:
+            transcoder.enabled = True
+            transcoder.bitrate_kbps = bitrates[0]
+        elif transcoder.bitrate_kbps in bitrates[:-1]:
+            transcoder.bitrate_kbps = bitrates[bitrates.index(transcoder.bitrate_kbps) + 1]
+        else:
+            transcoder.enabled = False
+        instance.text = self.transcode_mode_text()
+        self.save_sound_settings()
+
+    def toggle_keep_originals(self, instance):
+        """Сохранять ли оригиналы перекодированных файлов"""
+        self.transcoder.keep_original = not self.transcoder.keep_original
+        instance.text = f"Keep originals: {'On' if self.transcoder.keep_original else 'Off'}"
+        self.save_sound_settings()
 
     def on_search_text_change(self, instance, value):
         """Обработчик изменения текста в умном поиске"""
@@ -901,65 +4607,34 @@ class MyApp(App):
 
     def on_start(self):
         print("App started successfully")
-        # Копируем встроенные звуки
-        self.copy_builtin_sounds()
 
-    def copy_builtin_sounds(self):
-        """Копирует встроенные звуки в рабочую директорию"""
-        try:
-            print("Copying built-in sounds...")
-            
-            # Ищем папку со звуками в разных возможных местах
-            possible_paths = [
-                os.path.join(os.path.dirname(os.path.abspath(__file__)), "saved_sounds"),
-                os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", "saved_sounds"),
-                os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "saved_sounds"),  # Для GitHub структуры
-            ]
-            
-            source_dir = None
-            for path in possible_paths:
-                if os.path.exists(path) and os.path.isdir(path):
-                    source_dir = path
-                    print(f"Found built-in sounds at: {source_dir}")
-                    break
-            
-            if not source_dir:
-                print("No built-in sounds directory found")
-                return
-            
-            # Собираем все файлы для копирования
-            files_to_copy = []
-            for filename in os.listdir(source_dir):
-                if filename.lower().endswith(('.mp3', '.wav', '.ogg')):
-                    src_path = os.path.join(source_dir, filename)
-                    dst_path = os.path.join(self.save_dir, filename)
-                    
-                    # Копируем только если файл еще не существует
-                    if not os.path.exists(dst_path):
-                        files_to_copy.append((src_path, dst_path, filename))
-            
-            if files_to_copy:
-                print(f"Found {len(files_to_copy)} new sounds to copy")
-                
-                # Копируем все файлы сразу
-                copied_count = 0
-                for src_path, dst_path, filename in files_to_copy:
-                    try:
-                        shutil.copy2(src_path, dst_path)
-                        copied_count += 1
-                        print(f"Copied: {filename}")
-                    except Exception as e:
-                        print(f"Error copying {filename}: {e}")
-                
-                print(f"Successfully copied {copied_count} built-in sounds")
-                
-                # ОДИН раз обновляем интерфейс после копирования всех файлов
-                Clock.schedule_once(self.delayed_load_sounds, 0.5)
-            else:
-                print("No new sounds to copy")
-                
-        except Exception as e:
-            print(f"Error copying built-in sounds: {e}")
+    def on_pause(self):
+        self.settings_store.flush(wait=True)
+        self.flush_play_stats(wait=True)
+        self.instant_audio.cool_down()
+        return True
+
+    def on_stop(self):
+        self.library_loader.cancel()
+        self.sound_preloader.cancel()
+        self.download_manager.shutdown()
+        self.instant_audio.clear()
+        self.update_checker.cancel()
+        self.file_importer.cancel()
+        self.sound_analyzer.shutdown()
+        self.waveform_cache.shutdown()
+        self.http.close()
+        self.settings_store.flush(wait=True)
+        self.flush_play_stats(wait=True)
+        if self.library_index is not None:
+            # Индекс закрывается только после потоков, которые в него пишут
+            writers = (self.library_loader, self.download_manager, self.file_importer,
+                       self.sound_analyzer, self.waveform_cache)
+            deadline = time.monotonic() + self.SHUTDOWN_TIMEOUT
+            for component in writers:
+                for worker in component.active_threads():
+                    worker.join(max(0.0, deadline - time.monotonic()))
+            self.library_index.close()
 
     def request_android_permissions(self, dt=None):
         """Запрашивает разрешения на Android"""
@@ -1015,37 +4690,27 @@ class MyApp(App):
                 Uri = autoclass('android.net.Uri')
                 ClipData = autoclass('android.content.ClipData')
                 
-                clip_data = intent.getClipData()
-                processed_files = []
+                PythonActivity = autoclass('org.kivy.android.PythonActivity')
+                resolver = PythonActivity.mActivity.getContentResolver()
                 
+                clip_data = intent.getClipData()
+                uris = []
                 if clip_data is not None:
                     # Множественный выбор
                     count = clip_data.getItemCount()
                     print(f"Multiple files selected: {count}")
-                    for i in range(count):
-                        uri = clip_data.getItemAt(i).getUri()
-                        print(f"Processing URI {i+1}: {uri}")
-                        result = self.process_android_uri(uri)
-                        if result:
-                            processed_files.append(result)
+                    uris = [clip_data.getItemAt(i).getUri() for i in range(count)]
                 else:
                     # Одиночный выбор
                     uri = intent.getData()
                     if uri is not None:
                         print(f"Single file selected: {uri}")
-                        result = self.process_android_uri(uri)
-                        if result:
-                            processed_files.append(result)
-                
-                print(f"File processing completed. Processed {len(processed_files)} files")
+                        uris = [uri]
                 
-                # ВАЖНО: Двойное обновление для гарантии
-                if processed_files:
-                    # Сначала немедленно обновляем
-                    Clock.schedule_once(lambda dt: self.delayed_load_sounds(), 0.1)
-                    # Затем еще раз через 1 секунду для надежности
-                    Clock.schedule_once(lambda dt: self.force_reload_sounds(), 1.0)
-                    self.show_info_popup("Success", f"Added {len(processed_files)} audio files")
+                # Здесь только имя и размер; копирование идет в потоках импорта,
+                # итог покажет on_import_finished
+                sources = [AndroidUriSource.query(resolver, uri) for uri in uris]
+                Clock.schedule_once(lambda dt: self.start_uri_import(sources))
                 
             else:
                 print("User cancelled file selection")
@@ -1054,67 +4719,10 @@ class MyApp(App):
             print(f"Error processing activity result: {e}")
             self.show_error_popup(f"Error processing selected files: {str(e)}")
 
-    def process_android_uri(self, uri):
-        """Обрабатывает URI файла на Android и возвращает имя файла если успешно"""
-        try:
-            from jnius import autoclass
-            
-            Context = autoclass('android.content.Context')
-            ContentResolver = autoclass('android.content.ContentResolver')
-            PythonActivity = autoclass('org.kivy.android.PythonActivity')
-            context = PythonActivity.mActivity
-            
-            content_resolver = context.getContentResolver()
-            
-            # Получаем имя файла
-            cursor = content_resolver.query(uri, None, None, None, None)
-            filename = "audio_file"
-            if cursor:
-                try:
-                    display_name_index = cursor.getColumnIndex("_display_name")
-                    if display_name_index != -1 and cursor.moveToFirst():
-                        filename = cursor.getString(display_name_index)
-                finally:
-                    cursor.close()
-            
-            # Проверяем расширение файла
-            if not filename.lower().endswith(('.mp3', '.wav', '.ogg')):
-                print(f"Skipping non-audio file: {filename}")
-                return None
-            
-            print(f"Processing audio file: {filename}")
-            
-            # Создаем путь для сохранения
-            new_path = os.path.join(self.save_dir, filename)
-            
-            # Если файл с таким именем уже существует, добавляем номер
-            if os.path.exists(new_path):
-                base, ext = os.path.splitext(filename)
-                counter = 1
-                while os.path.exists(new_path):
-                    new_path = os.path.join(self.save_dir, f"{base}_{counter}{ext}")
-                    counter += 1
-            
-            # Копируем содержимое файла
-            input_stream = content_resolver.openInputStream(uri)
-            with open(new_path, 'wb') as out_file:
-                # Читаем и записываем файл по частям
-                buffer_size = 8192
-                buffer = bytearray(buffer_size)
-                bytes_read = input_stream.read(buffer)
-                while bytes_read != -1:
-                    out_file.write(buffer[:bytes_read])
-                    bytes_read = input_stream.read(buffer)
-            
-            input_stream.close()
-            
-            print(f"Successfully copied to: {new_path}")
-            return filename
-                
-        except Exception as e:
-            print(f"Error processing Android URI: {e}")
-            self.show_error_popup(f"Error processing file: {str(e)}")
-            return None
+    def start_uri_import(self, sources):
+        """Запускает фоновый импорт файлов из системного пикера"""
+        if not self.file_importer.start_sources(sources):
+            self.show_info_popup("No Audio Files", "No supported audio files selected")
 
     def load_settings(self):
         """Загружает настройки приложения"""
@@ -1123,6 +4731,20 @@ class MyApp(App):
                 with open(self.settings_file, 'r', encoding='utf-8') as f:
                     data = json.load(f)
                     self.sound_settings = data.get('sound_settings', {})
+                    self.bundled_sounds.hidden = set(data.get('hidden_bundled', []))
+                    self.list_mode = data.get('list_mode', 'auto')
+                    playback = data.get('playback', {})
+                    self.voice_pool.configure(
+                        max_voices=playback.get('voices'),
+                        steal_mode=playback.get('steal'),
+                        exclusive=playback.get('exclusive')
+                    )
+                    self.instant_audio.set_enabled(playback.get('instant', False))
+                    self.sound_analyzer.enabled = playback.get('normalize', True)
+                    transcode = data.get('transcode', {})
+                    self.transcoder.enabled = transcode.get('enabled', False)
+                    self.transcoder.bitrate_kbps = transcode.get('bitrate_kbps', 48)
+                    self.transcoder.keep_original = transcode.get('keep_original', False)
                 print("Settings loaded successfully")
             else:
                 self.sound_settings = {}
@@ -1131,27 +4753,51 @@ class MyApp(App):
             print(f"Error loading settings: {e}")
             self.sound_settings = {}
 
+    def settings_snapshot(self):
+        """Собирает текущие настройки для записи в файл"""
+        return {
+            'sound_settings': self.sound_settings,
+            'list_mode': self.list_mode,
+            'playback': {
+                'voices': self.voice_pool.max_voices,
+                'steal': self.voice_pool.steal_mode,
+                'exclusive': self.voice_pool.exclusive,
+                'instant': self.instant_audio.enabled,
+                'normalize': self.sound_analyzer.enabled
+            },
+            'transcode': {
+                'enabled': self.transcoder.enabled,
+                'bitrate_kbps': self.transcoder.bitrate_kbps,
+                'keep_original': self.transcoder.keep_original
+            },
+            'hidden_bundled': sorted(self.bundled_sounds.hidden),
+            'app_version': self.CURRENT_VERSION
+        }
+
     def save_sound_settings(self):
-        """Сохраняет настройки звуков"""
-        try:
-            for btn in self.buttons:
-                if btn.sound_id:
-                    self.sound_settings[btn.sound_id] = {
-                        'volume': btn.volume,
-                        'name': btn.btn_text
-                    }
-            
-            data = {
-                'sound_settings': self.sound_settings,
-                'app_version': self.CURRENT_VERSION
+        """Планирует сохранение настроек (запись отложенная, см. SettingsStore)"""
+        self.settings_store.mark_dirty()
+
+    def update_sound_setting(self, entry):
+        """Запоминает громкость одного звука"""
+        if entry.sound_id:
+            self.sound_settings[entry.sound_id] = {
+                'volume': entry.volume,
+                'name': entry.name
             }
-            
-            with open(self.settings_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-                
-            print("Settings saved successfully")
-        except Exception as e:
-            print(f"Error saving settings: {e}")
+            self.save_sound_settings()
+
+    def compact_settings(self):
+        """Удаляет настройки звуков, которых больше нет в библиотеке"""
+        known = {entry.sound_id for entry in self.sound_entries}
+        orphans = [sound_id for sound_id in self.sound_settings if sound_id not in known]
+        for sound_id in orphans:
+            del self.sound_settings[sound_id]
+        hidden = self.bundled_sounds.hidden & set(self.bundled_sounds.sound_ids())
+        if orphans or hidden != self.bundled_sounds.hidden:
+            print(f"Compacted settings: {len(orphans)} orphaned sounds")
+            self.bundled_sounds.hidden = hidden
+            self.save_sound_settings()
 
     def clean_sound_name(self, filename):
         """Очищает имя файла для отображения"""
@@ -1174,7 +4820,7 @@ class MyApp(App):
         return name
 
     def load_existing_sounds(self):
-        """Загружает существующие звуки"""
+        """Запускает фоновую загрузку существующих звуков"""
         print(f"Loading sounds from: {self.save_dir}")
         print(f"Directory exists: {os.path.exists(self.save_dir)}")
         
@@ -1182,119 +4828,408 @@ class MyApp(App):
             print(f"Creating directory: {self.save_dir}")
             os.makedirs(self.save_dir, exist_ok=True)
         
-        # Очищаем текущие кнопки
+        print("Scanning for audio files...")
+        # Повторный вызов во время сканирования отменяет предыдущее
+        self.library_loader.start()
+        self.download_manager.prune_partials()
+
+    def rescan_sounds(self):
+        """Инкрементально сверяет библиотеку с папкой без перестройки списка"""
+        loader = self.library_loader
+        if (loader.is_running and not loader.incremental) or \
+                (not loader.is_running and not self.sound_entries):
+            # Полное сканирование еще идет или список пуст - достаточно полного
+            self.load_existing_sounds()
+            return
+        print("Rescanning sounds...")
+        self.library_loader.start(incremental=True)
+
+    def apply_library_diff(self, entries, added, removed, changed):
+        """Применяет изменения папки: трогает только добавленные, удаленные и
+        измененные строки, остальные записи и их звуки в кэше сохраняются"""
+        print(f"Library changes: +{len(added)} -{len(removed)} ~{len(changed)}")
+        if not (added or removed or changed):
+            return
+        
+        current = {entry.path: entry for entry in self.sound_entries}
+        for path in removed:
+            self.sound_cache.remove(path)
+            self.voice_pool.forget(path)
+            self.instant_audio.forget(path)
+            self.waveform_cache.forget(path)
+        changed_entries = []
+        for path in changed:
+            # Файл перезаписан - старый декодированный звук устарел
+            self.sound_cache.remove(path)
+            self.voice_pool.forget(path)
+            self.instant_audio.forget(path)
+            self.waveform_cache.forget(path)
+        
+        changed_paths = set(changed)
+        merged = []
+        seen_ids = set()
+        for fresh in entries:
+            # Из записей с одинаковым sound_id остается первая
+            if fresh.sound_id in seen_ids:
+                continue
+            seen_ids.add(fresh.sound_id)
+            entry = current.get(fresh.path)
+            if entry is None:
+                entry = fresh
+                self.apply_sound_settings(entry)
+            elif fresh.path in changed_paths:
+                entry.name = fresh.name
+                entry.icon_path = fresh.icon_path
+                entry.size = fresh.size
+                entry.mtime_ns = fresh.mtime_ns
+                entry.duration = fresh.duration
+                entry.loudness, entry.peak = fresh.loudness, fresh.peak
+                entry.lead_silence, entry.trail_silence = fresh.lead_silence, fresh.trail_silence
+                changed_entries.append(entry)
+            merged.append(entry)
+        self.sound_entries[:] = merged
+        
+        # В поиске только записи списка: сначала убираем выбывшие, потом
+        # индексируем новые, измененные и занявшие sound_id выбывших
+        alive = set(map(id, merged))
+        for entry in current.values():
+            if id(entry) not in alive:
+                self.search_index.remove(entry)
+        for entry in changed_entries:
+            self.search_index.add(entry)
+        for entry in merged:
+            if not self.search_index.contains(entry):
+                self.search_index.add(entry)
+        
+        if self.should_use_virtual_list(len(merged)) != self.virtual_list:
+            self.refresh_sound_list()
+            return
+        if self.virtual_list:
+            self.filter_buttons()
+            return
+        
+        # Обычный список: удаляем, обновляем и вставляем только нужные виджеты
+        if self.no_sounds_label is not None:
+            self.layout.remove_widget(self.no_sounds_label)
+            self.no_sounds_label = None
+        widgets = {}
+        for btn in self.buttons[:]:
+            if id(btn.entry) not in alive:
+                if SoundButton.current_button is btn:
+                    btn.stop_sound_and_collapse()
+                    SoundButton.current_button = None
+                self.layout.remove_widget(btn)
+                self.buttons.remove(btn)
+            else:
+                widgets[id(btn.entry)] = btn
+        for entry in changed_entries:
+            btn = widgets.get(id(entry))
+            if btn:
+                btn.update_from_entry()
+        for position, entry in enumerate(merged):
+            if id(entry) not in widgets:
+                btn_widget = SoundButton(entry, app=self)
+                # children хранятся в обратном порядке отображения
+                self.layout.add_widget(btn_widget, index=len(self.layout.children) - position)
+                widgets[id(entry)] = btn_widget
+        self.buttons[:] = [widgets[id(entry)] for entry in merged]
+        
+        if not merged:
+            self.show_no_sounds_label()
+        elif self.search_input.text:
+            self.filter_buttons()
+
+    def on_library_scan_started(self, total):
+        """Сканирование нашло total файлов - очищаем список перед заполнением"""
+        self.sound_entries.clear()
+        self.search_index.clear()
+        self._loaded_sound_ids = set()
+        
+        virtual = self.should_use_virtual_list(total)
+        if virtual != self.virtual_list:
+            self.setup_sound_list(virtual)
+        if self.virtual_list:
+            self.scroll.set_entries([])
+        else:
+            self.layout.clear_widgets()
+            self.buttons.clear()
+            self.no_sounds_label = None
+        self.update_load_progress(0, total)
+
+    def on_library_entries_loaded(self, entries):
+        """Добавляет очередную порцию звуков из фонового сканирования"""
+        new_entries = []
+        for entry in entries:
+            if entry.sound_id in self._loaded_sound_ids:
+                print(f"Sound already exists: {os.path.basename(entry.path)}")
+                continue
+            self._loaded_sound_ids.add(entry.sound_id)
+            self.apply_sound_settings(entry)
+            self.search_index.add(entry)
+            new_entries.append(entry)
+        self.sound_entries.extend(new_entries)
+        
+        if self.virtual_list:
+            # Порция сканирования дописывается в конец модели, а не пересобирает ее
+            matches = self.search_index.matching_ids(self.search_input.text)
+            self.scroll.append_entries([entry for entry in new_entries
+                                        if matches is None or entry.sound_id in matches])
+            return
+        for entry in new_entries:
+            self.add_sound_widget(entry)
+        if self.search_input.text:
+            self.filter_buttons()
+
+    def on_library_scan_finished(self, complete=True):
+        """Сканирование завершено; complete=False - список неполный из-за ошибки"""
+        print(f"Total sounds loaded: {len(self.sound_entries)}")
+        self.update_load_progress(0, 0)
+        if complete:
+            self.compact_settings()
+        if not self.virtual_list and not self.sound_entries:
+            self.show_no_sounds_label()
+        # Прогреваем кэш любимыми звуками пользователя
+        self.sound_preloader.start(self.sound_entries)
+        # Новые и измененные файлы анализируются в фоне
+        self.sound_analyzer.submit(self.sound_entries)
+
+    def record_play(self, entry):
+        """Учитывает проигрывание звука для предзагрузки"""
+        entry.play_count += 1
+        entry.last_played = time.time()
+        count, last_played = self.pending_plays.get(entry.sound_id, (0, 0.0))
+        self.pending_plays[entry.sound_id] = (count + 1, entry.last_played)
+        self._flush_plays_trigger()
+
+    def flush_play_stats(self, *args, wait=False):
+        """Пишет накопленные проигрывания в индекс (в фоне, кроме wait=True)"""
+        if not self.pending_plays or self.library_index is None:
+            return
+        plays = [(sound_id, count, last_played)
+                 for sound_id, (count, last_played) in self.pending_plays.items()]
+        self.pending_plays = {}
+        
+        def write():
+            try:
+                self.library_index.record_plays(plays)
+            except Exception as e:
+                print(f"Error saving play stats: {e}")
+        
+        if wait:
+            write()
+        else:
+            threading.Thread(target=write, daemon=True).start()
+
+    def update_load_progress(self, loaded, total):
+        """Показывает прогресс сканирования; при total == 0 индикатор скрывается"""
+        if total and loaded < total:
+            self.load_progress.max = total
+            self.load_progress.value = loaded
+            self.load_progress.height = 8
+            self.load_progress.opacity = 1
+        else:
+            self.load_progress.height = 0
+            self.load_progress.opacity = 0
+
+    def refresh_sound_list(self):
+        """Перестраивает отображение списка по текущей библиотеке"""
+        virtual = self.should_use_virtual_list(len(self.sound_entries))
+        if virtual != self.virtual_list:
+            self.setup_sound_list(virtual)
+        
+        if self.virtual_list:
+            # Достаточно обновить модель данных - строки создаст RecycleView
+            self.filter_buttons()
+            return
+        
         self.layout.clear_widgets()
         self.buttons.clear()
+        self.no_sounds_label = None
+        for entry in self.sound_entries:
+            self.add_sound_widget(entry)
         
-        print("Scanning for audio files...")
-        audio_extensions = ('.mp3', '.wav', '.ogg')
-        found_files = False
-        
-        # Собираем все файлы сначала
-        sound_files = []
-        for filename in sorted(os.listdir(self.save_dir)):
-            if filename.lower().endswith(audio_extensions):
-                sound_path = os.path.join(self.save_dir, filename)
-                sound_files.append((sound_path, filename))
-                found_files = True
-        
-        # Предзагружаем звуки в кэш
-        if sound_files:
-            self.sound_cache.preload_sounds([path for path, name in sound_files])
-        
-        # Затем добавляем все кнопки сразу
-        for sound_path, filename in sound_files:
-            print(f"Found audio file: {filename}")
-            self.add_sound_button(sound_path)
-        
-        print(f"Total sounds loaded: {len(self.buttons)}")
-        
-        # Если файлов не найдено, показываем сообщение
-        if not found_files and len(self.buttons) == 0:
-            no_sounds_label = Label(
-                text="No sounds found\n\nUse the Upload button to add audio files",
-                size_hint_y=None,
-                height=200,
-                font_size='18sp',
-                halign='center'
-            )
-            no_sounds_label.bind(size=no_sounds_label.setter('text_size'))
-            self.layout.add_widget(no_sounds_label)
+        if not self.sound_entries:
+            self.show_no_sounds_label()
+        elif self.search_input.text:
+            self.filter_buttons()
+
+    def show_no_sounds_label(self):
+        """Показывает сообщение о пустой библиотеке"""
+        no_sounds_label = Label(
+            text="No sounds found\n\nUse the Upload button to add audio files",
+            size_hint_y=None,
+            height=200,
+            font_size='18sp',
+            halign='center'
+        )
+        no_sounds_label.bind(size=no_sounds_label.setter('text_size'))
+        self.layout.add_widget(no_sounds_label)
+        self.no_sounds_label = no_sounds_label
+
+    def build_sound_entry(self, path):
+        """Разбирает имя файла и ищет иконку; безопасно вызывать из фонового потока"""
+        filename = os.path.basename(path)
+        sound_id = os.path.splitext(filename)[0]
+        btn_text = self.clean_sound_name(filename)
+        
+        # Ищем иконку
+        icon_file = None
+        icon_extensions = ['.png', '.jpg', '.jpeg']
+        for ext in icon_extensions:
+            potential_icon = os.path.join(self.save_dir, sound_id + ext)
+            if os.path.exists(potential_icon):
+                icon_file = potential_icon
+                break
+        
+        entry = SoundEntry(path, btn_text, icon_file, sound_id=sound_id)
+        try:
+            st = os.stat(path)
+            entry.size = st.st_size
+            entry.mtime_ns = st.st_mtime_ns
+        except OSError:
+            pass
+        return entry
+
+    def apply_sound_settings(self, entry):
+        """Применяет сохраненные настройки звука к записи"""
+        if entry.sound_id in self.sound_settings:
+            entry.volume = self.sound_settings[entry.sound_id].get('volume', 1.0)
+
+    def create_sound_entry(self, path):
+        """Создает запись библиотеки для файла (без декодирования звука)"""
+        # Проверяем, не добавлен ли уже этот звук
+        filename = os.path.basename(path)
+        sound_id = os.path.splitext(filename)[0]
+        
+        for entry in self.sound_entries:
+            if entry.sound_id == sound_id:
+                print(f"Sound already exists: {filename}")
+                return None
+        
+        # Сам звук не загружаем - он декодируется при первом проигрывании
+        entry = self.build_sound_entry(path)
+        self.apply_sound_settings(entry)
+        return entry
+
+    def load_entry_sound(self, entry):
+        """Получает звук записи через кэш и запоминает его длительность в индексе"""
+        # В режиме instant горячие звуки играют из PCM в памяти
+        instant = self.instant_audio.get_sound(entry.path)
+        if instant is not None:
+            return instant
+        sound = self.sound_cache.load_sound(entry.path)
+        if sound and entry.duration is None and sound.length > 0:
+            entry.duration = sound.length
+            if self.library_index is not None:
+                try:
+                    self.library_index.update_duration(entry.path, entry.duration)
+                except Exception as e:
+                    print(f"Error updating library index: {e}")
+        return sound
+
+    def add_sound_widget(self, entry):
+        """Создает виджет кнопки для записи (обычный режим списка)"""
+        btn_widget = SoundButton(entry, app=self)
+        self.layout.add_widget(btn_widget)
+        self.buttons.append(btn_widget)
+        return btn_widget
 
     def add_sound_button(self, path):
-        """Добавляет кнопку звука с использованием кэша"""
+        """Добавляет звук в библиотеку и показывает его в списке"""
         try:
-            # Проверяем, не добавлен ли уже этот звук
-            filename = os.path.basename(path)
-            sound_id = os.path.splitext(filename)[0]
-            
-            for btn in self.buttons:
-                if btn.sound_id == sound_id:
-                    print(f"Sound already exists: {filename}")
-                    return False
-            
-            btn_text = self.clean_sound_name(filename)
-            
-            print(f"Loading sound: {filename}")
-            
-            # Ищем иконку
-            icon_file = None
-            icon_extensions = ['.png', '.jpg', '.jpeg']
-            for ext in icon_extensions:
-                potential_icon = os.path.join(self.save_dir, sound_id + ext)
-                if os.path.exists(potential_icon):
-                    icon_file = potential_icon
-                    break
+            entry = self.create_sound_entry(path)
+            if entry is None:
+                return False
             
-            # Пытаемся получить звук из кэша
-            sound = self.sound_cache.get_sound(path)
-            if sound is None:
-                # Если нет в кэше, загружаем
-                sound = SoundLoader.load(path)
-                if sound:
-                    self.sound_cache.add_sound(path, sound)
+            # Новый файл проверяем декодированием - звук остается в кэше
+            if not self.sound_cache.load_sound(path):
+                return False
             
-            if sound:
-                print(f"Sound loaded successfully: {filename}")
-                btn_widget = SoundButton(
-                    btn_text, sound, icon_file, app=self, 
-                    sound_id=sound_id, sound_path=path  # Сохраняем путь для кэширования
-                )
-                
-                if sound_id in self.sound_settings:
-                    btn_widget.volume = self.sound_settings[sound_id].get('volume', 1.0)
-                
-                self.layout.add_widget(btn_widget)
-                self.buttons.append(btn_widget)
-                return True
+            self.sound_entries.append(entry)
+            self.search_index.add(entry)
+            self.sound_analyzer.submit([entry])
+            if self.virtual_list:
+                self.filter_buttons()
             else:
-                print(f"Failed to load sound: {filename}")
-                return False
+                self.add_sound_widget(entry)
+                if self.search_input.text:
+                    self.filter_buttons()
+            return True
                 
         except Exception as e:
             print(f"Error adding sound button: {e}")
             return False
 
+    def add_sound_batch(self, paths):
+        """Добавляет пачку новых файлов одним обновлением списка.
+        Файлы уже проверены в фоне, поэтому звук здесь не декодируется"""
+        return self.add_sound_entries([self.build_sound_entry(path) for path in paths])
+
+    def add_sound_entries(self, entries):
+        """Добавляет готовые записи одним обновлением списка; возвращает добавленные"""
+        known_ids = {entry.sound_id for entry in self.sound_entries}
+        new_entries = []
+        for entry in entries:
+            if entry.sound_id in known_ids:
+                print(f"Sound already exists: {os.path.basename(entry.path)}")
+                continue
+            known_ids.add(entry.sound_id)
+            new_entries.append(entry)
+        if new_entries:
+            self.apply_library_diff(merge_sorted_entries(self.sound_entries, new_entries),
+                                    [entry.path for entry in new_entries], [], [])
+            self.sound_analyzer.submit(new_entries)
+        return new_entries
+
+    def on_sound_transcoded(self, old_path, new_path):
+        """Файл звука заменен перекодированным - переносим запись на новый путь"""
+        # Повторный импорт исходного файла найдет перекодированную копию
+        self.content_index.moved(old_path, new_path)
+        self.sound_cache.remove(old_path)
+        self.voice_pool.forget(old_path)
+        self.instant_audio.forget(old_path)
+        for entry in self.sound_entries:
+            if entry.path == old_path:
+                entry.path = new_path
+                entry.duration = None
+                try:
+                    stat = os.stat(new_path)
+                    entry.size = stat.st_size
+                    entry.mtime_ns = stat.st_mtime_ns
+                except OSError:
+                    pass
+                break
+        # Сверка с папкой обновит размер, время изменения и индекс
+        self.rescan_sounds()
+
     def delete_sound(self, sound_button):
         """Удаляет звук и очищает его из кэша"""
         try:
-            for btn in self.buttons[:]:
-                if btn == sound_button:
-                    if btn.sound:
-                        btn.sound.stop()
-                    
-                    # Удаляем звук из кэша
-                    if hasattr(btn, 'sound_path') and btn.sound_path:
-                        if btn.sound_path in self.sound_cache.cache:
-                            del self.sound_cache.cache[btn.sound_path]
-                            if btn.sound_path in self.sound_cache.access_order:
-                                self.sound_cache.access_order.remove(btn.sound_path)
-                            print(f"Removed from cache: {os.path.basename(btn.sound_path)}")
-                    
-                    self.layout.remove_widget(btn)
-                    self.buttons.remove(btn)
-                    
-                    sound_id = btn.sound_id
+            entry = sound_button.entry
+            if entry in self.sound_entries:
+                sound_button.stop_sound_and_collapse()
+                
+                # Удаляем звук из кэша (выгрузка останавливает его и у других кнопок)
+                self.sound_cache.remove(entry.path)
+                self.voice_pool.forget(entry.path)
+                self.instant_audio.forget(entry.path)
+                self.waveform_cache.forget(entry.path)
+                
+                self.sound_entries.remove(entry)
+                self.search_index.remove(entry)
+                if self.virtual_list:
+                    sound_button.reset_view_state()
+                    self.filter_buttons()
+                else:
+                    self.layout.remove_widget(sound_button)
+                    self.buttons.remove(sound_button)
+                
+                sound_id = entry.sound_id
+                if entry.bundled:
+                    # Файлы пакета не удаляются - встроенный звук только скрывается
+                    self.bundled_sounds.hide(entry)
+                    self.save_sound_settings()
+                else:
                     # Удаляем связанные файлы
                     for filename in os.listdir(self.save_dir):
                         file_base = os.path.splitext(filename)[0]
@@ -1305,15 +5240,12 @@ class MyApp(App):
                                 print(f"Removed: {file_path}")
                             except Exception as e:
                                 print(f"Error removing file: {e}")
-                    
-                    # Удаляем настройки
-                    if sound_id in self.sound_settings:
-                        del self.sound_settings[sound_id]
-                        self.save_sound_settings()
-                    
-                    # Перезагружаем список звуков
-                    Clock.schedule_once(self.delayed_load_sounds, 0.1)
-                    break
+                
+                # Удаляем настройки
+                if sound_id in self.sound_settings:
+                    del self.sound_settings[sound_id]
+                    self.save_sound_settings()
+                
                     
         except Exception as e:
             print(f"Error deleting sound: {e}")
@@ -1480,20 +5412,15 @@ class MyApp(App):
             
             file_paths = filedialog.askopenfilenames(
                 title="Select Audio Files",
-                filetypes=[("Audio files", "*.mp3 *.wav *.ogg"), ("All files", "*.*")]
+                filetypes=[("Audio files", " ".join("*" + ext for ext in LibraryIndex.AUDIO_EXTENSIONS)),
+                           ("All files", "*.*")]
             )
             
             root.destroy()
             
             if file_paths:
-                processed_count = 0
-                for file_path in file_paths:
-                    if self.copy_audio_file(file_path):
-                        processed_count += 1
-                
-                if processed_count > 0:
-                    self.show_info_popup("Success", f"Added {processed_count} audio files")
-                    Clock.schedule_once(self.delayed_load_sounds, 0.5)
+                # Копирование идет в фоне, итог покажет on_import_finished
+                self.file_importer.start(file_paths)
                     
         except Exception as e:
             print(f"Error in file picker: {e}")
@@ -1518,77 +5445,54 @@ class MyApp(App):
             print(f"Error in folder picker: {e}")
             self.show_error_popup(f"Error selecting folder: {str(e)}")
 
-    def copy_audio_file(self, file_path):
-        """Копирует аудио файл"""
-        try:
-            filename = os.path.basename(file_path)
-            
-            if not filename.lower().endswith(('.mp3', '.wav', '.ogg')):
-                return False
-            
-            new_path = os.path.join(self.save_dir, filename)
-            
-            # Добавляем номер если файл существует
-            if os.path.exists(new_path):
-                base, ext = os.path.splitext(filename)
-                counter = 1
-                while os.path.exists(new_path):
-                    new_path = os.path.join(self.save_dir, f"{base}_{counter}{ext}")
-                    counter += 1
-            
-            shutil.copy2(file_path, new_path)
-            print(f"Copied to: {new_path}")
-            
-            # Добавляем кнопку
-            return self.add_sound_button(new_path)
-                
-        except Exception as e:
-            print(f"Error copying file: {e}")
-            return False
-
     def copy_audio_from_folder(self, folder_path):
-        """Копирует все аудио файлы из папки"""
+        """Копирует все аудио файлы из папки (в фоновых потоках)"""
         try:
-            audio_files = []
-            for filename in os.listdir(folder_path):
-                if filename.lower().endswith(('.mp3', '.wav', '.ogg')):
-                    audio_files.append(filename)
+            with os.scandir(folder_path) as it:
+                audio_files = [item.path for item in it if item.is_file() and
+                               os.path.splitext(item.name)[1].lower() in LibraryIndex.AUDIO_EXTENSIONS]
             
             if not audio_files:
                 self.show_info_popup("No Audio Files", "No audio files found in selected folder")
                 return
             
-            copied_count = 0
-            for filename in audio_files:
-                src_path = os.path.join(folder_path, filename)
-                if self.copy_audio_file(src_path):
-                    copied_count += 1
-            
-            if copied_count > 0:
-                self.show_info_popup("Complete", f"Added {copied_count} audio files")
-                Clock.schedule_once(self.delayed_load_sounds, 0.5)
-            else:
-                self.show_info_popup("Error", "No files were added")
+            self.file_importer.start(sorted(audio_files))
             
         except Exception as e:
             print(f"Error copying from folder: {e}")
             self.show_error_popup(f"Error copying files: {str(e)}")
 
-    def force_reload_sounds(self):
-        """Принудительно перезагружает все звуки из папки saved_sounds"""
-        print("Force reloading sounds...")
-        self.load_existing_sounds()
+    def on_import_finished(self, added, duplicates, failed):
+        """Итог фонового импорта файлов"""
+        if not (added or duplicates or failed):
+            return
+        message = f"Added {added} audio files"
+        if duplicates:
+            message += f"\n{duplicates} already in library"
+        if failed:
+            message += f"\n{failed} files could not be imported"
+        self.show_info_popup("Complete" if added else "No New Sounds", message)
 
     def open_settings(self, instance):
         """Открывает настройки с информацией о кэше"""
         content = BoxLayout(orientation='vertical', spacing=10, padding=20)
         
         permissions_status = "Granted" if self.permissions_granted else "Not granted"
+        stats = self.sound_cache.get_stats()
         cache_info = f"""MemeCloud v{self.CURRENT_VERSION}
 
 Debug Info:
-• Sounds loaded: {len(self.buttons)}
-• Cache size: {len(self.sound_cache.cache)}/{self.sound_cache.max_size}
+• Sounds loaded: {len(self.sound_entries)}
+• List mode: {self.list_mode} ({'virtual' if self.virtual_list else 'classic'})
+• Cache: {stats['sounds']} sounds, {stats['bytes'] / 1048576:.1f}/{stats['max_bytes'] / 1048576:.1f} MB
+• Cache hits/misses: {stats['hits']}/{stats['misses']} ({stats['hit_rate'] * 100:.0f}%)
+• Cache evictions: {stats['evictions']}
+• Preloaded by usage: {self.sound_preloader.preloaded}
+• Voices: {self.voice_pool.active_count()}/{self.voice_pool.max_voices} playing, {self.voice_pool.steals} stolen
+• Instant PCM: {len(self.instant_audio.sounds)} sounds, {self.instant_audio.current_bytes / 1048576:.1f} MB
+• Tap latency: {self.latency_probe.report() if self.latency_probe.enabled else 'probe off'}
+• Analyzed: {sum(1 for entry in self.sound_entries if entry.loudness is not None)}/{len(self.sound_entries)} sounds{'' if self.sound_analyzer.available() else ' (numpy missing)'}
+• Transcoded imports: {self.transcoder.transcoded}, saved {self.transcoder.saved_bytes / 1048576:.1f} MB (encoder: {self.transcoder.encoder() or 'none'})
 • Save dir: {self.save_dir}
 • Permissions: {permissions_status}
 • Platform: {platform}"""
@@ -1596,7 +5500,7 @@ Debug Info:
         info_label = Label(
             text=cache_info,
             size_hint_y=None,
-            height=200,
+            height=360,
             text_size=(Window.width * 0.8 - 40, None),
             halign='left',
             valign='top'
@@ -1625,6 +5529,72 @@ Debug Info:
         cache_btn.bind(on_release=lambda x: self.clear_sound_cache())
         btn_layout.add_widget(cache_btn)
         
+        # Кнопка режима списка
+        list_btn = Button(
+            text=f"List: {self.list_mode.capitalize()}",
+            background_color=(0.3, 0.4, 0.5, 1),
+            font_size='12sp'
+        )
+        list_btn.bind(on_release=self.cycle_list_mode)
+        btn_layout.add_widget(list_btn)
+        
+        # Режим воспроизведения: полифония с вытеснением или один звук
+        playback_layout = BoxLayout(size_hint_y=None, height=50, spacing=10)
+        play_btn = Button(
+            text=self.playback_mode_text(),
+            background_color=(0.3, 0.4, 0.5, 1),
+            font_size='12sp'
+        )
+        play_btn.bind(on_release=self.cycle_playback_mode)
+        playback_layout.add_widget(play_btn)
+        
+        instant_btn = Button(
+            text=self.instant_mode_text(),
+            background_color=(0.3, 0.4, 0.5, 1),
+            font_size='12sp',
+            disabled=not self.instant_audio.available
+        )
+        instant_btn.bind(on_release=self.toggle_instant_mode)
+        playback_layout.add_widget(instant_btn)
+        
+        probe_btn = Button(
+            text=f"Probe: {'On' if self.latency_probe.enabled else 'Off'}",
+            background_color=(0.3, 0.4, 0.5, 1),
+            font_size='12sp'
+        )
+        probe_btn.bind(on_release=self.toggle_latency_probe)
+        playback_layout.add_widget(probe_btn)
+        
+        normalize_btn = Button(
+            text=f"Normalize: {'On' if self.sound_analyzer.enabled else 'Off'}",
+            background_color=(0.3, 0.4, 0.5, 1),
+            font_size='12sp'
+        )
+        normalize_btn.bind(on_release=self.toggle_normalize)
+        playback_layout.add_widget(normalize_btn)
+        
+        # Сжатие импортируемых звуков
+        import_layout = BoxLayout(size_hint_y=None, height=50, spacing=10)
+        transcode_btn = Button(
+            text=self.transcode_mode_text(),
+            background_color=(0.3, 0.4, 0.5, 1),
+            font_size='12sp',
+            disabled=self.transcoder.encoder() is None
+        )
+        transcode_btn.bind(on_release=self.cycle_transcode_mode)
+        import_layout.add_widget(transcode_btn)
+        
+        originals_btn = Button(
+            text=f"Keep originals: {'On' if self.transcoder.keep_original else 'Off'}",
+            background_color=(0.3, 0.4, 0.5, 1),
+            font_size='12sp',
+            disabled=self.transcoder.encoder() is None
+        )
+        originals_btn.bind(on_release=self.toggle_keep_originals)
+        import_layout.add_widget(originals_btn)
+        content.add_widget(import_layout)
+        content.add_widget(playback_layout)
+        
         github_btn = Button(
             text="GitHub", 
             background_color=(0.3, 0.3, 0.5, 1)
@@ -1651,6 +5621,8 @@ Debug Info:
 
     def clear_sound_cache(self):
         """Очищает кэш звуков"""
+        self.voice_pool.clear()
+        self.instant_audio.clear()
         self.sound_cache.clear_cache()
         self.show_info_popup("Cache Cleared", "Sound cache has been cleared")
 
@@ -1673,10 +5645,19 @@ Debug Info:
                     btn.collapse()
 
     def filter_buttons(self, *args):
-        """Фильтрует кнопки по поисковому запросу"""
-        value = self.search_input.text.lower()
+        """Фильтрует кнопки по поисковому запросу (через индекс, с учетом опечаток)"""
+        matches = self.search_index.matching_ids(self.search_input.text)
+        if self.virtual_list:
+            # В виртуальном списке фильтруется модель данных, а не виджеты
+            if matches is None:
+                self.scroll.set_entries(self.sound_entries)
+            else:
+                self.scroll.set_entries([entry for entry in self.sound_entries
+                                         if entry.sound_id in matches])
+            return
+        
         for btn_widget in self.buttons:
-            visible = value in btn_widget.btn_text.lower()
+            visible = matches is None or btn_widget.sound_id in matches
             btn_widget.opacity = 1 if visible else 0
             btn_widget.disabled = not visible
             btn_widget.height = 150 if visible else 0
@@ -1703,24 +5684,18 @@ Debug Info:
         close_btn.bind(on_release=popup.dismiss)
         popup.open()
 
-    def check_for_update(self):
-        """Проверяет обновления"""
+    def on_update_info(self, data):
+        """Получает результат фоновой проверки обновлений"""
         try:
-            print("Checking for updates...")
-            response = requests.get(self.UPDATE_URL, timeout=10)
-            if response.status_code == 200:
-                data = response.json()
-                latest_version = data.get('version', '')
-                
-                if latest_version and latest_version != self.CURRENT_VERSION:
-                    print(f"Update available: {latest_version}")
-                    download_url = data.get('download_url', '')
-                    changelog = data.get('changelog', '')
-                    self.show_update_popup(latest_version, download_url, changelog)
-                else:
-                    print("No updates available")
+            latest_version = str(data.get('version', ''))
+            
+            if latest_version and is_newer_version(latest_version, self.CURRENT_VERSION):
+                print(f"Update available: {latest_version}")
+                download_url = data.get('download_url', '')
+                changelog = data.get('changelog', '')
+                self.show_update_popup(latest_version, download_url, changelog)
             else:
-                print(f"Update check failed: {response.status_code}")
+                print("No updates available")
         except Exception as e:
             print(f"Update check error: {e}")
 
@@ -0,0 +1,62 @@
+"""Генерирует манифест встроенных звуков saved_sounds/sounds_manifest.json.
+
+Запускается при сборке, перед buildozer:
+    python make_sound_manifest.py [saved_sounds]
+
+Приложение читает манифест при старте и показывает встроенные звуки прямо
+из пакета, ничего не копируя. Дайджест совпадает с тем, что считает
+ContentIndex в main.py (blake2b, 16 байт), поэтому импорт того же файла
+распознается как уже существующий звук.
+"""
+import hashlib
+import json
+import os
+import sys
+
+MANIFEST_NAME = 'sounds_manifest.json'
+AUDIO_EXTENSIONS = ('.mp3', '.wav', '.ogg', '.m4a')
+ICON_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+def file_digest(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def build_manifest(directory):
+    filenames = sorted(os.listdir(directory))
+    icons = {}
+    for filename in filenames:
+        base, ext = os.path.splitext(filename)
+        ext = ext.lower()
+        if ext in ICON_EXTENSIONS:
+            current = icons.get(base)
+            if current is None or ICON_EXTENSIONS.index(ext) < \
+                    ICON_EXTENSIONS.index(os.path.splitext(current)[1].lower()):
+                icons[base] = filename
+
+    sounds = []
+    for filename in filenames:
+        base, ext = os.path.splitext(filename)
+        if ext.lower() not in AUDIO_EXTENSIONS:
+            continue
+        path = os.path.join(directory, filename)
+        sounds.append({
+            'file': filename,
+            'size': os.path.getsize(path),
+            'digest': file_digest(path),
+            'icon': icons.get(base)
+        })
+    return {'version': 1, 'sounds': sounds}
+
+
+if __name__ == '__main__':
+    directory = sys.argv[1] if len(sys.argv) > 1 else os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'saved_sounds')
+    manifest = build_manifest(directory)
+    with open(os.path.join(directory, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    print(f"Wrote {MANIFEST_NAME}: {len(manifest['sounds'])} sounds")
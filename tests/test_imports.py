@@ -0,0 +1,241 @@
+"""Загрузки с докачкой и импорт из потока - без сети и без Android:
+локальный HTTP-сервер вместо удаленного и поддельный InputStream."""
+import gzip
+import http.server
+import json
+import os
+import threading
+import time
+
+import pytest
+
+import main
+
+DATA = b'ID3' + bytes(range(256)) * 2048  # ~512 КБ, похоже на mp3
+
+
+class FakeApp:
+    """Ровно то, что нужно DownloadManager и FileImporter от MyApp"""
+    def __init__(self, save_dir):
+        self.save_dir = save_dir
+        self.http = main.create_http_session("MemeCloud/test", pool_size=2)
+        self.library_index = main.LibraryIndex(os.path.join(save_dir, 'library.db'))
+        self.sound_entries = []
+        self.bundled_sounds = main.BundledSounds(self)
+        self.content_index = main.ContentIndex(self)
+
+    def build_sound_entry(self, path):
+        return path
+
+
+class RangeHandler(http.server.BaseHTTPRequestHandler):
+    """Отдает DATA с ETag; Range выполняется, только если If-Range совпадает.
+    compress: None, 'negotiate' (gzip, если клиент согласен) или 'always'"""
+    protocol_version = 'HTTP/1.1'
+    etag = '"v1"'
+    compress = None
+    requests_seen = []
+    encodings_seen = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        range_header = self.headers.get('Range')
+        if_range = self.headers.get('If-Range')
+        self.requests_seen.append((range_header, if_range))
+        accept_encoding = self.headers.get('Accept-Encoding', '')
+        self.encodings_seen.append(accept_encoding)
+        if self.compress == 'always' or (self.compress == 'negotiate' and 'gzip' in accept_encoding):
+            body = gzip.compress(DATA)
+            self.send_response(200)
+            self.send_header('ETag', self.etag)
+            self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        start = 0
+        if range_header and (if_range is None or if_range == self.etag):
+            start = int(range_header.split('=')[1].rstrip('-'))
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{len(DATA) - 1}/{len(DATA)}')
+        else:
+            self.send_response(200)
+        self.send_header('ETag', self.etag)
+        self.send_header('Content-Length', str(len(DATA) - start))
+        self.end_headers()
+        self.wfile.write(DATA[start:])
+
+
+@pytest.fixture
+def server():
+    RangeHandler.requests_seen = []
+    RangeHandler.encodings_seen = []
+    RangeHandler.etag = '"v1"'
+    RangeHandler.compress = None
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{httpd.server_address[1]}'
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = FakeApp(str(tmp_path))
+    yield app
+    app.http.close()
+    app.library_index.close()
+
+
+def write_partial(manager, task, data, validator):
+    part_path, meta_path = manager.partial_paths(task)
+    os.makedirs(os.path.dirname(part_path), exist_ok=True)
+    with open(part_path, 'wb') as f:
+        f.write(data)
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump({'url': task.url, 'validator': validator, 'total': len(DATA)}, f)
+    return part_path
+
+
+def test_download_resumes_with_range(app, server):
+    manager = main.DownloadManager(app)
+    task = manager._create(server + '/meme.mp3', manager.unique_path('meme.mp3'))
+    part_path = write_partial(manager, task, DATA[:100000], '"v1"')
+    
+    manager._download(task)
+    
+    assert RangeHandler.requests_seen == [('bytes=100000-', '"v1"')]
+    with open(task.filepath, 'rb') as f:
+        assert f.read() == DATA
+    assert task.hasher.hexdigest() == main.hash_file(task.filepath)
+    assert not os.path.exists(part_path)
+
+
+def test_changed_file_restarts_from_zero(app, server):
+    manager = main.DownloadManager(app)
+    task = manager._create(server + '/meme.mp3', manager.unique_path('meme.mp3'))
+    write_partial(manager, task, b'stale bytes of an older version', '"v0"')
+    
+    manager._download(task)
+    
+    # If-Range не совпал - сервер ответил 200, старая часть не дописывается
+    assert RangeHandler.requests_seen == [('bytes=31-', '"v0"')]
+    with open(task.filepath, 'rb') as f:
+        assert f.read() == DATA
+
+
+def test_download_asks_for_uncompressed_body(app, server):
+    RangeHandler.compress = 'negotiate'
+    manager = main.DownloadManager(app)
+    task = manager._create(server + '/meme.mp3', manager.unique_path('meme.mp3'))
+    write_partial(manager, task, DATA[:100000], '"v1"')
+    
+    manager._download(task)
+    
+    # Range считается по байтам файла, поэтому сжатие не запрашивается
+    assert RangeHandler.encodings_seen == ['identity']
+    assert RangeHandler.requests_seen == [('bytes=100000-', '"v1"')]
+    with open(task.filepath, 'rb') as f:
+        assert f.read() == DATA
+
+
+def test_gzip_response_is_saved_decoded(app, server):
+    RangeHandler.compress = 'always'
+    manager = main.DownloadManager(app)
+    task = manager._create(server + '/meme.mp3', manager.unique_path('meme.mp3'))
+    
+    manager._download(task)
+    
+    # Content-Length сжатого ответа не считается длиной файла
+    with open(task.filepath, 'rb') as f:
+        assert f.read() == DATA
+    assert not os.path.exists(manager.partial_paths(task)[1])
+
+
+def test_same_url_tasks_use_separate_partial_files(app, server):
+    manager = main.DownloadManager(app)
+    url = server + '/meme.mp3'
+    first = manager._create(url, manager.unique_path('meme.mp3'))
+    second = manager._create(url, manager.unique_path('meme.mp3'))
+    
+    assert manager.partial_paths(first) != manager.partial_paths(second)
+    assert os.path.basename(second.filepath) == 'meme_1.mp3'
+
+
+def test_stale_partials_are_pruned(app):
+    manager = main.DownloadManager(app)
+    task = manager._create('http://example.com/kept.mp3', manager.unique_path('kept.mp3'))
+    task.status = 'failed'
+    partial_dir = os.path.join(app.save_dir, '.downloads')
+    os.makedirs(partial_dir)
+    old = time.time() - manager.PARTIAL_MAX_AGE - 60
+    names = {'abandoned': old, 'recent': time.time(), task.partial_key: old}
+    for key, mtime in names.items():
+        for ext in ('.part', '.json'):
+            path = os.path.join(partial_dir, key + ext)
+            open(path, 'wb').close()
+            os.utime(path, (mtime, mtime))
+    
+    manager._prune_partials(partial_dir, {task.partial_key})
+    
+    # Брошенная часть удалена, свежая и ожидающая повтора остались
+    assert sorted(os.listdir(partial_dir)) == sorted(
+        key + ext for key in ('recent', task.partial_key) for ext in ('.json', '.part'))
+
+
+def test_batch_file_names():
+    items = main.parse_import_list(json.dumps({'sounds': [
+        {'url': 'https://example.com/a/Bruh%20Sound.mp3'},
+        {'url': 'https://example.com/b/x.ogg', 'name': 'Manifest Name!'},
+        'https://example.com/stream?id=7',
+    ]}))
+    names = [main.import_filename(url, name) for url, name, icon in items]
+    assert names == ['Bruh Sound.mp3', 'Manifest Name_.ogg', 'stream.mp3']
+    assert main.parse_import_list("# list\nhttps://example.com/1.mp3\n\n") == \
+        [('https://example.com/1.mp3', None, None)]
+
+
+class FakeInputStream:
+    """Ведет себя как java.io.InputStream.read(byte[]): -1 в конце"""
+    def __init__(self, data, max_read=256 * 1024):
+        self.data = data
+        self.offset = 0
+        self.max_read = max_read
+        self.reads = 0
+        self.closed = False
+
+    def read(self, buffer):
+        self.reads += 1
+        if self.offset >= len(self.data):
+            return -1
+        size = min(len(buffer), self.max_read, len(self.data) - self.offset)
+        buffer[:size] = self.data[self.offset:self.offset + size]
+        self.offset += size
+        return size
+
+    def close(self):
+        self.closed = True
+
+
+def test_stream_import_copies_and_dedups(app):
+    importer = main.FileImporter(app)
+    stream = FakeInputStream(DATA)
+    source = main.JavaStreamSource(stream, name='picked.mp3', size=len(DATA))
+    
+    path = importer._import(source)
+    source.close()
+    
+    assert path == os.path.join(app.save_dir, 'picked.mp3')
+    with open(path, 'rb') as f:
+        assert f.read() == DATA
+    # Один вызов на заполненный буфер, а не на каждый байт или мелкий кусок
+    assert stream.reads == len(DATA) // stream.max_read + 2
+    assert stream.closed
+    assert importer.copied_bytes == len(DATA)
+    
+    again = main.JavaStreamSource(FakeInputStream(DATA), name='picked.mp3')
+    assert importer._import(again) is False
+    assert not os.path.exists(os.path.join(app.save_dir, 'picked_1.mp3'))
+    assert os.listdir(app.content_index.import_dir()) == []
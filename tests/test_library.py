@@ -0,0 +1,46 @@
+"""Порядок библиотеки: импортированные звуки встают туда же, куда их поставил бы скан."""
+import main
+
+
+class FakeLibraryApp:
+    """Ровно то, что нужно MyApp.add_sound_entries"""
+    def __init__(self, entries):
+        self.sound_entries = entries
+        self.submitted = []
+        self.sound_analyzer = self
+
+    def submit(self, entries):
+        self.submitted.extend(entries)
+
+    def apply_library_diff(self, entries, added, changed, removed):
+        self.sound_entries = entries
+
+
+def entry(filename):
+    return main.SoundEntry('/sounds/' + filename, filename)
+
+
+def names(entries):
+    return [e.name for e in entries]
+
+
+def test_imported_sound_lands_in_sorted_position():
+    app = FakeLibraryApp([entry('alpha.mp3'), entry('charlie.mp3'), entry('echo.mp3')])
+    added = main.MyApp.add_sound_entries(app, [entry('delta.mp3'), entry('bravo.mp3')])
+    assert names(added) == ['delta.mp3', 'bravo.mp3']
+    assert names(app.sound_entries) == ['alpha.mp3', 'bravo.mp3', 'charlie.mp3',
+                                        'delta.mp3', 'echo.mp3']
+    assert app.submitted == added
+
+
+def test_imported_order_matches_scan_order():
+    filenames = ['b.wav', 'A.mp3', 'a.ogg', 'z.mp3', '_x.mp3']
+    app = FakeLibraryApp([entry(f) for f in sorted(filenames[:2])])
+    main.MyApp.add_sound_entries(app, [entry(f) for f in filenames[2:]])
+    assert names(app.sound_entries) == sorted(filenames)
+
+
+def test_duplicate_sound_is_not_added():
+    app = FakeLibraryApp([entry('alpha.mp3')])
+    assert main.MyApp.add_sound_entries(app, [entry('alpha.mp3')]) == []
+    assert names(app.sound_entries) == ['alpha.mp3']
@@ -0,0 +1,89 @@
+"""Голоса VoicePool без аудиоустройства: поддельный звук с управляемой перемоткой."""
+from kivy.core.audio import Sound
+
+import main
+
+
+class FakeSound(Sound):
+    """Звук на 2 с; seekable=False ведет себя как SDL2-чанк, где seek ничего не делает"""
+    seekable = True
+
+    def __init__(self, **kwargs):
+        self.pos = 0.0
+        super().__init__(**kwargs)
+
+    def _get_length(self):
+        return 2.0
+
+    def play(self):
+        self.pos = 0.0
+        super().play()
+
+    def seek(self, position):
+        if self.seekable:
+            self.pos = position
+
+    def get_pos(self):
+        return self.pos
+
+
+def play(seekable, start, tail):
+    pool = main.VoicePool(main.PlaybackMonitor())
+    finished = []
+    sound = FakeSound(source='meme.mp3')
+    sound.seekable = seekable
+    pool.play(sound, 'meme.mp3', on_finished=finished.append, start=start, tail=tail)
+    return pool, finished
+
+
+def test_trailing_silence_stops_voice_early():
+    pool, finished = play(True, start=0.5, tail=0.25)
+    voice = pool.voices[0]
+    assert voice.stop_event.timeout == 1.25
+    
+    voice.stop_event.get_callback()(0)
+    assert pool.voices == []
+    assert finished == [voice.sound]
+
+
+def test_failed_seek_counts_from_the_beginning():
+    pool, finished = play(False, start=0.5, tail=0.25)
+    assert pool.voices[0].stop_event.timeout == 1.75
+
+
+def test_stopped_voice_cancels_scheduled_stop():
+    pool, finished = play(True, start=0.0, tail=0.25)
+    event = pool.voices[0].stop_event
+    pool.stop_all()
+    
+    assert not event.is_triggered
+    assert len(finished) == 1
+
+
+def test_no_tail_no_scheduled_stop():
+    pool, finished = play(True, start=0.5, tail=0.0)
+    assert pool.voices[0].stop_event is None
+
+
+def test_monitor_reports_natural_end_once():
+    monitor = main.PlaybackMonitor()
+    stopped = []
+    sound = FakeSound(source='meme.mp3')
+    sound.play()
+    monitor.watch(sound, stopped.append)
+    
+    sound.stop()
+    sound.stop()
+    assert stopped == [sound]
+    assert monitor.watched == {}
+
+
+def test_unwatched_sound_is_not_reported():
+    monitor = main.PlaybackMonitor()
+    stopped = []
+    sound = FakeSound(source='meme.mp3')
+    monitor.watch(sound, stopped.append)
+    monitor.unwatch(sound)
+    
+    sound.stop()
+    assert stopped == []
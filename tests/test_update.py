@@ -0,0 +1,78 @@
+"""Проверка обновлений: сравнение версий и какие ошибки повторяются."""
+import http.server
+import threading
+
+import pytest
+
+import main
+
+
+class StatusHandler(http.server.BaseHTTPRequestHandler):
+    """Отвечает статусом из очереди statuses; последний повторяется"""
+    protocol_version = 'HTTP/1.1'
+    statuses = []
+    hits = 0
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        type(self).hits += 1
+        status, body = self.statuses[min(self.hits, len(self.statuses)) - 1]
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeApp:
+    def __init__(self, save_dir):
+        self.save_dir = save_dir
+        self.http = main.create_http_session("MemeCloud/test")
+
+
+@pytest.fixture
+def checker(tmp_path):
+    StatusHandler.hits = 0
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StatusHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    app = FakeApp(str(tmp_path))
+    checker = main.UpdateChecker(app, f'http://127.0.0.1:{httpd.server_address[1]}/update.json')
+    checker.BACKOFF_BASE = 0.01
+    yield checker
+    app.http.close()
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def run_check(checker):
+    results = []
+    checker._run(results.append, True)
+    return results
+
+
+def test_version_order():
+    ordered = ['1.4.0-alpha9', '1.4.0-beta1', '1.4.0-rc2', '1.4.0rc10', '1.4', '1.4.1-rc1', '1.10']
+    for older, newer in zip(ordered, ordered[1:]):
+        assert main.is_newer_version(newer, older)
+        assert not main.is_newer_version(older, newer)
+    assert not main.is_newer_version('v1.4.0', '1.4')
+
+
+def test_client_error_is_not_retried(checker):
+    StatusHandler.statuses = [(404, b'missing')]
+    run_check(checker)
+    assert StatusHandler.hits == 1
+
+
+def test_malformed_body_is_not_retried(checker):
+    StatusHandler.statuses = [(200, b'<html>not json</html>')]
+    run_check(checker)
+    assert StatusHandler.hits == 1
+
+
+def test_server_error_is_retried(checker):
+    StatusHandler.statuses = [(503, b''), (502, b''), (200, b'{"version": "9.0"}')]
+    run_check(checker)
+    assert StatusHandler.hits == 3
+    assert checker.cache['data'] == {'version': '9.0'}